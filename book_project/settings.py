@@ -23,8 +23,99 @@ import dj_database_url
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-# Путь к папкам с файлами
-BOOKS_JSON_DIR = os.path.join(MEDIA_ROOT, 'books_json')
+# Путь к папкам с файлами (отдельный каталог — например, для бенчмарков)
+BOOKS_JSON_DIR = config('BOOKS_JSON_DIR', default=os.path.join(MEDIA_ROOT, 'books_json'))
+
+# Формат общего файла с книгами: 'jsonl' (журнал, дописывание в конец),
+# 'snapshot' (колоночный снимок через mmap + журнал новых книг)
+# или 'json' (старый all_books.json, перезапись целиком)
+BOOKS_FILE_BACKEND = config('BOOKS_FILE_BACKEND', default='jsonl')
+# Через сколько добавленных книг журнал уплотняется в фоне
+BOOKS_JSONL_COMPACT_EVERY = config('BOOKS_JSONL_COMPACT_EVERY', default=1000, cast=int)
+# Поля, по которым книга в файле считается дубликатом
+# (сравнение без учёта регистра и лишних пробелов)
+BOOKS_DUPLICATE_KEY = config('BOOKS_DUPLICATE_KEY', default='title,author', cast=Csv())
+# Сколько секунд воркер может держать разобранный каталог в памяти
+# (0 — без ограничения, только проверка stat() файла)
+BOOKS_FILE_CACHE_MAX_AGE = config('BOOKS_FILE_CACHE_MAX_AGE', default=300, cast=int)
+
+# Сколько недавних запросов к файловому каталогу хранить в LRU поиска
+BOOKS_SEARCH_CACHE_SIZE = config('BOOKS_SEARCH_CACHE_SIZE', default=64, cast=int)
+
+# Размер страницы списка книг и поиска (?limit= не может превысить максимум)
+BOOKS_PAGE_SIZE = config('BOOKS_PAGE_SIZE', default=50, cast=int)
+BOOKS_MAX_PAGE_SIZE = config('BOOKS_MAX_PAGE_SIZE', default=500, cast=int)
+
+# Загрузка файлов: сколько ошибок по записям показывать пользователю
+# и сколько книг дописывать в общий файл за один раз
+BOOKS_UPLOAD_MAX_ERRORS = config('BOOKS_UPLOAD_MAX_ERRORS', default=100, cast=int)
+BOOKS_UPLOAD_BATCH_SIZE = config('BOOKS_UPLOAD_BATCH_SIZE', default=1000, cast=int)
+
+# Приём файла на странице загрузки (books.uploads): наибольший размер файла
+# в байтах и число книг в нём; сбрасывать ли соединение при отказе, не дочитывая
+# тело запроса. Со сбросом отвергнутый файл не занимает воркер до конца приёма,
+# но клиент может увидеть обрыв вместо страницы ошибки; False — дочитывать тело
+BOOKS_UPLOAD_MAX_BYTES = config('BOOKS_UPLOAD_MAX_BYTES', default=100 * 1024 * 1024, cast=int)
+BOOKS_UPLOAD_MAX_RECORDS = config('BOOKS_UPLOAD_MAX_RECORDS', default=1_000_000, cast=int)
+BOOKS_UPLOAD_RESET_ON_REJECT = config('BOOKS_UPLOAD_RESET_ON_REJECT', default=True, cast=bool)
+
+# Загрузка в базу: строк в одном bulk_create и строк в одной транзакции
+BOOKS_DB_BATCH_SIZE = config('BOOKS_DB_BATCH_SIZE', default=2000, cast=int)
+BOOKS_DB_TRANSACTION_SIZE = config('BOOKS_DB_TRANSACTION_SIZE', default=20000, cast=int)
+
+# Пакетное изменение и удаление: сколько элементов можно прислать одним запросом
+BOOKS_BATCH_MAX_ITEMS = config('BOOKS_BATCH_MAX_ITEMS', default=5000, cast=int)
+
+# Почти-дубликаты (books.dedupe): проверять ли загружаемые книги, длина n-граммы,
+# число полос LSH и значений в полосе, порог сходства Жаккара названий и авторов, сколько
+# кандидатов брать из одной полосы, сколько книг держать в отчёте
+# и через сколько секунд перестраивать индекс каталога целиком
+BOOKS_DEDUPE_ON_UPLOAD = config('BOOKS_DEDUPE_ON_UPLOAD', default=False, cast=bool)
+BOOKS_DEDUPE_NGRAM = config('BOOKS_DEDUPE_NGRAM', default=3, cast=int)
+BOOKS_DEDUPE_BANDS = config('BOOKS_DEDUPE_BANDS', default=6, cast=int)
+BOOKS_DEDUPE_ROWS = config('BOOKS_DEDUPE_ROWS', default=3, cast=int)
+BOOKS_DEDUPE_THRESHOLD = config('BOOKS_DEDUPE_THRESHOLD', default=0.7, cast=float)
+BOOKS_DEDUPE_AUTHOR_THRESHOLD = config('BOOKS_DEDUPE_AUTHOR_THRESHOLD', default=0.4, cast=float)
+BOOKS_DEDUPE_MAX_CANDIDATES = config('BOOKS_DEDUPE_MAX_CANDIDATES', default=200, cast=int)
+BOOKS_DEDUPE_REPORT_LIMIT = config('BOOKS_DEDUPE_REPORT_LIMIT', default=100, cast=int)
+BOOKS_DEDUPE_INDEX_MAX_AGE = config('BOOKS_DEDUPE_INDEX_MAX_AGE', default=3600, cast=int)
+
+# Фоновая загрузка: файл ставится в очередь, обработка — manage.py run_import_worker
+BOOKS_UPLOAD_ASYNC = config('BOOKS_UPLOAD_ASYNC', default=False, cast=bool)
+BOOKS_IMPORT_JOBS_DIR = os.path.join(MEDIA_ROOT, 'import_jobs')
+
+# Выгрузка каталога: сколько строк читать из базы за один запрос курсора
+BOOKS_EXPORT_CHUNK_SIZE = config('BOOKS_EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Кэш ответов index и search_books: 'locmem' (память процесса) или 'file'
+# (общий для всех воркеров каталог BOOKS_CACHE_LOCATION)
+BOOKS_CACHE_BACKEND = config('BOOKS_CACHE_BACKEND', default='locmem')
+BOOKS_CACHE_LOCATION = config('BOOKS_CACHE_LOCATION', default='/tmp/books_cache')
+# Сколько секунд хранить ответ (0 — не кэшировать, ETag и 304 остаются)
+BOOKS_VIEW_CACHE_TIMEOUT = config('BOOKS_VIEW_CACHE_TIMEOUT', default=300, cast=int)
+# Сколько секунд общий кэш перед приложением (микрокэш nginx) может отдавать
+# страницу списка без обращения к приложению: Cache-Control: s-maxage.
+# Браузеру всегда max-age=0 — он проверяет страницу по ETag
+BOOKS_PROXY_CACHE_SECONDS = config('BOOKS_PROXY_CACHE_SECONDS', default=1, cast=int)
+
+# Замеры запросов (время, база, файлы, шаблоны): /metrics для Prometheus
+# и заголовок Server-Timing. Выключено — middleware не подключается
+BOOKS_METRICS = config('BOOKS_METRICS', default=False, cast=bool)
+BOOKS_METRICS_SERVER_TIMING = config('BOOKS_METRICS_SERVER_TIMING', default=True, cast=bool)
+# Общий каталог итогов воркеров, чтобы /metrics суммировал все процессы
+# (пусто — только процесс, ответивший на запрос)
+BOOKS_METRICS_DIR = config('BOOKS_METRICS_DIR', default='')
+
+CACHES = {
+    'default': {
+        'BACKEND': {
+            'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+            'file': 'django.core.cache.backends.filebased.FileBasedCache',
+        }[BOOKS_CACHE_BACKEND],
+        'LOCATION': BOOKS_CACHE_LOCATION,
+        'TIMEOUT': BOOKS_VIEW_CACHE_TIMEOUT,
+    }
+}
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -59,6 +150,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.metrics.MetricsMiddleware',  # первым: время всей цепочки
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -97,11 +189,33 @@ WSGI_APPLICATION = 'book_project.wsgi.application'
 #         'NAME': BASE_DIR / 'db.sqlite3',
 #     }
 # }
+# Соединения с базой. CONN_MAX_AGE — сколько секунд соединение живёт между
+# запросами (0 — новое соединение на каждый запрос); health checks проверяют
+# старое соединение перед повторным использованием
+BOOKS_DB_CONN_MAX_AGE = config('BOOKS_DB_CONN_MAX_AGE', default=60, cast=int)
+BOOKS_DB_CONN_HEALTH_CHECKS = config('BOOKS_DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+# Пул соединений psycopg 3 (только PostgreSQL). Нужен под ASGI, где постоянные
+# соединения привязаны к потокам; включённый пул заменяет CONN_MAX_AGE
+BOOKS_DB_POOL = config('BOOKS_DB_POOL', default=False, cast=bool)
+BOOKS_DB_POOL_MIN_SIZE = config('BOOKS_DB_POOL_MIN_SIZE', default=2, cast=int)
+BOOKS_DB_POOL_MAX_SIZE = config('BOOKS_DB_POOL_MAX_SIZE', default=10, cast=int)
+# Сколько секунд запрос ждёт свободное соединение из пула
+BOOKS_DB_POOL_TIMEOUT = config('BOOKS_DB_POOL_TIMEOUT', default=10, cast=int)
+
 DATABASES = {
     'default': dj_database_url.config(
-        default=config('DATABASE_URL', default='sqlite:///db.sqlite3')
+        default=config('DATABASE_URL', default='sqlite:///db.sqlite3'),
+        conn_max_age=BOOKS_DB_CONN_MAX_AGE,
+        conn_health_checks=BOOKS_DB_CONN_HEALTH_CHECKS,
     )
 }
+if BOOKS_DB_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': BOOKS_DB_POOL_MIN_SIZE,
+        'max_size': BOOKS_DB_POOL_MAX_SIZE,
+        'timeout': BOOKS_DB_POOL_TIMEOUT,
+    }
 # # Для совместимости с Postgres
 # DATABASES['default']['OPTIONS'] = {
 #     'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
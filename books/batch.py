@@ -0,0 +1,191 @@
+"""
+Пакетное редактирование и удаление книг в базе одним запросом.
+
+Тело запроса (JSON):
+    {"update": [{"id": 1, "title": "...", "year": 1869, "author": "...",
+                 "genre": "...", "pages": "..."}, ...],
+     "delete": [2, 3],
+     "all_or_nothing": false}
+
+Каждое изменение проверяется BookForm, дубликаты ищутся одним запросом
+по всем затронутым названиям и id, а запись — один
+DELETE ... WHERE id IN (...) и затем bulk_update в одной транзакции.
+В ответе — результат по каждому элементу в порядке запроса (сначала
+update, потом delete).
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .caching import bump_catalogue_version
+from .forms import BookForm
+from .models import Book
+
+EDIT_FIELDS = ['title', 'year', 'author', 'genre', 'pages']
+
+
+class BatchError(ValueError):
+    """Тело запроса не подходит под формат пакета целиком"""
+
+
+def form_errors(form):
+    return "; ".join(
+        error if field == '__all__' else f"{field}: {error}"
+        for field, errors in form.errors.items() for error in errors
+    )
+
+
+def parse_id(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError
+    pk = int(value)
+    if pk <= 0:
+        raise ValueError
+    return pk
+
+
+def parse_batch(payload):
+    """Проверяет структуру пакета; (изменения, удаления, all_or_nothing)"""
+    if not isinstance(payload, dict):
+        raise BatchError("Ожидается объект с полями update и delete")
+    updates = payload.get('update', [])
+    deletes = payload.get('delete', [])
+    if not isinstance(updates, list) or not isinstance(deletes, list):
+        raise BatchError("update и delete должны быть списками")
+    if len(updates) + len(deletes) > settings.BOOKS_BATCH_MAX_ITEMS:
+        raise BatchError(f"В пакете больше {settings.BOOKS_BATCH_MAX_ITEMS} элементов")
+    return updates, deletes, bool(payload.get('all_or_nothing'))
+
+
+def clean_update(item):
+    """(id, поля книги) из элемента update; ValueError с текстом ошибки"""
+    if not isinstance(item, dict):
+        raise ValueError("элемент должен быть объектом")
+    try:
+        pk = parse_id(item.get('id'))
+    except (TypeError, ValueError):
+        raise ValueError("нет корректного id")
+    form = BookForm({**{field: item.get(field) or '' for field in EDIT_FIELDS}, 'save_to': 'db'})
+    if not form.is_valid():
+        raise ValueError(f"Ошибка в форме: {form_errors(form)}")
+    data = form.cleaned_data
+    return pk, {
+        'title': data['title'].strip(),
+        'year': data['year'],
+        'author': (data.get('author') or '').strip() or None,
+        'genre': (data.get('genre') or '').strip() or None,
+        'pages': (data.get('pages') or '').strip() or None,
+    }
+
+
+def apply_batch(payload):
+    """
+    Применяет пакет; возвращает словарь ответа. Невалидные элементы
+    пропускаются (или, при all_or_nothing, отменяют весь пакет).
+    """
+    updates, deletes, all_or_nothing = parse_batch(payload)
+    results = []
+    changes = {}       # id -> (номер результата, новые поля)
+    delete_ids = {}    # id -> номер результата
+
+    for item in updates:
+        result = {'action': 'update', 'id': item.get('id') if isinstance(item, dict) else None}
+        results.append(result)
+        try:
+            pk, fields = clean_update(item)
+        except ValueError as e:
+            result.update(success=False, error=str(e))
+            continue
+        if pk in changes:
+            result.update(success=False, error="id уже встречается в пакете")
+            continue
+        result['id'] = pk
+        changes[pk] = (len(results) - 1, fields)
+
+    for value in deletes:
+        result = {'action': 'delete', 'id': value}
+        results.append(result)
+        try:
+            pk = parse_id(value)
+        except (TypeError, ValueError):
+            result.update(success=False, error="некорректный id")
+            continue
+        if pk in changes or pk in delete_ids:
+            result.update(success=False, error="id уже встречается в пакете")
+            continue
+        result['id'] = pk
+        delete_ids[pk] = len(results) - 1
+
+    # Одним запросом: сами книги пакета и все книги с затронутыми названиями
+    titles = {fields['title'] for _, fields in changes.values()}
+    rows = Book.objects.filter(
+        Q(id__in=list(changes) + list(delete_ids)) | Q(title__in=titles)
+    ).values_list('id', 'title', 'year', 'author')
+    existing = {pk: (title, year, author) for pk, title, year, author in rows}
+
+    # Какие (title, year) и (title, author) останутся заняты книгами вне пакета
+    taken_year, taken_author = set(), set()
+    for pk, (title, year, author) in existing.items():
+        if pk in changes or pk in delete_ids:
+            continue
+        taken_year.add((title, year))
+        taken_author.add((title, author))
+
+    for pk, index in list(delete_ids.items()):
+        if pk not in existing:
+            results[index].update(success=False, error="Книга не найдена")
+            del delete_ids[pk]
+
+    to_update = []
+    for pk, (index, fields) in list(changes.items()):
+        error = None
+        key_year = (fields['title'], fields['year'])
+        key_author = (fields['title'], fields['author'])
+        if pk not in existing:
+            error = "Книга не найдена"
+        elif key_year in taken_year:
+            error = f'Книга "{fields["title"]}" ({fields["year"]}) уже существует.'
+        elif key_author in taken_author:
+            error = f'Книга "{fields["title"]}" ({fields["author"] or "без автора"}) уже существует.'
+        if error:
+            results[index].update(success=False, error=error)
+            del changes[pk]
+            continue
+        # Следующие изменения пакета не могут занять те же ключи
+        taken_year.add(key_year)
+        taken_author.add(key_author)
+        to_update.append(Book(pk=pk, **fields))
+
+    failed = any(result.get('success') is False for result in results)
+    if all_or_nothing and failed:
+        for result in results:
+            if 'success' not in result:
+                result.update(success=False, error="Пакет отменён из-за ошибок в других элементах")
+        return {'success': False, 'updated': 0, 'deleted': 0, 'results': results}
+
+    try:
+        with transaction.atomic():
+            # Сначала удаление: ключи удаляемых книг может занять изменение
+            # из того же пакета (удалить X и переименовать Y в X)
+            deleted, _ = Book.objects.filter(id__in=list(delete_ids)).delete()
+            Book.objects.bulk_update(to_update, EDIT_FIELDS, batch_size=settings.BOOKS_DB_BATCH_SIZE)
+    except IntegrityError as e:
+        # Например, книги пакета обмениваются названиями: порядок строк
+        # в UPDATE нарушает ограничение, хотя итог был бы корректным
+        for result in results:
+            if 'success' not in result:
+                result.update(success=False, error=f"Пакет не записан: {e}")
+        return {'success': False, 'updated': 0, 'deleted': 0, 'results': results}
+
+    if to_update or deleted:
+        bump_catalogue_version()
+    for index, _ in changes.values():
+        results[index]['success'] = True
+    for index in delete_ids.values():
+        results[index]['success'] = True
+    return {
+        'success': not failed,
+        'updated': len(to_update),
+        'deleted': len(delete_ids),
+        'results': results,
+    }
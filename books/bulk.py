@@ -0,0 +1,137 @@
+"""
+Пакетная запись книг в базу данных.
+
+Книги пишутся через bulk_create пачками по BOOKS_DB_BATCH_SIZE строк,
+каждые BOOKS_DB_TRANSACTION_SIZE строк — в отдельной транзакции.
+Дубликаты определяются уникальным ограничением (title, author).
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .caching import bump_catalogue_version
+from .models import Book
+
+ON_CONFLICT_CHOICES = [
+    ('skip', 'Пропускать существующие'),
+    ('update', 'Обновлять существующие'),
+]
+
+UPDATE_FIELDS = ['year', 'genre', 'pages']
+
+
+def clean_text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def book_from_data(data):
+    """Book из словаря загруженного файла; ValueError, если поле не влезет в столбец"""
+    book = Book(
+        title=clean_text(data.get('title')),
+        year=int(data['year']),
+        author=clean_text(data.get('author')),
+        genre=clean_text(data.get('genre')),
+        pages=clean_text(data.get('pages')),
+    )
+    for field in ('title', 'author', 'genre', 'pages'):
+        value = getattr(book, field)
+        max_length = Book._meta.get_field(field).max_length
+        if value is not None and len(value) > max_length:
+            raise ValueError(f"поле '{field}' длиннее {max_length} символов")
+    return book
+
+
+def existing_keys(books):
+    """Какие (title, author) из пачки уже есть в таблице — одним запросом"""
+    titles = {book.title for book in books}
+    rows = Book.objects.filter(title__in=titles).values_list('title', 'author', 'id')
+    return {(title, author): pk for title, author, pk in rows}
+
+
+def write_batch(books, on_conflict, counts):
+    # Внутри пачки оставляем одну книгу на ключ: первую при пропуске,
+    # последнюю при обновлении
+    unique = {}
+    for book in books:
+        key = (book.title, book.author)
+        if key in unique:
+            counts['skipped'] += 1
+            if on_conflict == 'skip':
+                continue
+        unique[key] = book
+
+    # existing — все строки с теми же названиями; считаем только совпавшие ключи пачки
+    existing = existing_keys(unique.values())
+    matched = sum(key in existing for key in unique)
+    new_books = [book for key, book in unique.items() if key not in existing]
+
+    if on_conflict == 'update':
+        # NULL в author не срабатывает в уникальном ограничении, поэтому
+        # такие книги обновляем по найденному id
+        upsert, by_pk = list(new_books), []
+        for key, book in unique.items():
+            if key not in existing:
+                continue
+            if book.author is None:
+                book.pk = existing[key]
+                by_pk.append(book)
+            else:
+                upsert.append(book)
+        Book.objects.bulk_create(
+            upsert,
+            update_conflicts=True,
+            unique_fields=['title', 'author'],
+            update_fields=UPDATE_FIELDS,
+        )
+        Book.objects.bulk_update(by_pk, UPDATE_FIELDS)
+        counts['updated'] += matched
+    else:
+        # ignore_conflicts страхует от параллельной вставки того же ключа
+        Book.objects.bulk_create(new_books, ignore_conflicts=True)
+        counts['skipped'] += matched
+    counts['inserted'] += len(new_books)
+
+
+def import_books_to_db(books, report, on_conflict='skip', batch_size=None, transaction_size=None):
+    """
+    Записывает уже проверенные книги (словари) в базу пачками.
+    Книги, не подходящие под столбцы, учитываются в report как невалидные,
+    а failed считает строки из транзакций, которые не удалось записать.
+    Возвращает счётчики inserted / updated / skipped / failed.
+    """
+    batch_size = batch_size or settings.BOOKS_DB_BATCH_SIZE
+    transaction_size = transaction_size or settings.BOOKS_DB_TRANSACTION_SIZE
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+
+    books = iter(books)
+    while True:
+        rows = list(islice(books, transaction_size))
+        if not rows:
+            break
+        chunk = []
+        for data in rows:
+            try:
+                chunk.append(book_from_data(data))
+            except (ValueError, TypeError, KeyError) as e:
+                report.add_error(f"Книга '{str(data.get('title'))[:50]}': {e}")
+        if not chunk:
+            continue
+
+        chunk_counts = dict.fromkeys(counts, 0)
+        try:
+            with transaction.atomic():
+                for start in range(0, len(chunk), batch_size):
+                    write_batch(chunk[start:start + batch_size], on_conflict, chunk_counts)
+        except DatabaseError as e:
+            counts['failed'] += len(chunk)
+            report.note(f"Не удалось записать {len(chunk)} книг: {e}")
+        else:
+            for key, value in chunk_counts.items():
+                counts[key] += value
+            if chunk_counts['inserted'] or chunk_counts['updated']:
+                bump_catalogue_version()
+    return counts
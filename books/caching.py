@@ -0,0 +1,228 @@
+"""
+HTTP-кэширование index и search_books.
+
+Версия каталога — счётчик записей в таблицу книг (CatalogueVersion) для
+source=db и подпись общего файла (inode, размер, mtime) для source=file.
+Из версии строятся ETag и Last-Modified (ответ 304 без вызова представления),
+и она же входит в ключ кэша ответов: после записи старые ключи просто
+перестают читаться и вытесняются по таймауту.
+Общим кэшам (микрокэш nginx) Cache-Control разрешает хранить только
+страницы без сообщений и cookie, и лишь BOOKS_PROXY_CACHE_SECONDS секунд.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import F
+from django.middleware.csrf import CsrfViewMiddleware, get_token
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import decorator_from_middleware
+from django.views.decorators.http import condition
+
+from .models import CatalogueVersion
+from .utils import get_file_backend
+
+
+def bump_catalogue_version():
+    """Отмечает запись в таблицу книг; вызывать после каждого изменения"""
+    updated = CatalogueVersion.objects.filter(pk=1).update(
+        counter=F('counter') + 1, updated_at=timezone.now(),
+    )
+    if not updated:
+        CatalogueVersion.objects.get_or_create(pk=1, defaults={'counter': 1})
+
+
+async def abump_catalogue_version():
+    """bump_catalogue_version для асинхронных представлений"""
+    updated = await CatalogueVersion.objects.filter(pk=1).aupdate(
+        counter=F('counter') + 1, updated_at=timezone.now(),
+    )
+    if not updated:
+        await CatalogueVersion.objects.aget_or_create(pk=1, defaults={'counter': 1})
+
+
+def signature_mtime_ns(signature):
+    """Наибольший mtime из подписи файлового хранилища (у снимка их две)"""
+    if not signature:
+        return 0
+    if isinstance(signature[0], tuple) or signature[0] is None:
+        return max(signature_mtime_ns(part) for part in signature)
+    return signature[2]
+
+
+def db_version(row):
+    if row is None:
+        return 'db-0', None
+    return f"db-{row[0]}", row[1]
+
+
+def file_version():
+    signature = get_file_backend().signature()
+    mtime_ns = signature_mtime_ns(signature)
+    tag = hashlib.md5(repr(signature).encode('ascii')).hexdigest()[:16]
+    modified = datetime.fromtimestamp(mtime_ns / 1e9, dt_timezone.utc) if mtime_ns else None
+    return f"file-{tag}", modified
+
+
+def catalogue_version(source):
+    """(строка версии, время изменения) каталога из выбранного источника"""
+    if source == 'db':
+        return db_version(
+            CatalogueVersion.objects.filter(pk=1).values_list('counter', 'updated_at').first()
+        )
+    return file_version()
+
+
+async def acatalogue_version(source):
+    """catalogue_version без блокировки цикла событий"""
+    if source == 'db':
+        return db_version(
+            await CatalogueVersion.objects.filter(pk=1).values_list('counter', 'updated_at').afirst()
+        )
+    # stat() файлов каталога — в пуле потоков
+    return await sync_to_async(file_version, thread_sensitive=False)()
+
+
+def has_pending_messages(request):
+    """Есть ли сообщения для показа — такую страницу нельзя брать из кэша"""
+    return len(get_messages(request)) > 0
+
+
+def view_cache_key(view, version, request):
+    path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+    return f"books:view:{view.__name__}:{version[0]}:{path}"
+
+
+def is_cacheable(response, request):
+    # Сообщение могло появиться в самом представлении (ошибка каталога)
+    return (response.status_code == 200 and not response.cookies
+            and not has_pending_messages(request))
+
+
+def set_cache_control(response, cacheable):
+    """Cache-Control для общих кэшей: s-maxage у общих страниц, private у личных"""
+    if cacheable and settings.BOOKS_PROXY_CACHE_SECONDS > 0:
+        patch_cache_control(response, max_age=0, s_maxage=settings.BOOKS_PROXY_CACHE_SECONDS)
+    else:
+        patch_cache_control(response, private=True, max_age=0)
+    return response
+
+
+class _EnsureCsrfCookieOnce(CsrfViewMiddleware):
+    """
+    Как ensure_csrf_cookie, но cookie ставится, только если её ещё нет:
+    ensure_csrf_cookie обновляет её в каждом ответе, а ответ с Set-Cookie
+    общий кэш не сохраняет. Ответ, ставящий cookie, помечается private.
+    """
+
+    def _reject(self, request, reason):
+        return None
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        retval = super().process_view(request, callback, callback_args, callback_kwargs)
+        if 'CSRF_COOKIE' not in request.META:
+            get_token(request)
+        return retval
+
+    def process_response(self, request, response):
+        if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            patch_cache_control(response, private=True)
+        return super().process_response(request, response)
+
+
+ensure_csrf_cookie_once = decorator_from_middleware(_EnsureCsrfCookieOnce)
+
+
+def cached_catalogue_view(default_source):
+    """
+    ETag/Last-Modified, 304 и кэш ответа для представлений списка книг.
+    Ключ — версия каталога и полный путь запроса (source, q, limit, cursor).
+    Страницы с сообщениями и ответы, ставящие cookie, не кэшируются
+    и помечаются Cache-Control: private.
+    Работает и с синхронными, и с асинхронными представлениями.
+    """
+    def use_version(request):
+        return request.method in ('GET', 'HEAD') and not has_pending_messages(request)
+
+    def get_version(request):
+        if not hasattr(request, '_catalogue_version'):
+            request._catalogue_version = None
+            if use_version(request):
+                source = request.GET.get('source', default_source)
+                request._catalogue_version = catalogue_version(source)
+        return request._catalogue_version
+
+    async def aget_version(request):
+        if not hasattr(request, '_catalogue_version'):
+            request._catalogue_version = None
+            # Сообщения лежат в сессии, а сессия читается синхронно
+            if await sync_to_async(use_version)(request):
+                source = request.GET.get('source', default_source)
+                request._catalogue_version = await acatalogue_version(source)
+        return request._catalogue_version
+
+    def etag(request, *args, **kwargs):
+        version = get_version(request)
+        return version[0] if version else None
+
+    def last_modified(request, *args, **kwargs):
+        version = get_version(request)
+        return version[1] if version else None
+
+    conditional = condition(etag_func=etag, last_modified_func=last_modified)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @conditional
+            @wraps(view)
+            async def cached(request, *args, **kwargs):
+                version = request._catalogue_version
+                if version is None:
+                    return set_cache_control(await view(request, *args, **kwargs), False)
+                key = view_cache_key(view, version, request)
+                response = None
+                if settings.BOOKS_VIEW_CACHE_TIMEOUT:
+                    response = await cache.aget(key)
+                if response is not None:
+                    return set_cache_control(response, True)
+                response = await view(request, *args, **kwargs)
+                cacheable = await sync_to_async(is_cacheable)(response, request)
+                if cacheable and settings.BOOKS_VIEW_CACHE_TIMEOUT:
+                    await cache.aset(key, response, settings.BOOKS_VIEW_CACHE_TIMEOUT)
+                return set_cache_control(response, cacheable)
+
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                # condition() вызывает etag() синхронно, поэтому версию
+                # (запрос к базе) получаем заранее
+                await aget_version(request)
+                return await cached(request, *args, **kwargs)
+
+            return wrapper
+
+        @conditional
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            version = get_version(request)
+            if version is None:
+                return set_cache_control(view(request, *args, **kwargs), False)
+            key = view_cache_key(view, version, request)
+            response = None
+            if settings.BOOKS_VIEW_CACHE_TIMEOUT:
+                response = cache.get(key)
+            if response is not None:
+                return set_cache_control(response, True)
+            response = view(request, *args, **kwargs)
+            cacheable = is_cacheable(response, request)
+            if cacheable and settings.BOOKS_VIEW_CACHE_TIMEOUT:
+                cache.set(key, response, settings.BOOKS_VIEW_CACHE_TIMEOUT)
+            return set_cache_control(response, cacheable)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,466 @@
+"""
+Поиск почти-дубликатов книг: без учёта регистра, пробелов, знаков
+препинания, диакритики и транслитерации («Война и мир» / «Voina i Mir»),
+с опечатками и разным написанием автора («Tolstoy» / «Толстой»).
+
+Сравнивать каждую загружаемую книгу с каждой книгой каталога —
+квадратичная работа, поэтому сравнение идёт в два шага:
+
+1. Блокировка. Название приводится к нормальному виду (normalize_text)
+   и режется на символьные n-граммы. Из n-грамм
+   строится сигнатура MinHash (one permutation hashing: одна хеш-функция,
+   n-грамма попадает в одну из bins ячеек, в ячейке — минимум), а
+   сигнатура — в bands полос по rows значений (LSH). Книги с совпавшей
+   хотя бы одной полосой — кандидаты. Чем более похожи наборы n-грамм, тем
+   вероятнее совпадение полосы: при сходстве 0.8 и 6×3 — около 97%.
+   Числа в названии («Том 2», «1984») входят в ключ каждой полосы:
+   книги с разными числами не похожи, сколько бы ни совпадало остальное.
+2. Проверка. У кандидатов считается точное сходство Жаккара n-грамм
+   названий (не ниже threshold) и авторов (не ниже author_threshold,
+   если автор указан у обеих книг; имена сравниваются и как инициалы).
+   Короткие названия сравниваются ещё и расстоянием Левенштейна: в них
+   одна опечатка меняет большую часть n-грамм. Автор сравнивается отдельно, иначе
+   у коротких названий он перевешивает: «Dune» и «Dune Messiah» одного
+   автора оказались бы похожи сильнее, чем «Dune» с «F. Herbert».
+
+Полосы каждой книги хранятся в отсортированных array('Q') — ключ
+полосы и номер книги в одном 64-битном числе, — поиск полосы — bisect.
+Это десятки мегабайт на миллион книг вместо словарей со списками.
+Новые книги копятся в небольшом словаре и вливаются в массивы пачкой.
+"""
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .models import Book
+from .utils import get_file_backend, normalize_key_part
+
+# Русская транслитерация — без различий систем: разницу вроде «iy» / «y»
+# сглаживают n-граммы
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+    'і': 'i', 'ї': 'i', 'є': 'e', 'ґ': 'g', 'ў': 'u',
+})
+
+NON_WORD = re.compile(r'[\W_]+')
+NUMBER = re.compile(r'\d+')
+
+# Номер книги — младшие POS_BITS бит упакованного значения полосы
+POS_BITS = 26
+MAX_SIZE = 1 << POS_BITS
+KEY_MASK = (1 << (64 - POS_BITS)) - 1
+POS_MASK = MAX_SIZE - 1
+EMPTY = 1 << 32
+# Сдвиг значения, занятого у соседней ячейки (densification)
+BORROW_OFFSET = 0x9E3779B1
+# До какой длины название сравнивается ещё и расстоянием Левенштейна
+SHORT_TITLE = 40
+# Разделитель названия и автора в хранимом тексте книги
+SEPARATOR = '\x1f'
+
+
+def normalize_text(value):
+    """Текст для сравнения: латиница без диакритики, буквы и цифры через один пробел"""
+    if value is None:
+        return ''
+    text = str(value).casefold().translate(TRANSLIT)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(NON_WORD.sub(' ', text).split())
+
+
+def title_numbers(text):
+    """Числа нормализованного названия — без совпадения чисел книги не похожи"""
+    return tuple(int(number) for number in NUMBER.findall(text))
+
+
+def shingles(text, size=None):
+    """Множество символьных n-грамм текста (с пробелами по краям)"""
+    size = size or settings.BOOKS_DEDUPE_NGRAM
+    padded = f" {text} "
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+
+def edit_similarity(a, b):
+    """1 − расстояние Левенштейна / длина большей строки"""
+    if len(a) < len(b):
+        a, b = b, a
+    if not a:
+        return 1.0
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return 1 - previous[-1] / len(a)
+
+
+def short_name(author):
+    """«lev tolstoi» → «l tolstoi»: инициалы вместо имён, фамилия последней"""
+    parts = author.split()
+    return ' '.join([part[0] for part in parts[:-1]] + parts[-1:])
+
+
+def author_similarity(a, b):
+    """
+    Сходство нормализованных авторов: n-граммы полного имени или, если
+    так выходит больше, имени с инициалами («Лев Толстой» и «Л. Толстой»)
+    """
+    score = similarity(shingles(a), shingles(b))
+    if score < 1.0:
+        score = max(score, similarity(shingles(short_name(a)), shingles(short_name(b))))
+    return score
+
+
+def similarity(a, b):
+    """Сходство Жаккара двух множеств n-грамм"""
+    if not a or not b:
+        return 0.0
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+def signature(text, bins, size=None):
+    """
+    MinHash-сигнатура нормализованного текста из bins значений за один
+    проход по его n-граммам (повторы n-грамм минимум не меняют, поэтому
+    множество не строится). Пустые ячейки занимают значение следующей
+    непустой со сдвигом, чтобы у коротких текстов сигнатуры тоже были сравнимы.
+    """
+    size = size or settings.BOOKS_DEDUPE_NGRAM
+    padded = f" {text} ".encode('utf-8')
+    values = [EMPTY] * bins
+    crc32 = zlib.crc32
+    for i in range(max(1, len(padded) - size + 1)):
+        h = crc32(padded[i:i + size])
+        cell = h % bins
+        value = h // bins
+        if value < values[cell]:
+            values[cell] = value
+    if EMPTY in values:
+        # Два круга справа налево: на втором каждая пустая ячейка знает
+        # ближайшую непустую справа (по кругу)
+        result = values[:]
+        source = None
+        for j in range(2 * bins - 1, -1, -1):
+            i = j % bins
+            if values[i] != EMPTY:
+                source = i
+            elif j < bins and source is not None:
+                result[i] = (values[source] + ((source - i) % bins) * BORROW_OFFSET) & 0xFFFFFFFF
+        values = result
+    return values
+
+
+class NearDuplicateIndex:
+    """
+    LSH-индекс книг для поиска почти-дубликатов.
+    Книга — ссылка (id в базе или None), исходные название, автор и год;
+    add() возвращает её номер в индексе.
+    """
+
+    def __init__(self, bands=None, rows=None, threshold=None, author_threshold=None,
+                 max_candidates=None):
+        self.bands = bands or settings.BOOKS_DEDUPE_BANDS
+        self.rows = rows or settings.BOOKS_DEDUPE_ROWS
+        self.bins = self.bands * self.rows
+        self.threshold = settings.BOOKS_DEDUPE_THRESHOLD if threshold is None else threshold
+        self.author_threshold = (
+            settings.BOOKS_DEDUPE_AUTHOR_THRESHOLD if author_threshold is None else author_threshold
+        )
+        self.max_candidates = max_candidates or settings.BOOKS_DEDUPE_MAX_CANDIDATES
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.refs = []
+        self.texts = []
+        self.years = []
+        self._tables = [array('Q') for _ in range(self.bands)]
+        self._pending = [{} for _ in range(self.bands)]
+        self._pending_size = 0
+
+    @property
+    def size(self):
+        return len(self.texts)
+
+    def band_keys(self, title):
+        """Ключи полос LSH нормализованного названия"""
+        values = signature(title, self.bins)
+        numbers = title_numbers(title)
+        rows = self.rows
+        return [hash((numbers, *values[i:i + rows])) & KEY_MASK for i in range(0, self.bins, rows)]
+
+    def _store(self, title, author, year, ref):
+        position = self.size
+        if position >= MAX_SIZE:
+            raise OverflowError(f"В индексе почти-дубликатов не больше {MAX_SIZE} книг")
+        self.refs.append(ref)
+        self.texts.append(f"{title}{SEPARATOR}{author or ''}")
+        self.years.append(year)
+        return position, self.band_keys(normalize_text(title))
+
+    def add(self, title, author, year=None, ref=None):
+        """Добавляет одну книгу; полосы ждут слияния в словаре, поиск их уже видит"""
+        position, keys = self._store(title, author, year, ref)
+        for pending, key in zip(self._pending, keys):
+            pending.setdefault(key, []).append(position)
+        self._pending_size += 1
+        if self._pending_size >= max(10_000, self.size // 10):
+            self.merge_pending()
+        return position
+
+    def extend(self, records):
+        """Добавляет много книг (ref, title, author, year) и сортирует полосы один раз"""
+        packed = [array('Q') for _ in range(self.bands)]
+        for ref, title, author, year in records:
+            position, keys = self._store(title, author, year, ref)
+            for values, key in zip(packed, keys):
+                values.append(key << POS_BITS | position)
+        for band, values in enumerate(packed):
+            self._merge(band, values)
+
+    def merge_pending(self):
+        if not self._pending_size:
+            return
+        for band, pending in enumerate(self._pending):
+            self._merge(band, [key << POS_BITS | position
+                               for key, positions in pending.items() for position in positions])
+            pending.clear()
+        self._pending_size = 0
+
+    def _merge(self, band, packed):
+        if packed:
+            # Массив уже отсортирован — timsort сольёт его с новой пачкой почти за линейное время
+            self._tables[band] = array('Q', sorted([*self._tables[band], *packed]))
+
+    def candidates(self, title):
+        """Номера книг, у которых совпала хотя бы одна полоса с нормализованным title"""
+        found = set()
+        for band, key in enumerate(self.band_keys(title)):
+            table = self._tables[band]
+            start = bisect_left(table, key << POS_BITS)
+            end = min(bisect_left(table, (key + 1) << POS_BITS), start + self.max_candidates)
+            found.update(table[i] & POS_MASK for i in range(start, end))
+            found.update(self._pending[band].get(key, ()))
+        return found
+
+    def book(self, position):
+        title, author = self.texts[position].split(SEPARATOR)
+        return {'title': title, 'author': author or None, 'year': self.years[position]}
+
+    def match(self, title, author, limit=3, exclude=None):
+        """
+        Похожие книги индекса, по убыванию сходства названий: словари
+        с title, author, year, score (названия), author_score (если автор
+        есть у обеих) и id (если ref задан). exclude — номер самой
+        книги в индексе, чтобы не находить её саму.
+        """
+        title = normalize_text(title)
+        grams = shingles(title)
+        numbers = title_numbers(title)
+        author = normalize_text(author)
+        matches = []
+        with self.lock:
+            for position in self.candidates(title):
+                if position == exclude:
+                    continue
+                book = self.book(position)
+                other_title = normalize_text(book['title'])
+                # Совпадение полосы могло быть случайным совпадением хешей
+                if title_numbers(other_title) != numbers:
+                    continue
+                score = similarity(grams, shingles(other_title))
+                if score < self.threshold and max(len(title), len(other_title)) <= SHORT_TITLE:
+                    # В коротком названии одна опечатка задевает большую часть n-грамм
+                    score = max(score, edit_similarity(title, other_title))
+                if score < self.threshold:
+                    continue
+                other_author = normalize_text(book['author'])
+                if author and other_author:
+                    author_score = author_similarity(author, other_author)
+                    if author_score < self.author_threshold:
+                        continue
+                    book['author_score'] = round(author_score, 3)
+                book['score'] = round(score, 3)
+                book['position'] = position
+                if self.refs[position] is not None:
+                    book['id'] = self.refs[position]
+                matches.append(book)
+        matches.sort(key=lambda book: -book['score'])
+        return matches[:limit]
+
+
+class CatalogueNearDuplicateIndex(NearDuplicateIndex):
+    """
+    Индекс всего каталога из выбранного источника. Догоняет каталог,
+    как DuplicateIndex: файл — через backend.read_since(), база — новыми
+    строками с id больше последнего. Удалённые и изменённые в базе книги
+    замечаются полной перестройкой раз в BOOKS_DEDUPE_INDEX_MAX_AGE секунд
+    (и сразу, если книг стало меньше).
+    """
+
+    def __init__(self, source, **kwargs):
+        super().__init__(**kwargs)
+        self.source = source
+        self.max_age = settings.BOOKS_DEDUPE_INDEX_MAX_AGE
+        self.built_at = None
+        self._cursor = None
+        self._last_id = 0
+        self.backend = get_file_backend() if source == 'file' else None
+
+    def refresh(self):
+        with self.lock:
+            if self.built_at is None or time.monotonic() - self.built_at > self.max_age:
+                self.clear()
+                self._cursor = None
+                self._last_id = 0
+                self.built_at = time.monotonic()
+            if self.source == 'db':
+                self._refresh_db()
+            else:
+                self._refresh_file()
+        return self
+
+    def _refresh_file(self):
+        books, self._cursor, full = self.backend.read_since(self._cursor)
+        if full:
+            self.clear()
+        self.extend((None, book.get('title'), book.get('author'), book.get('year')) for book in books)
+
+    def _refresh_db(self):
+        if self.size and Book.objects.count() < self.size:
+            self.clear()
+            self._last_id = 0
+        rows = (
+            Book.objects.filter(id__gt=self._last_id).order_by('id')
+            .values_list('id', 'title', 'author', 'year')
+            .iterator(chunk_size=settings.BOOKS_EXPORT_CHUNK_SIZE)
+        )
+        self.extend(rows)
+        if self.refs:
+            self._last_id = self.refs[-1]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_near_duplicate_index(source):
+    """Индекс каталога source ('file' или 'db'), общий для процесса и догнанный до каталога"""
+    source = 'db' if source == 'db' else 'file'
+    with _indexes_lock:
+        index = _indexes.get(source)
+        if index is None:
+            index = _indexes[source] = CatalogueNearDuplicateIndex(source)
+    return index.refresh()
+
+
+def same_key(book, match):
+    """Точный дубликат по правилу хранилищ — его и так пропустит загрузка"""
+    return (normalize_key_part(book.get('title')), normalize_key_part(book.get('author'))) == (
+        normalize_key_part(match['title']), normalize_key_part(match['author'])
+    )
+
+
+class NearDuplicateReport:
+    """
+    Почти-дубликаты загружаемых книг для просмотра: с чем в каталоге
+    и с какими книгами той же загрузки совпала книга. Сохраняются
+    первые limit книг, flagged считает все.
+    """
+
+    def __init__(self, index, limit=None):
+        self.index = index
+        self.limit = settings.BOOKS_DEDUPE_REPORT_LIMIT if limit is None else limit
+        self.batch = NearDuplicateIndex(
+            bands=index.bands, rows=index.rows, threshold=index.threshold,
+            author_threshold=index.author_threshold, max_candidates=index.max_candidates,
+        )
+        self.checked = 0
+        self.flagged = 0
+        self.items = []
+
+    def check(self, book, line=None):
+        """Проверяет книгу загрузки; True, если у неё нашлись почти-дубликаты"""
+        title, author = book.get('title'), book.get('author')
+        self.checked += 1
+        line = self.checked if line is None else line
+        matches = [match for match in self.index.match(title, author) if not same_key(book, match)]
+        in_batch = [match for match in self.batch.match(title, author) if not same_key(book, match)]
+        self.batch.add(title, author, book.get('year'), line)
+        if not matches and not in_batch:
+            return False
+        self.flagged += 1
+        if len(self.items) < self.limit:
+            for match in in_batch:
+                match['line'] = match.pop('id')
+            self.items.append({
+                'line': line,
+                'book': {'title': title, 'author': author, 'year': book.get('year')},
+                'catalogue': [self.public(match) for match in matches],
+                'upload': [self.public(match) for match in in_batch],
+            })
+        return True
+
+    @staticmethod
+    def public(match):
+        match.pop('position', None)
+        return match
+
+    def as_dict(self):
+        return {
+            'checked': self.checked,
+            'flagged': self.flagged,
+            'truncated': self.flagged > len(self.items),
+            'items': self.items,
+        }
+
+
+def flag_near_duplicates(books, report, upload_report=None):
+    """
+    Пропускает книги дальше без изменений, отмечая почти-дубликаты в report.
+    upload_report (UploadReport проверки) даёт номер книги в файле с учётом невалидных.
+    """
+    for book in books:
+        report.check(book, upload_report.total if upload_report else None)
+        yield book
+
+
+def scan_catalogue(index, limit=None):
+    """
+    Пары почти-дубликатов внутри самого каталога: каждая книга ищет
+    похожие среди книг индекса с меньшим номером, поэтому пара
+    попадает в отчёт один раз. Возвращает (число пар, первые limit групп).
+    """
+    limit = settings.BOOKS_DEDUPE_REPORT_LIMIT if limit is None else limit
+    pairs = 0
+    groups = []
+    for position in range(index.size):
+        book = index.book(position)
+        matches = [
+            match for match in index.match(book['title'], book['author'], exclude=position)
+            if match['position'] < position
+        ]
+        if not matches:
+            continue
+        pairs += len(matches)
+        if len(groups) < limit:
+            if index.refs[position] is not None:
+                book['id'] = index.refs[position]
+            groups.append({'book': book, 'matches': [NearDuplicateReport.public(m) for m in matches]})
+    return pairs, groups
@@ -0,0 +1,117 @@
+"""
+Потоковая выгрузка каталога в CSV и JSON Lines (по желанию — в gzip).
+
+Книги читаются по одной через BookRepository.iter_rows(): из базы —
+iterator(chunk_size=...), из файла — backend.iter_books() (журнал
+построчно, снимок из mmap). Строки копятся в буфер около BUFFER_SIZE байт
+и отдаются кусками, поэтому память не зависит от размера каталога,
+а первый кусок уходит сразу после первых книг.
+
+export_stream() — синхронный итератор для WSGI. Под ASGI Django собрал бы
+его целиком в список (sync_to_async(list)), поэтому там отдаётся
+aexport_stream(): строки из BookRepository.aiter_rows() — aiterator()
+из базы и чтение файла кусками в пуле потоков.
+"""
+import csv
+import json
+import zlib
+
+from .repository import get_repository
+
+BUFFER_SIZE = 64 * 1024
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class LineBuffer:
+    """Файлоподобный приёмник для csv.writer: write() возвращает строку как есть"""
+
+    def write(self, value):
+        return value
+
+
+def line_format(fields, export_format):
+    """(заголовок — строка, возможно пустая; функция: кортеж значений → строка)"""
+    if export_format == 'csv':
+        writer = csv.writer(LineBuffer())
+
+        def csv_line(row):
+            return writer.writerow(['' if value is None else value for value in row])
+
+        return writer.writerow(fields), csv_line
+
+    def jsonl_line(row):
+        return json.dumps(dict(zip(fields, row)), ensure_ascii=False) + '\n'
+
+    return '', jsonl_line
+
+
+class Chunks:
+    """
+    Склеивает строки в куски байтов около size (первый — сразу) и по желанию
+    сжимает их gzip. add() возвращает готовый кусок или b'', close() — остаток.
+    """
+
+    def __init__(self, compress=False, size=BUFFER_SIZE):
+        self.size = size
+        self.parts, self.length, self.first = [], 0, True
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    def add(self, line):
+        self.parts.append(line)
+        self.length += len(line)
+        if self.first or self.length >= self.size:
+            return self._take()
+        return b''
+
+    def close(self):
+        data = self._take() if self.parts else b''
+        if self.compressor is not None:
+            data += self.compressor.flush()
+        return data
+
+    def _take(self):
+        data = ''.join(self.parts).encode('utf-8')
+        self.parts, self.length = [], 0
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+            if self.first:
+                # Иначе zlib придержит начало до заполнения своего буфера
+                data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.first = False
+        return data
+
+
+def export_stream(source, export_format, compress=False):
+    """Итератор кусков байтов выгрузки каталога из source ('file' или 'db')"""
+    repository = get_repository(source)
+    header, line = line_format(repository.fields, export_format)
+    chunks = Chunks(compress)
+    if header:
+        yield chunks.add(header)
+    for row in repository.iter_rows():
+        data = chunks.add(line(row))
+        if data:
+            yield data
+    data = chunks.close()
+    if data:
+        yield data
+
+
+async def aexport_stream(source, export_format, compress=False):
+    """То же асинхронным итератором — для ответа под ASGI"""
+    repository = get_repository(source)
+    header, line = line_format(repository.fields, export_format)
+    chunks = Chunks(compress)
+    if header:
+        yield chunks.add(header)
+    async for row in repository.aiter_rows():
+        data = chunks.add(line(row))
+        if data:
+            yield data
+    data = chunks.close()
+    if data:
+        yield data
@@ -0,0 +1,173 @@
+"""
+Очередь фоновых загрузок без внешнего брокера.
+
+Задания хранятся в таблице ImportJob, загруженный файл — в
+settings.BOOKS_IMPORT_JOBS_DIR. Команда run_import_worker забирает задания
+условным UPDATE ... WHERE status='queued' (работает на любой СУБД, в том
+числе SQLite) и обновляет прогресс по мере чтения файла.
+"""
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .dedupe import NearDuplicateReport, flag_near_duplicates, get_near_duplicate_index
+from .models import ImportJob
+from .repository import get_repository
+from .utils import UploadReport, iter_json_records, validate_books_stream
+
+
+def run_import(open_chunks, save_to='file', on_conflict='skip', partial=False,
+               check_near_duplicates=None):
+    """
+    Проверяет и сохраняет книги из JSON.
+    open_chunks() каждый раз возвращает новый итератор кусков файла:
+    в строгом режиме файл читается дважды — сначала только проверка.
+    С check_near_duplicates (по умолчанию settings.BOOKS_DEDUPE_ON_UPLOAD)
+    книги по пути в хранилище сверяются с индексом почти-дубликатов,
+    итог — в report.near_duplicates.
+    Возвращает (отчёт, счётчики или None, если загрузка отменена).
+    """
+    if check_near_duplicates is None:
+        check_near_duplicates = settings.BOOKS_DEDUPE_ON_UPLOAD
+
+    def import_books(report):
+        books = validate_books_stream(iter_json_records(open_chunks(), report), report)
+        if check_near_duplicates:
+            # Индекс догоняется до записи: книги этой загрузки сверяются друг
+            # с другом отдельно, в самом отчёте
+            report.near_duplicates = NearDuplicateReport(get_near_duplicate_index(save_to))
+            books = flag_near_duplicates(books, report.near_duplicates, report)
+        repository = get_repository(save_to)
+        if on_conflict == 'update':
+            return repository.upsert(books, report)
+        return repository.bulk_insert(books, report)
+
+    report = UploadReport()
+    if partial:
+        counts = import_books(report)
+    else:
+        # Первый проход только проверяет файл, ничего не сохраняя
+        for _ in validate_books_stream(iter_json_records(open_chunks(), report), report):
+            pass
+        if not report.ok:
+            return report, None
+        # Второй проход пишет книги; отчёт заново, чтобы не считать их дважды
+        report = UploadReport()
+        counts = import_books(report)
+
+    counts['failed'] += report.invalid
+    return report, counts
+
+
+def enqueue_upload(uploaded_file, save_to='file', on_conflict='skip', partial=False,
+                   check_near_duplicates=False):
+    """Сохраняет загруженный файл и ставит задание в очередь"""
+    os.makedirs(settings.BOOKS_IMPORT_JOBS_DIR, exist_ok=True)
+    payload_path = os.path.join(settings.BOOKS_IMPORT_JOBS_DIR, f"{uuid.uuid4().hex}.json")
+    size = 0
+    with open(payload_path, 'wb') as dest:
+        for chunk in uploaded_file.chunks():
+            dest.write(chunk)
+            size += len(chunk)
+    return ImportJob.objects.create(
+        file_name=uploaded_file.name,
+        payload_path=payload_path,
+        save_to=save_to,
+        on_conflict=on_conflict,
+        partial=partial,
+        check_near_duplicates=check_near_duplicates,
+        bytes_total=size,
+    )
+
+
+def claim_next_job():
+    """Забирает самое старое задание из очереди; None, если очередь пуста"""
+    for job in ImportJob.objects.filter(status=ImportJob.STATUS_QUEUED).order_by('created_at')[:10]:
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=job.pk, status=ImportJob.STATUS_QUEUED).update(
+            status=ImportJob.STATUS_RUNNING, started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def requeue_stale_jobs(stale_after):
+    """Возвращает в очередь задания, воркер которых перестал отмечаться"""
+    deadline = timezone.now() - timedelta(seconds=stale_after)
+    return ImportJob.objects.filter(
+        status=ImportJob.STATUS_RUNNING, heartbeat_at__lt=deadline,
+    ).update(status=ImportJob.STATUS_QUEUED, bytes_read=0)
+
+
+def job_chunks(job, chunk_size=64 * 1024, report_every=1.0):
+    """Читает файл задания кусками и раз в report_every секунд сохраняет прогресс"""
+    read = 0
+    last_report = time.monotonic()
+    with open(job.payload_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            read += len(chunk)
+            now = time.monotonic()
+            if now - last_report >= report_every:
+                last_report = now
+                ImportJob.objects.filter(pk=job.pk).update(
+                    bytes_read=read, heartbeat_at=timezone.now(),
+                )
+            yield chunk
+
+
+def process_job(job):
+    """Выполняет задание и записывает итог; файл задания после этого удаляется"""
+    try:
+        report, counts = run_import(
+            lambda: job_chunks(job), job.save_to, job.on_conflict, job.partial,
+            job.check_near_duplicates or None,
+        )
+    except Exception as e:
+        job.status = ImportJob.STATUS_FAILED
+        job.error = str(e)
+    else:
+        job.processed = report.total
+        job.errors = report.errors
+        job.error = report.fatal or ''
+        if report.near_duplicates is not None:
+            job.near_duplicates = report.near_duplicates.as_dict()
+        if counts is None:
+            job.status = ImportJob.STATUS_FAILED
+            job.error = f"Загрузка отменена. {report.first_error()}"
+        else:
+            job.status = ImportJob.STATUS_DONE
+            for key in ('inserted', 'updated', 'skipped', 'failed'):
+                setattr(job, key, counts[key])
+    job.bytes_read = job.bytes_total
+    job.finished_at = timezone.now()
+    job.save()
+    if os.path.exists(job.payload_path):
+        os.remove(job.payload_path)
+    return job
+
+
+def job_status(job):
+    """Состояние задания для JSON-ответа"""
+    return {
+        'id': str(job.id),
+        'status': job.status,
+        'file_name': job.file_name,
+        'progress': job.progress,
+        'processed': job.processed,
+        'inserted': job.inserted,
+        'updated': job.updated,
+        'skipped': job.skipped,
+        'failed': job.failed,
+        'errors': job.errors,
+        'near_duplicates': job.near_duplicates,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
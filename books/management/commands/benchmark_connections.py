@@ -0,0 +1,95 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+from books.models import CatalogueVersion
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def pool_available():
+    if connection.vendor != 'postgresql':
+        return False
+    try:
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def configure(max_age, health_checks, pool=None):
+    """Переключает настройки соединения default; старое соединение закрывается"""
+    connection.close()
+    connection.settings_dict['CONN_MAX_AGE'] = max_age
+    connection.settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+    options = connection.settings_dict.setdefault('OPTIONS', {})
+    if pool:
+        options['pool'] = pool
+    else:
+        options.pop('pool', None)
+
+
+def simulate_requests(count):
+    """
+    Цикл «запрос — ответ» как в представлении: сигналы request_started и
+    request_finished закрывают или оставляют соединение по CONN_MAX_AGE,
+    в середине — запрос версии каталога, который делает каждая страница.
+    """
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        request_started.send(sender=None)
+        CatalogueVersion.objects.filter(pk=1).values_list('counter', flat=True).first()
+        request_finished.send(sender=None)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает стоимость запроса к базе при новом соединении на каждый "
+        "запрос, постоянных соединениях (CONN_MAX_AGE, health checks) и пуле psycopg"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--max-age', type=int, default=60,
+                            help="CONN_MAX_AGE для режимов с постоянным соединением")
+
+    def handle(self, *args, **options):
+        saved = dict(connection.settings_dict)
+        saved_options = dict(saved.get('OPTIONS', {}))
+        modes = [
+            ('новое соединение (CONN_MAX_AGE=0)', 0, False, None),
+            (f"постоянное (CONN_MAX_AGE={options['max_age']})", options['max_age'], False, None),
+            ('постоянное + health checks', options['max_age'], True, None),
+        ]
+        if pool_available():
+            modes.append(('пул psycopg', 0, False, {'min_size': 1, 'max_size': 2}))
+        else:
+            self.stdout.write("Пул не проверяется: нужен PostgreSQL и psycopg[pool].")
+
+        self.stdout.write(f"База: {connection.vendor}, запросов на режим: {options['requests']}")
+        try:
+            for name, max_age, health_checks, pool in modes:
+                configure(max_age, health_checks, pool)
+                simulate_requests(10)  # прогрев
+                timings = simulate_requests(options['requests'])
+                total = sum(timings) / 1000
+                self.stdout.write(
+                    f"{name:<40} {options['requests'] / total:8.0f} запр/с  "
+                    f"p50={statistics.median(timings):.3f} мс  p95={percentile(timings, 95):.3f} мс"
+                )
+                if pool:
+                    connection.close_pool()
+        finally:
+            connection.close()
+            connection.settings_dict.update(saved)
+            connection.settings_dict['OPTIONS'] = saved_options
@@ -0,0 +1,169 @@
+import json
+import random
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.dedupe import (
+    TRANSLIT, NearDuplicateIndex, normalize_text, shingles, similarity, title_numbers,
+)
+from books.synthetic import generate_books
+
+
+def typo(text, rng):
+    """Одна опечатка в слове без цифр: пропуск, удвоение или перестановка букв"""
+    words = text.split(' ')
+    candidates = [i for i, word in enumerate(words) if len(word) > 3 and not any(c.isdigit() for c in word)]
+    if not candidates:
+        return text
+    i = rng.choice(candidates)
+    word = words[i]
+    at = rng.randrange(1, len(word) - 1)
+    kind = rng.random()
+    if kind < 0.34:
+        word = word[:at] + word[at + 1:]
+    elif kind < 0.67:
+        word = word[:at] + word[at] + word[at:]
+    else:
+        word = word[:at - 1] + word[at] + word[at - 1] + word[at + 1:]
+    words[i] = word
+    return ' '.join(words)
+
+
+def initials(author):
+    parts = (author or '').split()
+    if len(parts) < 2:
+        return author
+    return f"{parts[0][0]}. {' '.join(parts[1:])}"
+
+
+def variant(book, rng):
+    """«Грязная» копия книги: регистр, пробелы, транслитерация, опечатка, инициалы"""
+    title, author = book['title'], book['author']
+    changes = rng.sample(['case', 'spaces', 'translit', 'typo', 'initials'], rng.randint(1, 3))
+    if 'translit' in changes:
+        title = title.lower().translate(TRANSLIT)
+        author = author.lower().translate(TRANSLIT)
+    if 'case' in changes:
+        title = title.upper()
+    if 'spaces' in changes:
+        title = f"  {title.replace(' ', '  ')}!"
+    if 'typo' in changes:
+        title = typo(title, rng)
+    if 'initials' in changes:
+        author = initials(author)
+    return {'title': title, 'author': author, 'year': book['year']}, changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарк поиска почти-дубликатов на синтетическом каталоге в памяти: "
+        "время и память построения индекса, скорость проверки книг, полнота на "
+        "«грязных» копиях книг каталога, ложные срабатывания на новых книгах "
+        "и сравнение с полным перебором."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help="Книг в каталоге")
+        parser.add_argument('--queries', type=int, default=10_000,
+                            help="Проверяемых книг: половина — копии книг каталога, половина — новые")
+        parser.add_argument('--brute-force', type=int, default=3,
+                            help="Сколько книг проверить полным перебором для сравнения")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help="Файл результатов JSON")
+
+    def handle(self, *args, **options):
+        rows, queries = options['rows'], options['queries']
+        if rows <= 0 or queries <= 0:
+            raise CommandError("--rows и --queries должны быть больше нуля")
+        rng = random.Random(options['seed'])
+        sample = set(rng.sample(range(rows), min(rows, queries // 2)))
+        originals = {}
+
+        def records():
+            for position, book in enumerate(generate_books(rows, seed=options['seed'])):
+                if position in sample:
+                    originals[position] = book
+                yield position, book['title'], book['author'], book['year']
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        index = NearDuplicateIndex()
+        started = time.perf_counter()
+        index.extend(records())
+        build_seconds = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(
+            f"Индекс: {rows} книг за {build_seconds:.1f} с ({rows / build_seconds:,.0f} книг/с), "
+            f"пик памяти +{(rss_after - rss_before) / 1024:.0f} МБ"
+        )
+
+        checks = []
+        for position, book in originals.items():
+            dirty, changes = variant(book, rng)
+            checks.append((dirty, position, changes))
+        for book in generate_books(queries - len(checks), seed=options['seed'] + 1, start=rows):
+            checks.append((book, None, []))
+        rng.shuffle(checks)
+
+        found = missed = false_positives = candidates = 0
+        missed_by_change = {}
+        query_seconds = 0.0
+        for book, position, changes in checks:
+            candidates += len(index.candidates(normalize_text(book['title'])))
+            started = time.perf_counter()
+            matches = index.match(book['title'], book['author'])
+            query_seconds += time.perf_counter() - started
+            if position is None:
+                false_positives += bool(matches)
+            elif any(match['id'] == position for match in matches):
+                found += 1
+            else:
+                missed += 1
+                for change in changes:
+                    missed_by_change[change] = missed_by_change.get(change, 0) + 1
+
+        brute_seconds = self.brute_force(index, checks[:options['brute_force']])
+        positives = found + missed
+        result = {
+            'rows': rows,
+            'queries': len(checks),
+            'build_seconds': round(build_seconds, 2),
+            'build_rss_mb': round((rss_after - rss_before) / 1024),
+            'query_us': round(query_seconds / len(checks) * 1e6, 1),
+            'candidates_per_query': round(candidates / len(checks), 1),
+            'recall': round(found / positives, 4) if positives else None,
+            'missed_by_change': missed_by_change,
+            'false_positive_rate': round(false_positives / max(1, len(checks) - positives), 4),
+            'brute_force_query_seconds': round(brute_seconds, 3) if brute_seconds else None,
+        }
+        self.stdout.write(
+            f"Проверка: {result['query_us']} мкс на книгу, кандидатов в среднем "
+            f"{result['candidates_per_query']}, полнота {result['recall']}, "
+            f"ложных срабатываний {result['false_positive_rate']}"
+        )
+        if brute_seconds:
+            self.stdout.write(
+                f"Полный перебор: {brute_seconds:.2f} с на книгу — "
+                f"в {brute_seconds / (query_seconds / len(checks)):,.0f} раз медленнее; "
+                f"загрузка {len(checks)} книг заняла бы {brute_seconds * len(checks) / 3600:.1f} ч"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результаты: {options['output']}"))
+
+    @staticmethod
+    def brute_force(index, checks):
+        """Среднее время сравнения одной книги со всем каталогом без индекса"""
+        if not checks:
+            return None
+        started = time.perf_counter()
+        for book, _, _ in checks:
+            title = normalize_text(book['title'])
+            grams, numbers = shingles(title), title_numbers(title)
+            for position in range(index.size):
+                other = normalize_text(index.book(position)['title'])
+                if title_numbers(other) == numbers:
+                    similarity(grams, shingles(other))
+        return (time.perf_counter() - started) / len(checks)
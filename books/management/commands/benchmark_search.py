@@ -0,0 +1,71 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from books.models import Book
+from books.search import has_fts_index, search_books_page
+from books.synthetic import generate_books, sample_queries
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает задержку поиска по индексу с прежним icontains. "
+        "Недостающие строки дозаполняются синтетикой — запускайте на отдельной базе."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000,
+                            help="Сколько книг должно быть в таблице")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=50, help="Размер страницы")
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        existing = Book.objects.count()
+        missing = options['rows'] - existing
+        if missing > 0:
+            self.stdout.write(f"Добавляю {missing} синтетических книг...")
+            batch = []
+            for book in generate_books(missing, seed=options['seed'], start=existing):
+                batch.append(Book(**book))
+                if len(batch) >= options['batch_size']:
+                    Book.objects.bulk_create(batch, ignore_conflicts=True)
+                    batch = []
+            if batch:
+                Book.objects.bulk_create(batch, ignore_conflicts=True)
+
+        limit = options['limit']
+        queries = sample_queries(options['queries'], seed=options['seed'])
+
+        def legacy(query):
+            # Прежний search_books: все совпадения одним ответом
+            return list(Book.objects.filter(
+                Q(title__icontains=query) | Q(author__icontains=query)
+            ).values())
+
+        def indexed(query):
+            return search_books_page(query, limit)
+
+        self.stdout.write(
+            f"Строк: {Book.objects.count()}, запросов: {len(queries)}, "
+            f"полнотекстовый индекс: {'да' if has_fts_index() else 'нет'}"
+        )
+        for name, func in (('icontains', legacy), ('fts', indexed)):
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                func(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{name:>10}: p50={statistics.median(timings):.2f} мс "
+                f"p95={percentile(timings, 95):.2f} мс max={max(timings):.2f} мс"
+            )
@@ -0,0 +1,123 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.snapshot import encode_snapshot
+from books.synthetic import generate_books
+from books.utils import (
+    TITLE, CatalogueCache, JsonFileBackend, JsonlFileBackend, SnapshotFileBackend, atomic_write,
+)
+
+FORMATS = ('json', 'jsonl', 'snapshot')
+
+
+def read_rss():
+    """RssAnon и RssFile процесса в КБ: собственная память и общие страницы файлов"""
+    rss = {'RssAnon': 0, 'RssFile': 0}
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in rss:
+                    rss[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return rss
+
+
+def make_backend(name, directory):
+    log_path = os.path.join(directory, 'all_books.jsonl')
+    legacy_path = os.path.join(directory, 'all_books.json')
+    if name == 'json':
+        return JsonFileBackend(legacy_path)
+    if name == 'jsonl':
+        return JsonlFileBackend(log_path, legacy_path, compact_every=0)
+    return SnapshotFileBackend(
+        log_path, os.path.join(directory, 'all_books.snap'), legacy_path, compact_every=0,
+    )
+
+
+def measure(name, directory, needle, results):
+    """Выполняется в отдельном процессе, чтобы RSS форматов не смешивался"""
+    before = read_rss()
+    started = time.perf_counter()
+    books = CatalogueCache(make_backend(name, directory), max_age=0).get()
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    found = sum(1 for book in books if needle in str(book[TITLE] or '').casefold())
+    scan_seconds = time.perf_counter() - started
+    after = read_rss()
+    results.put({
+        'format': name,
+        'books': len(books),
+        'found': found,
+        'load_seconds': load_seconds,
+        'scan_seconds': scan_seconds,
+        'rss_anon_kb': after['RssAnon'] - before['RssAnon'],
+        'rss_file_kb': after['RssFile'] - before['RssFile'],
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает форматы файлового каталога (json, jsonl, snapshot): "
+        "размер файла, время загрузки, полный проход поиском и прирост RSS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--needle', default='тайна', help="Подстрока для прохода поиском")
+        parser.add_argument('--dir', default=None,
+                            help="Каталог для файлов (по умолчанию временный, удаляется)")
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or tempfile.mkdtemp(prefix='books-bench-')
+        os.makedirs(directory, exist_ok=True)
+        try:
+            self.stdout.write(f"Генерирую {options['rows']} книг в {directory}...")
+            books = list(generate_books(options['rows'], seed=options['seed']))
+            # Старый формат пишется так же, как раньше: indent=4
+            atomic_write(os.path.join(directory, 'all_books.json'), [
+                json.dumps(books, ensure_ascii=False, indent=4).encode('utf-8')
+            ])
+            atomic_write(os.path.join(directory, 'all_books.jsonl'), (
+                json.dumps(book, ensure_ascii=False).encode('utf-8') + b'\n' for book in books
+            ))
+            log_inode = os.stat(os.path.join(directory, 'all_books.jsonl')).st_ino
+            log_size = os.path.getsize(os.path.join(directory, 'all_books.jsonl'))
+            # Снимок покрывает весь журнал, поэтому журнал при чтении пропускается
+            atomic_write(os.path.join(directory, 'all_books.snap'),
+                         encode_snapshot(books, log_inode, log_size))
+            del books
+
+            ctx = multiprocessing.get_context('spawn')
+            results = ctx.Queue()
+            sizes = {
+                'json': 'all_books.json', 'jsonl': 'all_books.jsonl', 'snapshot': 'all_books.snap',
+            }
+            self.stdout.write(
+                f"{'формат':>9} {'файл, МБ':>9} {'загрузка, с':>12} {'поиск, с':>9} "
+                f"{'RssAnon, МБ':>12} {'RssFile, МБ':>12}"
+            )
+            for name in FORMATS:
+                process = ctx.Process(
+                    target=measure, args=(name, directory, options['needle'], results),
+                )
+                process.start()
+                row = results.get()
+                process.join()
+                size = os.path.getsize(os.path.join(directory, sizes[name])) / 2 ** 20
+                self.stdout.write(
+                    f"{name:>9} {size:>9.1f} {row['load_seconds']:>12.3f} "
+                    f"{row['scan_seconds']:>9.3f} {row['rss_anon_kb'] / 1024:>12.1f} "
+                    f"{row['rss_file_kb'] / 1024:>12.1f}"
+                )
+        finally:
+            if not options['dir']:
+                shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,68 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books.utils import (
+    SnapshotFileBackend, UploadReport, get_file_backend, iter_json_records,
+    read_file_chunks, save_all_books_to_file, validate_books_stream,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Снимок файлового каталога: build — перенести журнал в all_books.snap, "
+        "export — выгрузить каталог в JSON, import — заменить каталог книгами из JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['build', 'export', 'import'])
+        parser.add_argument('path', nargs='?', help="Файл для export / import")
+        parser.add_argument('--jsonl', action='store_true',
+                            help="export: одна книга на строку вместо JSON-массива")
+
+    def handle(self, *args, **options):
+        action, path = options['action'], options['path']
+        backend = get_file_backend()
+        if action == 'build':
+            if not isinstance(backend, SnapshotFileBackend):
+                raise CommandError(
+                    f"Снимок используется только при BOOKS_FILE_BACKEND=snapshot "
+                    f"(сейчас {settings.BOOKS_FILE_BACKEND!r})"
+                )
+            count = len(backend.load())
+            backend.compact()
+            self.stdout.write(self.style.SUCCESS(
+                f"Снимок {backend.snapshot_path} собран, книг: {count}"
+            ))
+            return
+
+        if not path:
+            raise CommandError(f"Укажите файл для {action}")
+        if action == 'export':
+            count = 0
+            with open(path, 'w', encoding='utf-8') as f:
+                if not options['jsonl']:
+                    f.write('[\n')
+                for book in backend.load():
+                    line = json.dumps(book, ensure_ascii=False)
+                    if options['jsonl']:
+                        f.write(line + '\n')
+                    else:
+                        f.write((',\n' if count else '') + line)
+                    count += 1
+                if not options['jsonl']:
+                    f.write('\n]\n')
+            self.stdout.write(self.style.SUCCESS(f"Выгружено книг: {count} в {path}"))
+        else:
+            report = UploadReport()
+            try:
+                books = list(validate_books_stream(
+                    iter_json_records(read_file_chunks(path), report), report
+                ))
+            except OSError as e:
+                raise CommandError(f"Не удалось прочитать {path}: {e}")
+            if not report.ok:
+                raise CommandError(f"Файл не загружен. {report.first_error()}")
+            save_all_books_to_file(books)
+            self.stdout.write(self.style.SUCCESS(f"Загружено книг: {len(books)} из {path}"))
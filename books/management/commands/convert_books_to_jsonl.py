@@ -0,0 +1,48 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.utils import (
+    ALL_BOOKS_FILE, ALL_BOOKS_LOG_FILE, ALL_BOOKS_SNAPSHOT_FILE, convert_json_to_jsonl,
+    convert_jsonl_to_json,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит каталог из all_books.json в журнал all_books.jsonl. "
+        "С --to json — обратно: журнал (и снимок) в all_books.json, "
+        "чтобы вернуться к BOOKS_FILE_BACKEND=json"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=['jsonl', 'json'], default='jsonl',
+                            help="Формат, в который переносится каталог")
+        parser.add_argument('--src', default=None,
+                            help="Исходный файл (по умолчанию all_books.json или all_books.jsonl)")
+        parser.add_argument('--dst', default=None,
+                            help="Файл результата (по умолчанию all_books.jsonl или all_books.json)")
+        parser.add_argument('--force', action='store_true',
+                            help="Перезаписать файл результата, если он уже существует")
+
+    def handle(self, *args, **options):
+        to_json = options['to'] == 'json'
+        src = options['src'] or (ALL_BOOKS_LOG_FILE if to_json else ALL_BOOKS_FILE)
+        dst = options['dst'] or (ALL_BOOKS_FILE if to_json else ALL_BOOKS_LOG_FILE)
+        sources = [src, ALL_BOOKS_SNAPSHOT_FILE] if to_json else [src]
+        if not any(os.path.exists(path) for path in sources):
+            raise CommandError(f"Файл {src} не найден")
+        if os.path.exists(dst) and not options['force']:
+            raise CommandError(f"Файл {dst} уже существует (используйте --force)")
+
+        if to_json:
+            count = convert_jsonl_to_json(src, dst)
+            self.stdout.write(self.style.SUCCESS(
+                f"Перенесено книг: {count}. Журнал и снимок сохранены с суффиксом .bak; "
+                f"теперь задайте BOOKS_FILE_BACKEND=json"
+            ))
+            return
+        count = convert_json_to_jsonl(src, dst)
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено книг: {count}. Исходный файл сохранён как {src}.bak"
+        ))
@@ -0,0 +1,72 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.dedupe import (
+    NearDuplicateReport, flag_near_duplicates, get_near_duplicate_index, scan_catalogue,
+)
+from books.utils import UploadReport, iter_json_records, read_file_chunks, validate_books_stream
+
+
+class Command(BaseCommand):
+    help = (
+        "Ищет почти-дубликаты книг (регистр, пробелы, транслитерация, опечатки). "
+        "С --input сверяет книги из JSON-файла с каталогом и друг с другом, "
+        "ничего не записывая; без него ищет пары похожих книг внутри каталога. "
+        "Отчёт для просмотра пишется в --output."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=['file', 'db'], default='db')
+        parser.add_argument('--input', default=None, help="JSON-файл с книгами для проверки")
+        parser.add_argument('--output', default=None, help="Файл отчёта JSON")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Сколько книг держать в отчёте (по умолчанию BOOKS_DEDUPE_REPORT_LIMIT)")
+        parser.add_argument('--batch-output', default=None,
+                            help="Только для базы и без --input: тело запроса POST /batch/, "
+                                 "удаляющего более поздние книги каждой пары")
+
+    def handle(self, *args, **options):
+        if options['batch_output'] and (options['input'] or options['source'] != 'db'):
+            raise CommandError("--batch-output работает только с --source db и без --input")
+        started = time.monotonic()
+        index = get_near_duplicate_index(options['source'])
+        self.stdout.write(f"Индекс: {index.size} книг за {time.monotonic() - started:.1f} с")
+
+        started = time.monotonic()
+        if options['input']:
+            result = self.check_file(index, options['input'], options['limit'])
+            self.stdout.write(
+                f"Проверено {result['checked']} книг за {time.monotonic() - started:.1f} с, "
+                f"похожих: {result['flagged']}"
+            )
+        else:
+            pairs, groups = scan_catalogue(index, options['limit'])
+            result = {'pairs': pairs, 'groups': groups}
+            self.stdout.write(f"Пар похожих книг: {pairs} (за {time.monotonic() - started:.1f} с)")
+            if options['batch_output']:
+                # Остаётся книга с меньшим id — её добавили раньше
+                delete = sorted({group['book']['id'] for group in groups})
+                with open(options['batch_output'], 'w', encoding='utf-8') as f:
+                    json.dump({'delete': delete}, f)
+                self.stdout.write(f"Пакет на удаление {len(delete)} книг: {options['batch_output']}")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Отчёт: {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+
+    def check_file(self, index, path, limit):
+        report = UploadReport()
+        near = NearDuplicateReport(index, limit)
+        books = validate_books_stream(iter_json_records(read_file_chunks(path), report), report)
+        for book in flag_near_duplicates(books, near, report):
+            pass
+        if report.fatal:
+            raise CommandError(report.fatal)
+        if report.invalid:
+            self.stderr.write(f"Пропущено невалидных книг: {report.invalid}")
+        return near.as_dict()
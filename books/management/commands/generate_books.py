@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.caching import bump_catalogue_version
+from books.models import Book
+from books.synthetic import generate_books
+from books.utils import get_file_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет каталог синтетическими книгами (от тысяч до 10 млн) — "
+        "в файл текущего формата (BOOKS_FILE_BACKEND) и/или в базу. "
+        "Запускайте на отдельной базе и каталоге BOOKS_JSON_DIR."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help="Сколько книг создать")
+        parser.add_argument('--target', choices=['file', 'db', 'both'], default='both')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10_000,
+                            help="Книг в одном bulk_create")
+        parser.add_argument('--replace', action='store_true',
+                            help="Заменить существующий каталог (файл перезаписывается, "
+                                 "таблица книг очищается)")
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        if rows <= 0:
+            raise CommandError("--rows должно быть больше нуля")
+        if options['target'] in ('file', 'both'):
+            self.fill_file(rows, options)
+        if options['target'] in ('db', 'both'):
+            self.fill_db(rows, options)
+
+    def fill_file(self, rows, options):
+        backend = get_file_backend()
+        if backend.signature() is not None and not options['replace']:
+            raise CommandError(
+                "Файловый каталог уже существует; добавьте --replace, чтобы заменить его"
+            )
+        started = time.monotonic()
+        # Книги идут генератором: журнал и снимок пишутся потоком,
+        # только старый формат json собирает весь список в памяти
+        backend.save(generate_books(rows, seed=options['seed']))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Файл: {rows} книг за {elapsed:.1f} с ({rows / max(elapsed, 1e-9):,.0f} книг/с)"
+        ))
+
+    def fill_db(self, rows, options):
+        if options['replace']:
+            Book.objects.all().delete()
+        # Нумерация продолжается после существующих книг, чтобы (title, author) не совпадали
+        start = Book.objects.count()
+        started = time.monotonic()
+        batch = []
+        for book in generate_books(rows, seed=options['seed'], start=start):
+            batch.append(Book(**book))
+            if len(batch) >= options['batch_size']:
+                Book.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        if batch:
+            Book.objects.bulk_create(batch, ignore_conflicts=True)
+        bump_catalogue_version()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"База: {rows} книг за {elapsed:.1f} с ({rows / max(elapsed, 1e-9):,.0f} книг/с), "
+            f"всего {Book.objects.count()}"
+        ))
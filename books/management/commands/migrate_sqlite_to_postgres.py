@@ -0,0 +1,193 @@
+import json
+import multiprocessing
+import os
+import queue
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from books.bulk import book_from_data, write_batch
+from books.caching import bump_catalogue_version
+
+SELECT_SQL = (
+    "SELECT rowid, title, year, author, genre, pages FROM books_book "
+    "WHERE rowid > ? AND rowid <= ? ORDER BY rowid"
+)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, shard, last_rowid, lock):
+    """Сохраняет последний записанный rowid шарда (атомарно, через временный файл)"""
+    with lock:
+        state = load_checkpoint(path)
+        state['shards'][str(shard)] = last_rowid
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+
+def migrate_range(shard, start, end, options, progress, lock):
+    """
+    Переносит строки с rowid в (start, end] пачками.
+    После каждой закоммиченной пачки rowid попадает в файл контрольной точки.
+    """
+    sqlite_conn = sqlite3.connect(options['sqlite_path'])
+    cursor = sqlite_conn.execute(SELECT_SQL, (start, end))
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+    try:
+        while True:
+            rows = cursor.fetchmany(options['batch_size'])
+            if not rows:
+                break
+            books = []
+            for rowid, title, year, author, genre, pages in rows:
+                try:
+                    books.append(book_from_data({
+                        'title': title, 'year': year, 'author': author,
+                        'genre': genre, 'pages': pages,
+                    }))
+                except (ValueError, TypeError) as e:
+                    counts['failed'] += 1
+                    progress.put(('error', f"rowid={rowid}: {e}"))
+            with transaction.atomic():
+                write_batch(books, options['on_conflict'], counts)
+            save_checkpoint(options['checkpoint'], shard, rows[-1][0], lock)
+            progress.put(('rows', len(rows)))
+    finally:
+        sqlite_conn.close()
+        connections.close_all()
+    return counts
+
+
+_worker_state = {}
+
+
+def init_worker(progress, lock):
+    _worker_state['progress'] = progress
+    _worker_state['lock'] = lock
+
+
+def run_pooled(args):
+    shard, start, end, options = args
+    return migrate_range(shard, start, end, options, _worker_state['progress'], _worker_state['lock'])
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит книги из старой базы SQLite в текущую базу (PostgreSQL) "
+        "пачками через bulk_create, с продолжением после сбоя"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sqlite-path', default='/app/db.sqlite3',
+                            help="Путь к старой базе SQLite")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Строк в одной пачке (и одной транзакции)")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Число процессов; диапазоны rowid делятся между ними")
+        parser.add_argument('--checkpoint', default=None,
+                            help="Файл контрольной точки (по умолчанию рядом с базой SQLite)")
+        parser.add_argument('--restart', action='store_true',
+                            help="Игнорировать контрольную точку и начать сначала")
+        parser.add_argument('--on-conflict', choices=['update', 'skip'], default='update',
+                            help="Что делать с книгами, которые уже есть (title, author)")
+
+    def handle(self, *args, **options):
+        sqlite_path = options['sqlite_path']
+        if not os.path.exists(sqlite_path):
+            raise CommandError(f"База SQLite {sqlite_path} не найдена")
+        options['checkpoint'] = options['checkpoint'] or f"{sqlite_path}.checkpoint.json"
+        if options['restart'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+        sqlite_conn = sqlite3.connect(sqlite_path)
+        min_rowid, max_rowid, total = sqlite_conn.execute(
+            "SELECT MIN(rowid), MAX(rowid), COUNT(*) FROM books_book"
+        ).fetchone()
+        sqlite_conn.close()
+        if not total:
+            self.stdout.write("В базе SQLite нет книг.")
+            return
+
+        # Делим [min_rowid, max_rowid] на равные диапазоны по числу процессов
+        workers = max(1, options['workers'])
+        checkpoint = load_checkpoint(options['checkpoint'])
+        if checkpoint is None:
+            checkpoint = {'workers': workers, 'shards': {}}
+            with open(options['checkpoint'], 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f)
+        elif checkpoint['workers'] != workers:
+            raise CommandError(
+                f"Контрольная точка создана для --workers={checkpoint['workers']}; "
+                f"продолжите с тем же числом процессов или используйте --restart"
+            )
+
+        step = (max_rowid - min_rowid + workers) // workers
+        tasks = []
+        for shard in range(workers):
+            start = min_rowid - 1 + shard * step
+            end = min(max_rowid, start + step)
+            start = max(start, checkpoint['shards'].get(str(shard), start))
+            if start < end:
+                tasks.append((shard, start, end))
+
+        self.stdout.write(
+            f"Книг в SQLite: {total}, процессов: {workers}, "
+            f"осталось диапазонов: {len(tasks)} (контрольная точка: {options['checkpoint']})"
+        )
+        if not tasks:
+            self.stdout.write(self.style.SUCCESS("Всё уже перенесено."))
+            return
+
+        worker_options = {
+            key: options[key] for key in ('sqlite_path', 'batch_size', 'checkpoint', 'on_conflict')
+        }
+        started = time.monotonic()
+        totals = {'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+
+        # Соединения нельзя наследовать через fork — закрываем до запуска процессов
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        manager = ctx.Manager()
+        progress, lock = manager.Queue(), manager.Lock()
+        with ctx.Pool(len(tasks), initializer=init_worker, initargs=(progress, lock)) as pool:
+            result = pool.map_async(
+                run_pooled, [(shard, start, end, worker_options) for shard, start, end in tasks]
+            )
+            processed = 0
+            last_report = 0.0
+            while not (result.ready() and progress.empty()):
+                try:
+                    kind, value = progress.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if kind == 'error':
+                    self.stderr.write(f"❌ {value}")
+                    continue
+                processed += value
+                now = time.monotonic()
+                if now - last_report >= 1:
+                    last_report = now
+                    rate = processed / max(now - started, 1e-9)
+                    self.stdout.write(f"… {processed} строк, {rate:,.0f} строк/с")
+            for counts in result.get():
+                for key, value in counts.items():
+                    totals[key] += value
+        manager.shutdown()
+
+        bump_catalogue_version()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"📊 Готово за {elapsed:.1f} с ({processed / max(elapsed, 1e-9):,.0f} строк/с): "
+            f"добавлено {totals['inserted']}, обновлено {totals['updated']}, "
+            f"пропущено {totals['skipped']}, ошибок {totals['failed']}."
+        ))
@@ -0,0 +1,225 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from books.models import Book
+from books.repository import get_repository
+from books.synthetic import generate_books, sample_queries
+from books.utils import (
+    TITLE, YEAR, AUTHOR, count_books_in_file, get_catalogue_cache, load_all_books,
+    validate_json_file,
+)
+
+CASES = (
+    'load_all_books_cold', 'load_all_books_warm', 'validate_json_file',
+    'add_book_duplicate_file', 'add_book_duplicate_db',
+    'upload_merge_file', 'upload_merge_db',
+    'search_file', 'search_db', 'index_file', 'index_db',
+    'repository_split_duplicates_file', 'repository_split_duplicates_db',
+    'repository_bulk_insert_file', 'repository_bulk_insert_db',
+)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(timings):
+    """Сводка замеров одного случая, миллисекунды"""
+    timings = [t * 1000 for t in timings]
+    return {
+        'runs': len(timings),
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def upload_payload(existing, count, run_id, number):
+    """JSON для загрузки: половина — книги из каталога, половина — новые"""
+    books = [
+        {'title': title, 'year': year, 'author': author}
+        for title, year, author in existing[:count // 2]
+    ]
+    for book in generate_books(count - len(books), seed=number):
+        book['title'] = f"{book['title']} {run_id}-{number}"
+        books.append(book)
+    return json.dumps(books, ensure_ascii=False).encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарки основных операций каталога (загрузка файла, проверка JSON, "
+        "дубликаты при добавлении, загрузка файла, поиск, главная страница) "
+        "на текущих данных. Итог пишется в JSON для сравнения запусков. "
+        "Загрузка и добавление меняют каталог — запускайте на отдельных данных "
+        "(см. generate_books)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', action='append', choices=CASES,
+                            help="Какие случаи запускать (по умолчанию все)")
+        parser.add_argument('--repeat', type=int, default=20, help="Замеров на случай")
+        parser.add_argument('--upload-rows', type=int, default=1000,
+                            help="Книг в загружаемом файле")
+        parser.add_argument('--output', default=None,
+                            help="Файл результатов (по умолчанию benchmarks/results/<время>.json)")
+        parser.add_argument('--compare', default=None,
+                            help="Прежний файл результатов: вывести изменение медиан")
+
+    def handle(self, *args, **options):
+        cases = options['case'] or CASES
+        repeat = options['repeat']
+        if repeat <= 0:
+            raise CommandError("--repeat должно быть больше нуля")
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        # Кэш ответов отключён: меряется работа представлений, а не кэш
+        with override_settings(BOOKS_VIEW_CACHE_TIMEOUT=0, BOOKS_UPLOAD_ASYNC=False,
+                               ALLOWED_HOSTS=['testserver']):
+            results = self.run_cases(cases, repeat, options['upload_rows'])
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'file_backend': settings.BOOKS_FILE_BACKEND,
+                'books_file': count_books_in_file(),
+                'books_db': Book.objects.count(),
+                'repeat': repeat,
+                'upload_rows': options['upload_rows'],
+            },
+            'cases': results,
+        }
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'results',
+            f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.json",
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        self.stdout.write(f"{'случай':<34} {'медиана, мс':>12} {'p95, мс':>10}" +
+                          (f" {'было, мс':>10} {'изменение':>10}" if baseline else ''))
+        for name, stats in results.items():
+            line = f"{name:<34} {stats['median_ms']:>12.3f} {stats['p95_ms']:>10.3f}"
+            before = (baseline or {}).get('cases', {}).get(name)
+            if before:
+                change = (stats['median_ms'] / before['median_ms'] - 1) * 100 if before['median_ms'] else 0
+                line += f" {before['median_ms']:>10.3f} {change:>+9.1f}%"
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {output}"))
+
+    def run_cases(self, cases, repeat, upload_rows):
+        run_id = uuid.uuid4().hex[:8]
+        file_books = list(load_all_books()[:upload_rows])
+        db_books = list(Book.objects.values_list('title', 'year', 'author')[:upload_rows])
+        existing_file = [(row[TITLE], row[YEAR], row[AUTHOR]) for row in file_books]
+        queries = sample_queries(repeat, seed=0)
+        client = Client()
+        results = {}
+
+        def timed(name, func, needs=True):
+            if name not in cases:
+                return
+            if not needs:
+                self.stderr.write(f"{name}: пропущен — в каталоге нет книг")
+                return
+            func(-1)  # прогрев
+            timings = []
+            for number in range(repeat):
+                started = time.perf_counter()
+                func(number)
+                timings.append(time.perf_counter() - started)
+            results[name] = summarize(timings)
+
+        def load_cold(number):
+            get_catalogue_cache().clear()
+            len(load_all_books())
+
+        timed('load_all_books_cold', load_cold)
+        timed('load_all_books_warm', lambda number: len(load_all_books()))
+
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            f.write(upload_payload(existing_file, upload_rows, run_id, 0))
+            upload_path = f.name
+        try:
+            timed('validate_json_file', lambda number: validate_json_file(upload_path))
+        finally:
+            os.remove(upload_path)
+
+        def add_duplicate(save_to, book):
+            title, year, author = book
+            return lambda number: client.post('/add/', {
+                'title': title, 'year': year, 'author': author or '', 'save_to': save_to,
+            })
+
+        timed('add_book_duplicate_file',
+              add_duplicate('file', existing_file[0]) if existing_file else None, bool(existing_file))
+        timed('add_book_duplicate_db',
+              add_duplicate('db', db_books[0]) if db_books else None, bool(db_books))
+
+        def upload(save_to, existing):
+            def run(number):
+                payload = upload_payload(existing, upload_rows, run_id, number + 1)
+                client.post('/upload/', {
+                    'file': SimpleUploadedFile('bench.json', payload, 'application/json'),
+                    'save_to': save_to,
+                })
+            return run
+
+        timed('upload_merge_file', upload('file', existing_file))
+        timed('upload_merge_db', upload('db', db_books))
+
+        timed('search_file', lambda number: client.get(
+            '/search/', {'q': queries[number % len(queries)], 'source': 'file'}))
+        timed('search_db', lambda number: client.get(
+            '/search/', {'q': queries[number % len(queries)], 'source': 'db'}))
+        timed('index_file', lambda number: client.get('/', {'source': 'file'}))
+        timed('index_db', lambda number: client.get('/', {'source': 'db'}))
+
+        # Те же операции напрямую через BookRepository обоих хранилищ
+        def upload_books(existing, number):
+            return json.loads(upload_payload(existing, upload_rows, run_id, number))
+
+        for source, existing in (('file', existing_file), ('db', db_books)):
+            repository = get_repository(source)
+            books = upload_books(existing, 0)
+            timed(f'repository_split_duplicates_{source}',
+                  lambda number, books=books, repository=repository: repository.split_duplicates(books))
+            timed(f'repository_bulk_insert_{source}',
+                  lambda number, existing=existing, repository=repository: repository.bulk_insert(
+                      upload_books(existing, repeat + number + 2)))
+        return results
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from books.jobs import claim_next_job, process_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает очередь фоновых загрузок (ImportJob)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Пауза между опросами пустой очереди, секунд")
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help="Через сколько секунд без отметки задание возвращается в очередь")
+        parser.add_argument('--once', action='store_true',
+                            help="Обработать очередь и выйти")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Воркер загрузок запущен")
+        while True:
+            close_old_connections()
+            requeued = requeue_stale_jobs(options['stale_after'])
+            if requeued:
+                self.stdout.write(f"Возвращено в очередь зависших заданий: {requeued}")
+
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"▶ {job.id}: {job.file_name}")
+            job = process_job(job)
+            self.stdout.write(
+                f"{'✅' if job.status == job.STATUS_DONE else '❌'} {job.id}: "
+                f"добавлено {job.inserted}, обновлено {job.updated}, "
+                f"пропущено {job.skipped}, ошибок {job.failed} {job.error}"
+            )
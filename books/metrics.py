@@ -0,0 +1,370 @@
+"""
+Замеры производительности запросов: время представления, запросы к базе,
+чтение и запись файлов каталога, рендеринг шаблонов.
+
+MetricsMiddleware заводит на запрос объект RequestMetrics (в contextvar —
+он виден и в потоках sync_to_async), измерители добавляют в него время,
+а по окончании запроса итог попадает в гистограммы процесса. Итоги
+отдаются на /metrics в текстовом формате Prometheus и заголовком
+Server-Timing; на /metrics — ещё и счётчики кэшей каталога и поиска
+в памяти процесса. Файлы замеряются там, где их читают и пишут
+хранилища, — каждое чтение учитывается один раз.
+При BOOKS_METRICS=False middleware отключается целиком,
+а measure() вне запроса сразу возвращает пустой измеритель.
+"""
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+# Границы корзин гистограммы времени ответа, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+KINDS = ('db', 'file', 'template')
+
+_current = ContextVar('books_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Накопленное за один запрос: секунды по видам, число запросов к базе, байты файлов"""
+
+    __slots__ = ('seconds', 'db_queries', 'file_bytes')
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(KINDS, 0.0)
+        self.db_queries = 0
+        self.file_bytes = 0
+
+
+class Timer:
+    """Добавляет время блока with к текущему запросу"""
+
+    __slots__ = ('metrics', 'kind', 'started')
+
+    def __init__(self, metrics, kind):
+        self.metrics = metrics
+        self.kind = kind
+
+    def add_bytes(self, count):
+        self.metrics.file_bytes += count
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.seconds[self.kind] += time.perf_counter() - self.started
+
+
+class NullTimer:
+    """Измеритель вне запроса или при выключенных метриках — ничего не делает"""
+
+    def add_bytes(self, count):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def measure(kind):
+    """
+    Контекстный менеджер замера для текущего запроса:
+        with measure('file') as timer:
+            data = f.read()
+            timer.add_bytes(len(data))
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return NULL_TIMER
+    return Timer(metrics, kind)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.seconds['db'] += time.perf_counter() - started
+        metrics.db_queries += 1
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    # Список обёрток живёт на объекте соединения и переживает переподключения
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+class Registry:
+    """Гистограммы и счётчики по представлениям в памяти процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self._dumped_at = 0.0
+
+    def observe(self, view, duration, metrics):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = {
+                    'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0,
+                    'db_queries': 0, 'file_bytes': 0,
+                    **{f"{kind}_seconds": 0.0 for kind in KINDS},
+                }
+            for index, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    stats['buckets'][index] += 1
+                    break
+            stats['count'] += 1
+            stats['sum'] += duration
+            stats['db_queries'] += metrics.db_queries
+            stats['file_bytes'] += metrics.file_bytes
+            for kind in KINDS:
+                stats[f"{kind}_seconds"] += metrics.seconds[kind]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: dict(stats, buckets=list(stats['buckets']))
+                for view, stats in self._views.items()
+            }
+
+    def dump(self, directory, every=1.0):
+        """
+        Не чаще раза в every секунд сохраняет итоги процесса в directory/<pid>.json,
+        чтобы /metrics любого воркера отдавал сумму по всем воркерам
+        """
+        now = time.monotonic()
+        if now - self._dumped_at < every:
+            return
+        self._dumped_at = now
+        from .utils import atomic_write
+        atomic_write(
+            os.path.join(directory, f"{os.getpid()}.json"),
+            [json.dumps({'views': self.snapshot(), 'caches': cache_stats()}).encode('utf-8')],
+        )
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+def cache_stats():
+    """Счётчики кэша каталога и кэша поиска этого процесса (books.utils)"""
+    from .utils import file_cache_stats, search_cache_stats
+    return {'catalogue': file_cache_stats(), 'search': search_cache_stats()}
+
+
+def merge_caches(stats_list):
+    """Сумма счётчиков кэшей по воркерам"""
+    merged = {}
+    for stats in stats_list:
+        for cache, counters in stats.items():
+            total = merged.setdefault(cache, {})
+            for key, value in counters.items():
+                total[key] = total.get(key, 0) + value
+    return merged
+
+
+def merge_snapshots(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for view, stats in snapshot.items():
+            total = merged.get(view)
+            if total is None:
+                merged[view] = dict(stats, buckets=list(stats['buckets']))
+                continue
+            for key, value in stats.items():
+                if key == 'buckets':
+                    total['buckets'] = [a + b for a, b in zip(total['buckets'], value)]
+                else:
+                    total[key] += value
+    return merged
+
+
+def collect():
+    """
+    (итоги по представлениям, счётчики кэшей) этого процесса и, если задан
+    BOOKS_METRICS_DIR, остальных воркеров
+    """
+    own, caches = get_registry().snapshot(), cache_stats()
+    directory = settings.BOOKS_METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return own, caches
+    snapshots, cache_list = [own], [caches]
+    own_file = f"{os.getpid()}.json"
+    for name in os.listdir(directory):
+        if not name.endswith('.json') or name == own_file:
+            continue
+        try:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshots.append(data.get('views', {}))
+        cache_list.append(data.get('caches', {}))
+    return merge_snapshots(snapshots), merge_caches(cache_list)
+
+
+def format_number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+# (кэш, счётчик в stats()) -> значение метки result
+CACHE_RESULTS = (
+    ('catalogue', 'hits', 'hit'),
+    ('catalogue', 'misses', 'miss'),
+    ('search', 'hits', 'hit'),
+    ('search', 'refined', 'refined'),
+    ('search', 'misses', 'miss'),
+)
+
+
+def render_prometheus(views, caches=None):
+    """Текстовый формат Prometheus (exposition format 0.0.4)"""
+    lines = [
+        '# HELP books_request_duration_seconds Время ответа представления',
+        '# TYPE books_request_duration_seconds histogram',
+    ]
+    for view in sorted(views):
+        stats = views[view]
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats['buckets']):
+            cumulative += count
+            lines.append(f'books_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+        lines.append(f'books_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'books_request_duration_seconds_sum{{view="{view}"}} {format_number(stats["sum"])}')
+        lines.append(f'books_request_duration_seconds_count{{view="{view}"}} {stats["count"]}')
+
+    counters = (
+        ('books_db_queries_total', 'Запросов к базе', 'db_queries'),
+        ('books_db_seconds_total', 'Время запросов к базе, с', 'db_seconds'),
+        ('books_file_bytes_total', 'Байт прочитано и записано в файлы каталога', 'file_bytes'),
+        ('books_file_seconds_total', 'Время чтения и записи файлов каталога, с', 'file_seconds'),
+        ('books_template_seconds_total', 'Время рендеринга шаблонов, с', 'template_seconds'),
+    )
+    for name, help_text, key in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for view in sorted(views):
+            lines.append(f'{name}{{view="{view}"}} {format_number(views[view][key])}')
+
+    if caches:
+        lines += [
+            '# HELP books_cache_requests_total Обращения к кэшам каталога и поиска '
+            '(refined — результат уточнён по началу запроса)',
+            '# TYPE books_cache_requests_total counter',
+        ]
+        for cache, key, result in CACHE_RESULTS:
+            if cache in caches:
+                lines.append(f'books_cache_requests_total{{cache="{cache}",result="{result}"}} '
+                             f'{caches[cache].get(key, 0)}')
+        if 'catalogue' in caches:
+            lines += [
+                '# HELP books_cache_rebuild_seconds_total Время перечитывания каталога в кэш, с',
+                '# TYPE books_cache_rebuild_seconds_total counter',
+                f'books_cache_rebuild_seconds_total{{cache="catalogue"}} '
+                f'{format_number(float(caches["catalogue"].get("rebuild_seconds", 0)))}',
+            ]
+        lines += [
+            '# HELP books_cache_entries Строк каталога и запросов поиска в кэшах (сумма по воркерам)',
+            '# TYPE books_cache_entries gauge',
+        ]
+        for cache in sorted(caches):
+            lines.append(f'books_cache_entries{{cache="{cache}"}} {caches[cache].get("size", 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+def server_timing(metrics, duration):
+    parts = [
+        f'db;dur={metrics.seconds["db"] * 1000:.2f};desc="{metrics.db_queries} queries"',
+        f'file;dur={metrics.seconds["file"] * 1000:.2f}',
+        f'tpl;dur={metrics.seconds["template"] * 1000:.2f}',
+        f'total;dur={duration * 1000:.2f}',
+    ]
+    return ', '.join(parts)
+
+
+class MetricsMiddleware:
+    """
+    Замеры каждого запроса. Ставить первым в MIDDLEWARE, чтобы время
+    включало всю цепочку. Работает и в WSGI, и в ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.BOOKS_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = settings.BOOKS_METRICS_SERVER_TIMING
+        self.directory = settings.BOOKS_METRICS_DIR
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.registry = get_registry()
+        connection_created.connect(install_db_wrapper)
+        for connection in connections.all(initialized_only=True):
+            install_db_wrapper(None, connection)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def start(self):
+        metrics = RequestMetrics()
+        return metrics, _current.set(metrics), time.perf_counter()
+
+    def finish(self, request, response, metrics, token, started):
+        duration = time.perf_counter() - started
+        _current.reset(token)
+        match = request.resolver_match
+        # Неизвестные адреса — одной меткой, чтобы не плодить ряды
+        view = match.view_name if match else 'unknown'
+        self.registry.observe(view, duration, metrics)
+        if self.directory:
+            self.registry.dump(self.directory)
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(metrics, duration)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, started = self.start()
+        response = self.get_response(request)
+        return self.finish(request, response, metrics, token, started)
+
+    async def __acall__(self, request):
+        metrics, token, started = self.start()
+        response = await self.get_response(request)
+        return self.finish(request, response, metrics, token, started)
+
+
+def metrics_view(request):
+    """Метрики в формате Prometheus; при выключенных метриках — 404"""
+    if not settings.BOOKS_METRICS:
+        raise Http404("Метрики выключены")
+    return HttpResponse(
+        render_prometheus(*collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,82 @@
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS books_book_search_tsv ON books_book "
+    "USING GIN (to_tsvector('simple', title || ' ' || coalesce(author, '')))",
+    "CREATE INDEX IF NOT EXISTS books_book_search_trgm ON books_book "
+    "USING GIN ((title || ' ' || coalesce(author, '')) gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS books_book_search_trgm",
+    "DROP INDEX IF EXISTS books_book_search_tsv",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_book_fts USING fts5("
+    "title, author, content='books_book', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS books_book_fts_ai AFTER INSERT ON books_book BEGIN "
+    "INSERT INTO books_book_fts(rowid, title, author) VALUES (new.id, new.title, new.author); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS books_book_fts_ad AFTER DELETE ON books_book BEGIN "
+    "INSERT INTO books_book_fts(books_book_fts, rowid, title, author) "
+    "VALUES ('delete', old.id, old.title, old.author); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS books_book_fts_au AFTER UPDATE ON books_book BEGIN "
+    "INSERT INTO books_book_fts(books_book_fts, rowid, title, author) "
+    "VALUES ('delete', old.id, old.title, old.author); "
+    "INSERT INTO books_book_fts(rowid, title, author) VALUES (new.id, new.title, new.author); "
+    "END",
+    "INSERT INTO books_book_fts(books_book_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS books_book_fts_au",
+    "DROP TRIGGER IF EXISTS books_book_fts_ad",
+    "DROP TRIGGER IF EXISTS books_book_fts_ai",
+    "DROP TABLE IF EXISTS books_book_fts",
+]
+
+
+def sqlite_has_fts5(cursor):
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.books_fts5_probe USING fts5(x)")
+        cursor.execute("DROP TABLE temp.books_fts5_probe")
+    except Exception:
+        return False
+    return True
+
+
+def run_statements(schema_editor, postgres, sqlite):
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            statements = postgres
+        elif vendor == 'sqlite' and sqlite_has_fts5(cursor):
+            statements = sqlite
+        else:
+            # Без полнотекстового индекса поиск работает через icontains
+            return
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def forward(apps, schema_editor):
+    run_statements(schema_editor, POSTGRES_FORWARD, SQLITE_FORWARD)
+
+
+def backward(apps, schema_editor):
+    run_statements(schema_editor, POSTGRES_BACKWARD, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_alter_book_unique_together'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
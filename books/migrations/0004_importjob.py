@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:33
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_book_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='queued', max_length=10, verbose_name='Статус')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('payload_path', models.CharField(max_length=500, verbose_name='Путь к файлу')),
+                ('save_to', models.CharField(default='file', max_length=10, verbose_name='Сохранить в')),
+                ('on_conflict', models.CharField(default='skip', max_length=10, verbose_name='При дубликате')),
+                ('partial', models.BooleanField(default=False, verbose_name='Загружать валидные')),
+                ('bytes_total', models.BigIntegerField(default=0)),
+                ('bytes_read', models.BigIntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('inserted', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Загрузка',
+                'verbose_name_plural': 'Загрузки',
+                'indexes': [models.Index(fields=['status', 'created_at'], name='books_impor_status_163c40_idx')],
+            },
+        ),
+    ]
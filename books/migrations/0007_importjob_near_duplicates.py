@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_book_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='check_near_duplicates',
+            field=models.BooleanField(default=False, verbose_name='Искать почти-дубликаты'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='near_duplicates',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.core.management.base import CommandError
+from django.db import migrations, models
+from django.db.models import Count
+
+# Сколько групп дубликатов показывать в сообщении об ошибке
+SHOWN_GROUPS = 20
+
+
+def check_duplicates_without_author(apps, schema_editor):
+    """
+    Ограничение нельзя создать, пока в базе есть книги без автора с одинаковым
+    названием. Миграция их не удаляет: она останавливается и перечисляет id,
+    чтобы лишние книги удалили или дополнили автором вручную.
+    """
+    Book = apps.get_model('books', 'Book')
+    without_author = Book.objects.filter(author__isnull=True)
+    titles = list(
+        without_author.values('title').annotate(count=Count('id')).filter(count__gt=1)
+        .order_by('title').values_list('title', flat=True)
+    )
+    if not titles:
+        return
+    groups = []
+    for title in titles[:SHOWN_GROUPS]:
+        ids = without_author.filter(title=title).order_by('id').values_list('id', flat=True)
+        groups.append(f'"{title}": id {", ".join(map(str, ids))}')
+    if len(titles) > SHOWN_GROUPS:
+        groups.append(f"и ещё названий: {len(titles) - SHOWN_GROUPS}")
+    raise CommandError(
+        "Книги без автора с одинаковым названием мешают создать ограничение "
+        "book_unique_title_no_author. Удалите лишние или укажите автора и "
+        "повторите migrate:\n  " + "\n  ".join(groups)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_importjob_near_duplicates'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates_without_author, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(condition=models.Q(('author__isnull', True)), fields=('title',), name='book_unique_title_no_author'),
+        ),
+    ]
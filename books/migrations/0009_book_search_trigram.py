@@ -0,0 +1,70 @@
+from django.db import migrations
+
+# Вторая таблица FTS5 — с токенизатором trigram: по ней ищется подстрока
+# внутри слова («стров» в «Остров»), которую books_book_fts (начала слов)
+# не находит. Регистр trigram сворачивает сам, в том числе у кириллицы.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_book_trgm USING fts5("
+    "title, author, content='books_book', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS books_book_trgm_ai AFTER INSERT ON books_book BEGIN "
+    "INSERT INTO books_book_trgm(rowid, title, author) VALUES (new.id, new.title, new.author); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS books_book_trgm_ad AFTER DELETE ON books_book BEGIN "
+    "INSERT INTO books_book_trgm(books_book_trgm, rowid, title, author) "
+    "VALUES ('delete', old.id, old.title, old.author); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS books_book_trgm_au AFTER UPDATE ON books_book BEGIN "
+    "INSERT INTO books_book_trgm(books_book_trgm, rowid, title, author) "
+    "VALUES ('delete', old.id, old.title, old.author); "
+    "INSERT INTO books_book_trgm(rowid, title, author) VALUES (new.id, new.title, new.author); "
+    "END",
+    "INSERT INTO books_book_trgm(books_book_trgm) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS books_book_trgm_au",
+    "DROP TRIGGER IF EXISTS books_book_trgm_ad",
+    "DROP TRIGGER IF EXISTS books_book_trgm_ai",
+    "DROP TABLE IF EXISTS books_book_trgm",
+]
+
+
+def sqlite_has_trigram(cursor):
+    # Токенизатор trigram появился в SQLite 3.34
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.books_trgm_probe USING fts5(x, tokenize='trigram')")
+        cursor.execute("DROP TABLE temp.books_trgm_probe")
+    except Exception:
+        return False
+    return True
+
+
+def run_statements(schema_editor, statements):
+    # PostgreSQL ищет подстроку по индексу pg_trgm из 0003
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if not sqlite_has_trigram(cursor):
+            # Без trigram поиск по базе работает через icontains
+            return
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def forward(apps, schema_editor):
+    run_statements(schema_editor, SQLITE_FORWARD)
+
+
+def backward(apps, schema_editor):
+    run_statements(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_book_unique_title_no_author'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -1,4 +1,12 @@
+import uuid
+
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+# Столбцы, которые выводят таблица книг и поиск
+BOOK_LIST_FIELDS = ('id', 'title', 'year', 'author', 'genre', 'pages')
+
 
 class Book(models.Model):
     title = models.CharField("Название", max_length=200)
@@ -10,6 +18,89 @@ class Book(models.Model):
         verbose_name = "Книга"
         verbose_name_plural = "Книги"
         unique_together = ('title', 'author')  # Защита от дубликатов
+        constraints = [
+            # NULL в author не срабатывает в unique_together — книги без автора
+            # уникальны по названию отдельным частичным ограничением
+            models.UniqueConstraint(
+                fields=['title'], condition=Q(author__isnull=True),
+                name='book_unique_title_no_author',
+            ),
+        ]
+        indexes = [
+            models.Index(Lower('title'), name='book_title_lower_idx'),
+            # Проверка дубликата при редактировании и сортировка списка по title
+            models.Index(fields=['title', 'year'], name='book_title_year_idx'),
+            models.Index(fields=['author'], name='book_author_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.author})"
+
+
+class ImportJob(models.Model):
+    """Фоновая загрузка файла с книгами (обрабатывается командой run_import_worker)"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField("Статус", max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    file_name = models.CharField("Имя файла", max_length=255)
+    payload_path = models.CharField("Путь к файлу", max_length=500)
+    save_to = models.CharField("Сохранить в", max_length=10, default='file')
+    on_conflict = models.CharField("При дубликате", max_length=10, default='skip')
+    partial = models.BooleanField("Загружать валидные", default=False)
+    check_near_duplicates = models.BooleanField("Искать почти-дубликаты", default=False)
+    bytes_total = models.BigIntegerField(default=0)
+    bytes_read = models.BigIntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    inserted = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    near_duplicates = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Загрузка"
+        verbose_name_plural = "Загрузки"
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.file_name} ({self.get_status_display()})"
+
+    @property
+    def progress(self):
+        if self.status == self.STATUS_DONE:
+            return 100
+        if not self.bytes_total:
+            return 0
+        return min(99, int(self.bytes_read * 100 / self.bytes_total))
+
+
+class CatalogueVersion(models.Model):
+    """
+    Счётчик записей в таблицу книг (одна строка, pk=1).
+    Из него строятся ETag и ключи кэша ответов для source=db.
+    """
+    counter = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Версия каталога"
+        verbose_name_plural = "Версия каталога"
+
+    def __str__(self):
+        return f"v{self.counter}"
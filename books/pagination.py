@@ -0,0 +1,112 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+
+def parse_limit(request):
+    """Размер страницы из ?limit=, ограниченный settings.BOOKS_MAX_PAGE_SIZE"""
+    try:
+        limit = int(request.GET.get('limit', settings.BOOKS_PAGE_SIZE))
+    except (TypeError, ValueError):
+        limit = settings.BOOKS_PAGE_SIZE
+    return max(1, min(limit, settings.BOOKS_MAX_PAGE_SIZE))
+
+
+def parse_fields(request, allowed):
+    """
+    Поля из ?fields=title,year — только те, что есть в allowed.
+    Без параметра (или без известных полей) — все allowed.
+    """
+    requested = [field.strip() for field in request.GET.get('fields', '').split(',')]
+    fields = [field for field in requested if field in allowed]
+    return fields or list(allowed)
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор; битый или пустой курсор означает первую страницу"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def page_meta(next_cursor, limit):
+    return {
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+    }
+
+
+def keyset_queryset(queryset, cursor):
+    """Запрос страницы после курсора: сортировка по (title, id) и фильтр по позиции"""
+    queryset = queryset.order_by('title', 'id')
+    position = decode_cursor(cursor)
+    if position and 'title' in position and 'id' in position:
+        queryset = queryset.filter(
+            Q(title__gt=position['title']) |
+            Q(title=position['title'], id__gt=position['id'])
+        )
+    return queryset
+
+
+def keyset_page(rows, limit):
+    """Обрезает limit + 1 строк до страницы и строит курсор по последней"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if isinstance(last, dict):
+            title, pk = last['title'], last['id']
+        else:
+            title, pk = last.title, last.pk
+        next_cursor = encode_cursor({'title': title, 'id': pk})
+    return rows, page_meta(next_cursor, limit)
+
+
+def paginate_queryset(queryset, limit, cursor=None):
+    """
+    Keyset-пагинация по (title, id): следующая страница начинается строго
+    после последней строки предыдущей, без OFFSET и без подсчёта строк.
+    Возвращает (строки, метаданные страницы).
+    """
+    rows = list(keyset_queryset(queryset, cursor)[:limit + 1])
+    return keyset_page(rows, limit)
+
+
+async def apaginate_queryset(queryset, limit, cursor=None):
+    """То же, что paginate_queryset, через асинхронный ORM"""
+    queryset = keyset_queryset(queryset, cursor)[:limit + 1]
+    rows = [row async for row in queryset.aiterator()]
+    return keyset_page(rows, limit)
+
+
+def paginate_list(items, limit, cursor=None):
+    """
+    Пагинация уже загруженного списка (файловый каталог) по смещению записи.
+    Возвращает (записи, метаданные страницы).
+    """
+    position = decode_cursor(cursor)
+    offset = 0
+    if position:
+        try:
+            offset = max(0, int(position.get('offset', 0)))
+        except (TypeError, ValueError):
+            offset = 0
+
+    rows = items[offset:offset + limit]
+    next_cursor = None
+    if offset + limit < len(items):
+        next_cursor = encode_cursor({'offset': offset + limit})
+    return rows, page_meta(next_cursor, limit)
@@ -0,0 +1,320 @@
+"""
+Хранилища книг с общим интерфейсом BookRepository.
+
+Представления и импорт работают с каталогом через get_repository(source)
+и не ветвятся на «файл» и «базу»: страница, поиск, проверка дубликатов,
+добавление, пакетная вставка и upsert есть у обоих хранилищ, а каждое
+реализует их по-своему (файл — кэш строк в памяти и индекс ключей,
+база — ORM, keyset-пагинация и уникальное ограничение).
+
+Книги на входе — словари с полями BOOK_FIELDS. Страница — пара
+(словари книг, метаданные страницы), как в books.pagination. Пакетные
+операции возвращают счётчики inserted / updated / skipped / failed;
+книги, которые хранилище не может записать, учитываются в report
+(UploadReport) как невалидные.
+Правило дубликатов своё у каждого хранилища: файл сравнивает поля
+settings.BOOKS_DUPLICATE_KEY без учёта регистра и лишних пробелов,
+база — точное совпадение (title, author) по уникальному ограничению.
+"""
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .bulk import book_from_data, clean_text, existing_keys, import_books_to_db
+from .caching import bump_catalogue_version
+from .models import BOOK_LIST_FIELDS, Book
+from .pagination import apaginate_queryset, paginate_list, paginate_queryset
+from .search import asearch_books_page, search_books_page
+from .utils import (
+    BOOK_FIELDS, CatalogueCache, DisplayBooks, DuplicateIndex, SearchCache, UploadReport,
+    clean_book, get_catalogue_cache, get_duplicate_index, get_search_cache,
+    update_all_books_in_file,
+)
+
+COUNTS = ('inserted', 'updated', 'skipped', 'failed')
+
+
+def empty_counts():
+    return dict.fromkeys(COUNTS, 0)
+
+
+class BookRepository:
+    """Общий интерфейс хранилища книг"""
+
+    source = None
+    # Поля строк iter_rows()
+    fields = BOOK_FIELDS
+
+    def get_page(self, limit, cursor=None):
+        """Страница всех книг"""
+        return self.search('', limit, cursor)
+
+    def search(self, query, limit, cursor=None):
+        """Страница книг, в названии или авторе которых есть query"""
+        raise NotImplementedError
+
+    async def aget_page(self, limit, cursor=None):
+        return await self.asearch('', limit, cursor)
+
+    async def asearch(self, query, limit, cursor=None):
+        # По умолчанию — синхронный поиск в пуле потоков
+        return await sync_to_async(self.search, thread_sensitive=False)(query, limit, cursor)
+
+    def split_duplicates(self, books):
+        """Делит книги на (новые, дубликаты) — и относительно хранилища, и внутри списка"""
+        raise NotImplementedError
+
+    def exists(self, book):
+        """Есть ли уже такая книга (по правилу дубликатов хранилища)"""
+        new_books, _ = self.split_duplicates([book])
+        return not new_books
+
+    def add(self, book):
+        """Добавляет одну книгу; False, если она уже есть"""
+        raise NotImplementedError
+
+    def bulk_insert(self, books, report=None):
+        """Добавляет книги, пропуская дубликаты"""
+        raise NotImplementedError
+
+    def upsert(self, books, report=None):
+        """Добавляет новые книги и обновляет year, genre, pages у существующих"""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def iter_rows(self):
+        """Все книги кортежами значений self.fields — по одной, без списка в памяти"""
+        raise NotImplementedError
+
+    async def aiter_rows(self):
+        # По умолчанию — iter_rows() в пуле потоков, по BOOKS_EXPORT_CHUNK_SIZE строк за раз
+        rows = iter(self.iter_rows())
+        size = settings.BOOKS_EXPORT_CHUNK_SIZE
+        read_chunk = sync_to_async(lambda: list(islice(rows, size)), thread_sensitive=False)
+        try:
+            while chunk := await read_chunk():
+                for row in chunk:
+                    yield row
+        finally:
+            close = getattr(rows, 'close', None)
+            if close is not None:
+                # Файл выгрузки закрывается и при обрыве соединения
+                await sync_to_async(close, thread_sensitive=False)()
+
+
+class FileBookRepository(BookRepository):
+    """
+    Общий файл каталога. Без аргумента работает с хранилищем из настроек
+    и общими для процесса кэшами; с backend — со своими (например, во
+    временном каталоге).
+    """
+
+    source = 'file'
+
+    def __init__(self, backend=None):
+        if backend is None:
+            self.cache = get_catalogue_cache()
+            self.search_cache = get_search_cache()
+            self.index = get_duplicate_index()
+        else:
+            self.cache = CatalogueCache(backend)
+            self.search_cache = SearchCache()
+            self.index = DuplicateIndex(backend)
+        self.backend = self.index.backend
+
+    def search(self, query, limit, cursor=None):
+        rows = self.search_cache.search(self.cache.get(), query)
+        # «—» подставляются только в книги выбранной страницы
+        return paginate_list(DisplayBooks(rows), limit, cursor)
+
+    def split_duplicates(self, books):
+        return self.index.split(books)
+
+    def add(self, book):
+        new_books, _ = self.insert_unique([book])
+        return bool(new_books)
+
+    def insert_unique(self, books):
+        """Дописывает только новые книги; возвращает (добавленные, дубликаты)"""
+        # Проверка и запись под одной файловой блокировкой: другой воркер
+        # не успеет дописать ту же книгу между ними
+        with self.index.lock, self.backend.lock.exclusive():
+            new_books, duplicates = self.index.split(books)
+            self.backend.append(new_books)
+            self.index.refresh()
+        return new_books, duplicates
+
+    def bulk_insert(self, books, report=None, batch_size=None):
+        counts = empty_counts()
+        for batch in self.batches(books, batch_size):
+            new_books, duplicates = self.insert_unique(batch)
+            counts['inserted'] += len(new_books)
+            counts['skipped'] += len(duplicates)
+        return counts
+
+    def upsert(self, books, report=None, batch_size=None):
+        """
+        Новые книги дописываются пачками, как в bulk_insert; обновления
+        существующих копятся и применяются одной перезаписью файла в конце
+        """
+        counts = empty_counts()
+        updates = {}
+        for batch in self.batches(books, batch_size):
+            new_books, duplicates = self.insert_unique(batch)
+            counts['inserted'] += len(new_books)
+            for book in duplicates:
+                # Последняя версия книги из загрузки побеждает
+                updates[self.index.key(book)] = clean_book(book)
+        if updates:
+            counts['updated'] += self.apply_updates(updates)
+        return counts
+
+    def apply_updates(self, updates):
+        """
+        Переписывает файл, заменяя year, genre, pages у книг с ключами из updates.
+        Книги, дописанные другим процессом во время перезаписи, не теряются:
+        при конфликте версий файл перечитывается и изменения применяются заново.
+        """
+        updated = set()
+
+        def modify(books):
+            # Повторная попытка считает обновлённые книги заново
+            updated.clear()
+            result = []
+            for book in books:
+                key = self.index.key(book)
+                change = updates.get(key)
+                if change is not None:
+                    book = dict(book)
+                    for field in ('year', 'genre', 'pages'):
+                        if field in change:
+                            book[field] = change[field]
+                        else:
+                            book.pop(field, None)
+                    updated.add(key)
+                result.append(book)
+            return result
+
+        with self.index.lock:
+            update_all_books_in_file(modify, backend=self.backend)
+            self.index.refresh()
+        return len(updated)
+
+    def count(self):
+        self.index.refresh()
+        return self.index.size
+
+    def iter_rows(self):
+        fields = self.fields
+        return (tuple(book.get(field) for field in fields) for book in self.backend.iter_books())
+
+    @staticmethod
+    def batches(books, batch_size=None):
+        batch_size = batch_size or settings.BOOKS_UPLOAD_BATCH_SIZE
+        batch = []
+        for book in books:
+            batch.append(book)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class OrmBookRepository(BookRepository):
+    """Таблица Book через ORM"""
+
+    source = 'db'
+    fields = BOOK_LIST_FIELDS
+
+    def queryset(self):
+        return Book.objects.values(*BOOK_LIST_FIELDS)
+
+    def get_page(self, limit, cursor=None):
+        return paginate_queryset(self.queryset(), limit, cursor)
+
+    def search(self, query, limit, cursor=None):
+        if not query.strip():
+            return self.get_page(limit, cursor)
+        return search_books_page(query, limit, cursor)
+
+    async def aget_page(self, limit, cursor=None):
+        return await apaginate_queryset(self.queryset(), limit, cursor)
+
+    async def asearch(self, query, limit, cursor=None):
+        if not query.strip():
+            return await self.aget_page(limit, cursor)
+        return await asearch_books_page(query, limit, cursor)
+
+    @staticmethod
+    def key(book):
+        return clean_text(book.get('title')), clean_text(book.get('author'))
+
+    def split_duplicates(self, books):
+        books = list(books)
+        # Один запрос на весь список, как в bulk.write_batch
+        existing = existing_keys([
+            Book(title=title, author=author) for title, author in map(self.key, books)
+        ])
+        new_books, duplicates = [], []
+        seen = set()
+        for book in books:
+            key = self.key(book)
+            if key in existing or key in seen:
+                duplicates.append(book)
+            else:
+                seen.add(key)
+                new_books.append(book)
+        return new_books, duplicates
+
+    def add(self, book):
+        # Дубликат отсекает уникальное ограничение — без отдельной проверки,
+        # между которой и вставкой успел бы записать другой запрос
+        try:
+            with transaction.atomic():
+                book_from_data(book).save(force_insert=True)
+        except IntegrityError:
+            return False
+        bump_catalogue_version()
+        return True
+
+    def bulk_insert(self, books, report=None):
+        return import_books_to_db(books, report or UploadReport(), 'skip')
+
+    def upsert(self, books, report=None):
+        return import_books_to_db(books, report or UploadReport(), 'update')
+
+    def count(self):
+        return Book.objects.count()
+
+    def iter_rows(self):
+        return (
+            Book.objects.order_by('id').values_list(*self.fields)
+            .iterator(chunk_size=settings.BOOKS_EXPORT_CHUNK_SIZE)
+        )
+
+    async def aiter_rows(self):
+        # aiterator() у values_list() выполняет запрос прямо в цикле событий
+        # (SynchronousOnlyOperation в Django 5.2), а у values() — в потоке
+        fields = self.fields
+        books = (
+            Book.objects.order_by('id').values(*fields)
+            .aiterator(chunk_size=settings.BOOKS_EXPORT_CHUNK_SIZE)
+        )
+        async for book in books:
+            yield tuple(book[field] for field in fields)
+
+
+REPOSITORIES = {
+    'file': FileBookRepository,
+    'db': OrmBookRepository,
+}
+
+
+def get_repository(source):
+    """Хранилище по значению параметра source ('file' или 'db'); по умолчанию — файл"""
+    return REPOSITORIES.get(source, FileBookRepository)()
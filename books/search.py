@@ -0,0 +1,173 @@
+"""
+Полнотекстовый поиск книг по названию и автору.
+
+PostgreSQL: GIN-индекс по to_tsvector('simple', ...) для поиска по
+префиксам слов с ранжированием ts_rank и GIN-индекс pg_trgm по той же
+строке для поиска подстроки через ILIKE.
+SQLite: виртуальная таблица FTS5 books_book_fts, которую триггеры
+синхронизируют с books_book; ранжирование по bm25. FTS5 находит только
+начала слов, поэтому подстрока («стров» в «Остров») ищется по второй
+таблице books_book_trgm с токенизатором trigram (миграция 0009) — тоже
+по индексу, без просмотра всей таблицы. Такие книги идут после найденных
+по началам слов. trigram ищет подстроку в title и author по отдельности
+и только от трёх символов: более короткий запрос ищет начала слов.
+Остальные СУБД (и SQLite без FTS5) используют прежний icontains.
+Индексы создаются миграциями 0003_book_search_index и 0009_book_search_trigram.
+"""
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Q
+
+from .models import BOOK_LIST_FIELDS, Book
+from .pagination import decode_cursor, encode_cursor, page_meta
+
+FTS_TABLE = 'books_book_fts'
+TRGM_TABLE = 'books_book_trgm'
+
+# Выражение должно совпадать с выражениями индексов из миграции
+SEARCH_DOCUMENT = "title || ' ' || coalesce(author, '')"
+
+POSTGRES_SQL = f"""
+    SELECT id FROM books_book
+    WHERE to_tsvector('simple', {SEARCH_DOCUMENT}) @@ to_tsquery('simple', %s)
+       OR {SEARCH_DOCUMENT} ILIKE %s
+    ORDER BY ts_rank(to_tsvector('simple', {SEARCH_DOCUMENT}), to_tsquery('simple', %s)) DESC,
+             similarity({SEARCH_DOCUMENT}, %s) DESC,
+             id
+    LIMIT %s OFFSET %s
+"""
+
+# Токенизатор trigram не находит строки короче трёх символов
+TRGM_MIN_LENGTH = 3
+
+SQLITE_PREFIX_SQL = f"""
+    SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+    ORDER BY bm25({FTS_TABLE}), rowid
+    LIMIT %s OFFSET %s
+"""
+
+# Сначала совпадения по началам слов (по bm25), затем остальные книги
+# с подстрокой (по id); обе выборки идут по индексам FTS5
+SQLITE_SUBSTRING_SQL = f"""
+    WITH prefix AS (
+        SELECT rowid, bm25({FTS_TABLE}) AS rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+    )
+    SELECT id FROM (
+        SELECT rowid AS id, 0 AS part, rank FROM prefix
+        UNION ALL
+        SELECT rowid, 1, 0 FROM {TRGM_TABLE}
+        WHERE {TRGM_TABLE} MATCH %s AND rowid NOT IN (SELECT rowid FROM prefix)
+    )
+    ORDER BY part, rank, id
+    LIMIT %s OFFSET %s
+"""
+
+_fts_available = {}
+
+
+def search_terms(query):
+    """Слова запроса: только буквы и цифры, без операторов поискового синтаксиса"""
+    return re.findall(r'\w+', query.casefold())
+
+
+def has_fts_index():
+    """Есть ли полнотекстовый индекс в текущей базе (проверяется один раз)"""
+    alias = connection.alias
+    if alias not in _fts_available:
+        if connection.vendor == 'postgresql':
+            _fts_available[alias] = True
+        elif connection.vendor == 'sqlite':
+            # Без таблицы trigram подстроку нашёл бы только icontains
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s)",
+                    [FTS_TABLE, TRGM_TABLE],
+                )
+                _fts_available[alias] = cursor.fetchone()[0] == 2
+        else:
+            _fts_available[alias] = False
+    return _fts_available[alias]
+
+
+def search_book_ids(terms, query, limit, offset):
+    """id подходящих книг в порядке релевантности"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            tsquery = ' & '.join(f"{term}:*" for term in terms)
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            cursor.execute(POSTGRES_SQL, [tsquery, pattern, tsquery, query, limit, offset])
+        else:
+            match = ' AND '.join(f'"{term}"*' for term in terms)
+            substring = query.strip()
+            if len(substring) >= TRGM_MIN_LENGTH:
+                # Запрос целиком — одна фраза trigram, кавычки внутри удваиваются
+                phrase = '"' + substring.replace('"', '""') + '"'
+                cursor.execute(SQLITE_SUBSTRING_SQL, [match, phrase, limit, offset])
+            else:
+                cursor.execute(SQLITE_PREFIX_SQL, [match, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def cursor_offset(cursor):
+    position = decode_cursor(cursor) or {}
+    try:
+        return max(0, int(position.get('offset', 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def fallback_queryset(query, limit, offset):
+    """Прежний поиск icontains — для баз без полнотекстового индекса"""
+    return (
+        Book.objects.filter(Q(title__icontains=query) | Q(author__icontains=query))
+        .order_by('title', 'id')
+        .values(*BOOK_LIST_FIELDS)[offset:offset + limit + 1]
+    )
+
+
+def search_page(rows, limit, offset):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({'offset': offset + limit})
+    return rows, page_meta(next_cursor, limit)
+
+
+def search_books_page(query, limit, cursor=None):
+    """
+    Одна страница результатов поиска, отсортированных по релевантности.
+    Курсор — смещение в выдаче: у релевантности нет стабильного ключа
+    для keyset-пагинации, а выдача поиска обычно неглубокая.
+    Возвращает (строки как в .values(), метаданные страницы).
+    """
+    offset = cursor_offset(cursor)
+    terms = search_terms(query)
+    if terms and has_fts_index():
+        ids = search_book_ids(terms, query, limit + 1, offset)
+        rows_by_id = {row['id']: row for row in Book.objects.filter(id__in=ids).values(*BOOK_LIST_FIELDS)}
+        rows = [rows_by_id[pk] for pk in ids if pk in rows_by_id]
+    else:
+        rows = list(fallback_queryset(query, limit, offset))
+    return search_page(rows, limit, offset)
+
+
+async def asearch_books_page(query, limit, cursor=None):
+    """
+    То же, что search_books_page, через асинхронный ORM.
+    Сырой SQL полнотекстового индекса у Django синхронный — он
+    выполняется через sync_to_async, а строки книг читаются aiterator().
+    """
+    offset = cursor_offset(cursor)
+    terms = search_terms(query)
+    if terms and await sync_to_async(has_fts_index)():
+        ids = await sync_to_async(search_book_ids)(terms, query, limit + 1, offset)
+        rows_by_id = {
+            row['id']: row
+            async for row in Book.objects.filter(id__in=ids).values(*BOOK_LIST_FIELDS).aiterator()
+        }
+        rows = [rows_by_id[pk] for pk in ids if pk in rows_by_id]
+    else:
+        rows = [row async for row in fallback_queryset(query, limit, offset).aiterator()]
+    return search_page(rows, limit, offset)
@@ -0,0 +1,229 @@
+"""
+Компактный колоночный снимок файлового каталога (all_books.snap).
+
+Формат (little-endian):
+    заголовок   magic, число книг, число строк, inode и смещение журнала,
+                до которого снимок включает книги
+    смещения    uint64[число строк + 1] — границы строк в блоке строк
+    столбцы     uint32[число книг] для каждого поля из FIELDS — номер
+                строки в таблице (0 — поле отсутствует)
+    строки      UTF-8; каждая строка начинается с байта типа значения
+
+Повторяющиеся значения (авторы, жанры, годы) хранятся один раз.
+Файл читается через mmap, поэтому воркеры делят одни и те же страницы
+кэша ОС вместо собственных копий списка словарей.
+"""
+import mmap
+import struct
+from array import array
+from collections.abc import Sequence
+
+MAGIC = b'BKSNAP01'
+HEADER = struct.Struct('<8sIIQQ')
+FIELDS = ('title', 'year', 'author', 'genre', 'pages')
+
+# Байт типа в начале каждой строки таблицы
+TYPE_STR, TYPE_INT, TYPE_FLOAT, TYPE_TRUE, TYPE_FALSE = b's', b'i', b'f', b'T', b'F'
+
+
+class SnapshotError(ValueError):
+    """Файл не является снимком каталога или повреждён"""
+
+
+def encode_value(value):
+    if isinstance(value, bool):
+        return TYPE_TRUE if value else TYPE_FALSE
+    if isinstance(value, int):
+        return TYPE_INT + str(value).encode('ascii')
+    if isinstance(value, float):
+        return TYPE_FLOAT + repr(value).encode('ascii')
+    return TYPE_STR + str(value).encode('utf-8')
+
+
+def decode_value(raw):
+    kind, body = raw[:1], raw[1:]
+    if kind == TYPE_STR:
+        return body.decode('utf-8')
+    if kind == TYPE_INT:
+        return int(body)
+    if kind == TYPE_FLOAT:
+        return float(body)
+    return kind == TYPE_TRUE
+
+
+def encode_snapshot(books, log_inode=0, log_offset=0):
+    """
+    Кодирует книги в снимок; возвращает список кусков байтов для записи.
+    Поля вне FIELDS не сохраняются; None и отсутствующее поле неразличимы.
+    """
+    interned = {}
+    strings = [b'']
+    columns = [array('I') for _ in FIELDS]
+    count = 0
+    for book in books:
+        count += 1
+        for column, field in zip(columns, FIELDS):
+            value = book.get(field)
+            if value is None:
+                column.append(0)
+                continue
+            raw = encode_value(value)
+            string_id = interned.get(raw)
+            if string_id is None:
+                string_id = interned[raw] = len(strings)
+                strings.append(raw)
+            column.append(string_id)
+
+    offsets = array('Q', [0])
+    position = 0
+    for raw in strings:
+        position += len(raw)
+        offsets.append(position)
+
+    chunks = [HEADER.pack(MAGIC, count, len(strings), log_inode, log_offset), offsets.tobytes()]
+    chunks.extend(column.tobytes() for column in columns)
+    chunks.append(b''.join(strings))
+    return chunks
+
+
+class SnapshotCatalogue(Sequence):
+    """
+    Снимок, открытый через mmap: ведёт себя как список словарей книг,
+    но разбирает запись только при обращении к ней.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"{path}: пустой файл")
+        try:
+            magic, count, n_strings, self.log_inode, self.log_offset = HEADER.unpack_from(self._mmap, 0)
+        except struct.error:
+            raise SnapshotError(f"{path}: слишком короткий файл")
+        if magic != MAGIC:
+            raise SnapshotError(f"{path}: не снимок каталога")
+        self._count = count
+        self._view = view = memoryview(self._mmap)
+        position = HEADER.size
+        offsets_size = (n_strings + 1) * 8
+        self._offsets = view[position:position + offsets_size].cast('Q')
+        position += offsets_size
+        self._columns = []
+        for _ in FIELDS:
+            self._columns.append(view[position:position + count * 4].cast('I'))
+            position += count * 4
+        self._blob = position
+        if position + self._offsets[-1] > len(self._mmap):
+            raise SnapshotError(f"{path}: файл обрезан")
+        self._cache = {}
+
+    def string(self, string_id):
+        """Значение по номеру строки; частые значения кэшируются"""
+        if string_id == 0:
+            return None
+        value = self._cache.get(string_id)
+        if value is None:
+            start = self._blob + self._offsets[string_id]
+            end = self._blob + self._offsets[string_id + 1]
+            value = decode_value(self._mmap[start:end])
+            if len(self._cache) < 65536:
+                self._cache[string_id] = value
+        return value
+
+    def __len__(self):
+        return self._count
+
+    def record(self, index):
+        book = {}
+        for column, field in zip(self._columns, FIELDS):
+            string_id = column[index]
+            if string_id:
+                book[field] = self.string(string_id)
+        return book
+
+    def row(self, index):
+        """Книга кортежем значений в порядке FIELDS (None — поля нет)"""
+        string = self.string
+        return tuple(string(column[index]) for column in self._columns)
+
+    @property
+    def rows(self):
+        """Те же книги, но кортежами — без словаря на каждую запись"""
+        return SnapshotRows(self)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.record(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self.record(index)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self.record(index)
+
+    def column(self, field):
+        """Значения одного поля по всем книгам (без сборки словарей)"""
+        column = self._columns[FIELDS.index(field)]
+        string = self.string
+        return (string(string_id) for string_id in column)
+
+    def close(self):
+        for view in (self._offsets, *self._columns, self._view):
+            view.release()
+        self._mmap.close()
+
+
+class SnapshotRows(Sequence):
+    """Книги снимка кортежами (см. SnapshotCatalogue.row)"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.snapshot.row(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.snapshot.row(index)
+
+    def __iter__(self):
+        row = self.snapshot.row
+        for index in range(len(self)):
+            yield row(index)
+
+
+class CatalogueView(Sequence):
+    """Книги снимка и следом — книги из журнала, дописанные после него"""
+
+    def __init__(self, snapshot, tail):
+        self.snapshot = snapshot if snapshot is not None else ()
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.snapshot) + len(self.tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if 0 <= index < len(self.snapshot):
+            return self.snapshot[index]
+        if index < 0:
+            raise IndexError(index)
+        return self.tail[index - len(self.snapshot)]
+
+    def __iter__(self):
+        yield from self.snapshot
+        yield from self.tail
@@ -0,0 +1,48 @@
+"""Синтетические книги для бенчмарков и нагрузочных тестов"""
+import random
+
+WORDS = [
+    'война', 'мир', 'тайна', 'остров', 'город', 'ночь', 'море', 'дорога',
+    'история', 'сад', 'звезда', 'время', 'дом', 'песня', 'тень', 'зима',
+    'lost', 'night', 'river', 'empire', 'garden', 'stone', 'winter', 'shadow',
+]
+FIRST_NAMES = ['Лев', 'Анна', 'Иван', 'Мария', 'Фёдор', 'Ольга', 'John', 'Emma', 'Jack', 'Lucy']
+LAST_NAMES = ['Толстой', 'Ахматова', 'Бунин', 'Цветаева', 'Достоевский', 'Smith', 'Brown', 'London']
+GENRES = ['Роман', 'Поэзия', 'Фантастика', 'Детектив', 'Драма', None]
+
+
+def generate_books(count, seed=0, start=0):
+    """
+    Генерирует count словарей книг в формате all_books.json.
+    Номер в названии делает каждую пару (title, author) уникальной.
+    """
+    rng = random.Random(seed)
+    for number in range(start, start + count):
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        book = {
+            'title': f"{title.capitalize()} {number}",
+            'year': rng.randint(1800, 2025),
+            'author': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        }
+        genre = rng.choice(GENRES)
+        if genre:
+            book['genre'] = genre
+        if rng.random() < 0.7:
+            book['pages'] = str(rng.randint(50, 1500))
+        yield book
+
+
+def sample_queries(count, seed=0):
+    """Типичные запросы из строки поиска: слово, префикс слова, фамилия"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(rng.choice(WORDS))
+        elif kind < 0.8:
+            word = rng.choice(WORDS)
+            queries.append(word[:rng.randint(2, len(word))])
+        else:
+            queries.append(rng.choice(LAST_NAMES))
+    return queries
@@ -1,3 +1,1569 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import queue
+import runpy
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .bulk import import_books_to_db, write_batch
+from .caching import bump_catalogue_version, catalogue_version, view_cache_key
+from .dedupe import NearDuplicateIndex, NearDuplicateReport, flag_near_duplicates
+from .jobs import claim_next_job, enqueue_upload, process_job, requeue_stale_jobs
+from .management.commands.migrate_sqlite_to_postgres import load_checkpoint, migrate_range
+from .metrics import RequestMetrics, _current as metrics_context
+from .models import Book, ImportJob
+from .pagination import (
+    decode_cursor, encode_cursor, paginate_list, paginate_queryset, parse_fields,
+)
+from .repository import FileBookRepository, OrmBookRepository
+from .search import search_books_page
+from .snapshot import HEADER, SnapshotCatalogue, SnapshotError, encode_snapshot
+from .synthetic import generate_books, sample_queries
+from .uploads import BooksUploadHandler
+from .utils import (
+    BOOK_FIELDS, CatalogueCache, CatalogueConflict, DisplayBooks, DuplicateIndex, FileLock,
+    JsonFileBackend, JsonlFileBackend, JsonStreamError, JsonStreamParser, SearchCache,
+    SnapshotFileBackend, UploadReport, atomic_write, book_row, clean_book, convert_jsonl_to_json,
+    iter_json_records, row_matches, update_all_books_in_file, validate_books_stream,
+)
+from .views import SEARCH_FIELDS_DB, search_books
+
+
+def make_book(number, **fields):
+    book = {'title': f"Book {number}", 'year': 2000 + number % 20, 'author': f"Author {number % 7}"}
+    book.update(fields)
+    return book
+
+
+class RepositoryContract:
+    """
+    Контракт BookRepository: одинаковые проверки для каждого хранилища.
+    Подкласс задаёт make_repository(); данные — только ASCII, чтобы поиск
+    без учёта регистра работал и в SQLite без полнотекстового индекса.
+    """
+
+    def make_repository(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        self.repository = self.make_repository()
+
+    def all_titles(self, limit=3):
+        titles = []
+        cursor = None
+        while True:
+            rows, page = self.repository.get_page(limit, cursor)
+            titles.extend(row['title'] for row in rows)
+            if not page['has_more']:
+                return titles
+            cursor = page['next_cursor']
+
+    def test_empty(self):
+        self.assertEqual(self.repository.count(), 0)
+        rows, page = self.repository.get_page(10)
+        self.assertEqual(list(rows), [])
+        self.assertFalse(page['has_more'])
+
+    def test_add_and_duplicate(self):
+        book = make_book(1)
+        self.assertFalse(self.repository.exists(book))
+        self.assertTrue(self.repository.add(book))
+        self.assertTrue(self.repository.exists(book))
+        self.assertFalse(self.repository.add(dict(book, year=1990)))
+        self.assertEqual(self.repository.count(), 1)
+
+    def test_bulk_insert_skips_duplicates(self):
+        self.repository.add(make_book(0))
+        books = [make_book(number) for number in range(10)] + [make_book(3)]
+        counts = self.repository.bulk_insert(books)
+        self.assertEqual(counts['inserted'], 9)
+        self.assertEqual(counts['skipped'], 2)
+        self.assertEqual(counts['updated'], 0)
+        self.assertEqual(self.repository.count(), 10)
+
+    def test_split_duplicates(self):
+        self.repository.bulk_insert([make_book(1), make_book(2)])
+        new_books, duplicates = self.repository.split_duplicates(
+            [make_book(2), make_book(3), make_book(3)]
+        )
+        self.assertEqual([book['title'] for book in new_books], ['Book 3'])
+        self.assertEqual([book['title'] for book in duplicates], ['Book 2', 'Book 3'])
+
+    def test_pages_cover_all_books_once(self):
+        self.repository.bulk_insert([make_book(number) for number in range(10)])
+        titles = self.all_titles(limit=3)
+        self.assertEqual(sorted(titles), sorted(f"Book {number}" for number in range(10)))
+
+    def test_search_title_and_author(self):
+        self.repository.bulk_insert([
+            make_book(1, title='War and Peace', author='Leo Tolstoy'),
+            make_book(2, title='Peace Talks', author='Jim Butcher'),
+            make_book(3, title='Dune', author='Frank Herbert'),
+        ])
+        rows, _ = self.repository.search('peace', 10)
+        self.assertEqual(sorted(row['title'] for row in rows), ['Peace Talks', 'War and Peace'])
+        rows, _ = self.repository.search('herbert', 10)
+        self.assertEqual([row['title'] for row in rows], ['Dune'])
+        rows, page = self.repository.search('peace', 1)
+        self.assertEqual(len(rows), 1)
+        self.assertTrue(page['has_more'])
+
+    def test_upsert_updates_existing(self):
+        self.repository.bulk_insert([make_book(1, year=1950), make_book(2)])
+        counts = self.repository.upsert([make_book(1, year=1960, genre='Novel'), make_book(3)])
+        self.assertEqual(counts['inserted'], 1)
+        self.assertEqual(counts['updated'], 1)
+        self.assertEqual(self.repository.count(), 3)
+        rows, _ = self.repository.search('Book 1', 10)
+        self.assertEqual([str(row['year']) for row in rows], ['1960'])
+        self.assertEqual([row['genre'] for row in rows], ['Novel'])
+
+
+class OrmRepositoryTests(RepositoryContract, TestCase):
+    def make_repository(self):
+        return OrmBookRepository()
+
+
+class FileRepositoryTests(RepositoryContract, TestCase):
+    """
+    Файловое хранилище во временном каталоге; подклассы меняют формат.
+    Уплотнение в фоне отключено большим compact_every.
+    """
+
+    def make_backend(self, directory):
+        return JsonlFileBackend(
+            os.path.join(directory, 'all_books.jsonl'), os.path.join(directory, 'all_books.json'),
+            compact_every=10 ** 9,
+        )
+
+    def make_repository(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        return FileBookRepository(self.make_backend(directory))
+
+
+class JsonFileRepositoryTests(FileRepositoryTests):
+    def make_backend(self, directory):
+        return JsonFileBackend(os.path.join(directory, 'all_books.json'))
+
+
+class SnapshotFileRepositoryTests(FileRepositoryTests):
+    def make_backend(self, directory):
+        return SnapshotFileBackend(
+            os.path.join(directory, 'all_books.jsonl'), os.path.join(directory, 'all_books.snap'),
+            os.path.join(directory, 'all_books.json'), compact_every=10 ** 9,
+        )
+
+
+class BatchBooksTests(TestCase):
+    """Пакетное изменение и удаление книг базы через /batch/"""
+
+    def setUp(self):
+        self.books = [Book.objects.create(**make_book(number)) for number in range(5)]
+
+    def post(self, payload):
+        return self.client.post('/batch/', json.dumps(payload), content_type='application/json')
+
+    def test_update_and_delete(self):
+        first, second = self.books[0], self.books[1]
+        response = self.post({
+            'update': [{'id': first.pk, 'title': 'New title', 'year': 1999, 'author': 'Someone'}],
+            'delete': [second.pk],
+        })
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual((data['updated'], data['deleted']), (1, 1))
+        first.refresh_from_db()
+        self.assertEqual((first.title, first.year, first.author, first.genre), ('New title', 1999, 'Someone', None))
+        self.assertFalse(Book.objects.filter(pk=second.pk).exists())
+
+    def test_per_item_errors(self):
+        other = self.books[2]
+        response = self.post({
+            'update': [
+                {'id': self.books[0].pk, 'title': other.title, 'year': other.year},
+                {'id': self.books[1].pk, 'title': '', 'year': 2000},
+                {'id': 10 ** 6, 'title': 'Missing', 'year': 2000},
+                {'id': self.books[3].pk, 'title': 'Fine', 'year': 2000},
+            ],
+            'delete': [10 ** 6, self.books[4].pk],
+        })
+        results = response.json()['results']
+        self.assertEqual([result['success'] for result in results], [False, False, False, True, False, True])
+        self.assertTrue(Book.objects.filter(pk=self.books[3].pk, title='Fine').exists())
+        self.assertEqual(Book.objects.count(), 4)
+
+    def test_update_may_take_key_of_deleted_book(self):
+        removed, renamed = self.books[0], self.books[1]
+        response = self.post({
+            'update': [{'id': renamed.pk, 'title': removed.title, 'year': removed.year,
+                        'author': removed.author}],
+            'delete': [removed.pk],
+        })
+        data = response.json()
+        self.assertTrue(data['success'], data)
+        self.assertEqual((data['updated'], data['deleted']), (1, 1))
+        renamed.refresh_from_db()
+        self.assertEqual((renamed.title, renamed.author), (removed.title, removed.author))
+        self.assertFalse(Book.objects.filter(pk=removed.pk).exists())
+
+    def test_conflicts_inside_batch(self):
+        response = self.post({'update': [
+            {'id': self.books[0].pk, 'title': 'Same', 'year': 2000},
+            {'id': self.books[1].pk, 'title': 'Same', 'year': 2000},
+        ]})
+        self.assertEqual([result['success'] for result in response.json()['results']], [True, False])
+
+    def test_all_or_nothing(self):
+        response = self.post({
+            'update': [{'id': self.books[0].pk, 'title': 'Changed', 'year': 2000}],
+            'delete': [10 ** 6],
+            'all_or_nothing': True,
+        })
+        self.assertFalse(response.json()['success'])
+        self.assertFalse(Book.objects.filter(title='Changed').exists())
+
+    def test_bad_payload(self):
+        self.assertEqual(self.client.post('/batch/', 'not json', content_type='application/json').status_code, 400)
+        self.assertEqual(self.post({'update': {}}).status_code, 400)
+        self.assertEqual(self.client.get('/batch/').status_code, 405)
+
+
+class NearDuplicateTests(TestCase):
+    """Почти-дубликаты: нормализация, транслитерация, опечатки, числа в названии"""
+
+    def setUp(self):
+        self.index = NearDuplicateIndex()
+        self.index.extend([
+            (1, 'Война и мир', 'Лев Толстой', 1869),
+            (2, 'Dune', 'Frank Herbert', 1965),
+            (3, 'Harry Potter 2', 'J. K. Rowling', 1998),
+        ])
+
+    def matched_ids(self, title, author):
+        return [match['id'] for match in self.index.match(title, author)]
+
+    def test_variants_match(self):
+        self.assertEqual(self.matched_ids('VOINA I MIR!', 'Lev Tolstoi'), [1])
+        self.assertEqual(self.matched_ids('Война и  мир', 'Л. Толстой'), [1])
+        self.assertEqual(self.matched_ids('Войан и мир', 'Лев Толстой'), [1])
+        self.assertEqual(self.matched_ids('Dune', 'F. Herbert'), [2])
+
+    def test_different_books_do_not_match(self):
+        self.assertEqual(self.matched_ids('Dune Messiah', 'Frank Herbert'), [])
+        self.assertEqual(self.matched_ids('Dune', 'Someone Else'), [])
+        self.assertEqual(self.matched_ids('Harry Potter 3', 'J. K. Rowling'), [])
+
+    def test_report_checks_upload_itself(self):
+        report = NearDuplicateReport(self.index)
+        books = [
+            {'title': 'Война и мир', 'author': 'Лев Толстой', 'year': 1869},
+            {'title': 'Solaris', 'author': 'Stanislaw Lem', 'year': 1961},
+            {'title': 'Solyaris', 'author': 'Станислав Лем', 'year': 1961},
+        ]
+        self.assertEqual(len(list(flag_near_duplicates(books, report))), 3)
+        # Первая книга — точный дубликат: его пропустит сама загрузка
+        self.assertEqual(report.flagged, 1)
+        item = report.as_dict()['items'][0]
+        self.assertEqual(item['line'], 3)
+        self.assertEqual([match['line'] for match in item['upload']], [2])
+
+
+class StreamedUploadTests(TestCase):
+    """Приём файла BooksUploadHandler: проверка по мере приёма, лимиты, строгий режим"""
+
+    def upload(self, content, name='books.json', **fields):
+        return self.client.post('/upload/', {
+            'save_to': 'db', **fields, 'file': SimpleUploadedFile(name, content, 'application/json'),
+        })
+
+    def books(self, count, **fields):
+        return json.dumps([make_book(number, **fields) for number in range(count)]).encode()
+
+    def test_valid_file_is_imported(self):
+        response = self.upload(self.books(5))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.objects.count(), 5)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_large_file_is_kept_on_disk(self):
+        content = self.books(100)
+        handler = BooksUploadHandler()
+        handler.new_file('file', 'books.json', 'application/json', len(content))
+        handler.receive_data_chunk(content[:512], 0)
+        self.assertFalse(handler.file._rolled)
+        handler.receive_data_chunk(content[512:], 512)
+        self.assertTrue(handler.file._rolled)
+        uploaded = handler.file_complete(len(content))
+        self.addCleanup(uploaded.close)
+        self.assertEqual(b''.join(uploaded.chunks()), content)
+        self.assertEqual(uploaded.report.total, 100)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_spooled_file_is_imported(self):
+        self.upload(self.books(100))
+        self.assertEqual(Book.objects.count(), 100)
+
+    def test_rejected_file_is_closed(self):
+        handler = BooksUploadHandler()
+        handler.new_file('file', 'books.json', 'application/json', None)
+        handler.receive_data_chunk(b'[{"title": "A", "year": 2000}', 0)
+        self.assertIsNone(handler.file_complete(29))
+        self.assertTrue(handler.file.closed)
+
+    def test_broken_json_is_rejected(self):
+        response = self.upload(b'[{"title": "A", "year": 2000},')
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'неожиданный конец файла', status_code=400)
+        self.assertEqual(Book.objects.count(), 0)
+
+    @override_settings(BOOKS_UPLOAD_MAX_RECORDS=3)
+    def test_record_limit(self):
+        self.assertEqual(self.upload(self.books(4)).status_code, 400)
+        self.assertEqual(self.upload(self.books(3)).status_code, 200)
+
+    @override_settings(BOOKS_UPLOAD_MAX_BYTES=1024)
+    def test_size_limit(self):
+        response = self.upload(b'[' + b' ' * 4096 + b']')
+        self.assertEqual(response.status_code, 400)
+
+    def test_size_rejection_resets_connection(self):
+        handler = BooksUploadHandler(max_bytes=1024)
+        handler.new_file('file', 'books.json', 'application/json', None)
+        with self.assertRaises(StopUpload) as raised:
+            handler.receive_data_chunk(b'[' + b' ' * 2048, 0)
+        self.assertTrue(raised.exception.connection_reset)
+
+    def test_record_rejection_resets_connection(self):
+        handler = BooksUploadHandler(max_records=3)
+        handler.new_file('file', 'books.json', 'application/json', None)
+        with self.assertRaises(StopUpload) as raised:
+            handler.receive_data_chunk(self.books(4), 0)
+        self.assertTrue(raised.exception.connection_reset)
+        self.assertEqual(handler.error, "В файле больше 3 книг")
+
+    @override_settings(BOOKS_UPLOAD_RESET_ON_REJECT=False)
+    def test_rejection_can_read_rest_of_body(self):
+        handler = BooksUploadHandler(max_bytes=1024)
+        handler.new_file('file', 'books.json', 'application/json', None)
+        with self.assertRaises(StopUpload) as raised:
+            handler.receive_data_chunk(b'[' + b' ' * 2048, 0)
+        self.assertFalse(raised.exception.connection_reset)
+
+    def test_strict_and_partial_modes(self):
+        content = json.dumps([make_book(1), {'title': ''}]).encode()
+        self.upload(content)
+        self.assertEqual(Book.objects.count(), 0)
+        self.upload(content, partial='1')
+        self.assertEqual(Book.objects.count(), 1)
+
+
+class ProxyCacheHeadersTests(TestCase):
+    """Заголовки для микрокэша nginx: s-maxage у общих страниц, cookie CSRF один раз"""
+
+    def test_catalogue_pages_are_shared_for_a_few_seconds(self):
+        self.client.get('/?source=db')
+        for url in ('/?source=db', '/search/?q=book'):
+            response = self.client.get(url)
+            self.assertEqual(response['Cache-Control'], 'max-age=0, s-maxage=1')
+            self.assertNotIn('csrftoken', response.cookies)
+
+    def test_response_setting_csrf_cookie_is_private(self):
+        response = self.client.get('/?source=db')
+        self.assertIn('csrftoken', response.cookies)
+        self.assertIn('private', response['Cache-Control'])
+
+    @override_settings(BOOKS_PROXY_CACHE_SECONDS=0)
+    def test_proxy_cache_can_be_disabled(self):
+        response = self.client.get('/search/?q=book')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=0')
+
+
+class JsonlBackendTests(TestCase):
+    """Журнал JSON Lines: дозапись, уплотнение и перенос из all_books.json и обратно"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.log_path = os.path.join(self.directory, 'all_books.jsonl')
+        self.json_path = os.path.join(self.directory, 'all_books.json')
+        self.backend = JsonlFileBackend(self.log_path, self.json_path, compact_every=10 ** 9)
+
+    def read_lines(self):
+        with open(self.log_path, 'rb') as f:
+            return f.read().splitlines()
+
+    def test_append_writes_one_clean_line_per_book(self):
+        self.backend.append([make_book(1, genre='  '), make_book(2, author=' Leo ')])
+        self.backend.append([make_book(3)])
+        lines = [json.loads(line) for line in self.read_lines()]
+        self.assertEqual([book['title'] for book in lines], ['Book 1', 'Book 2', 'Book 3'])
+        self.assertNotIn('genre', lines[0])
+        self.assertEqual(lines[1]['author'], 'Leo')
+
+    def test_append_after_torn_line_starts_new_line(self):
+        self.backend.append([make_book(1)])
+        with open(self.log_path, 'ab') as f:
+            f.write(b'{"title": "Torn')
+        self.backend.append([make_book(2)])
+        self.assertEqual([book['title'] for book in self.backend.load()], ['Book 1', 'Book 2'])
+
+    def test_torn_last_line_does_not_rewrite_log_on_every_load(self):
+        self.backend.append([make_book(1)])
+        with open(self.log_path, 'ab') as f:
+            f.write(b'{"title": "Torn')
+        inode = os.stat(self.log_path).st_ino
+        # Уплотнение синхронно: если его запустит чтение, журнал сменит inode
+        with mock.patch.object(self.backend, 'schedule_compaction',
+                               side_effect=self.backend.compact) as schedule:
+            for _ in range(3):
+                self.assertEqual([book['title'] for book in self.backend.load()], ['Book 1'])
+        schedule.assert_not_called()
+        self.assertEqual(os.stat(self.log_path).st_ino, inode)
+
+    def test_compaction_drops_broken_lines_and_keeps_books(self):
+        self.backend.append([make_book(1)])
+        with open(self.log_path, 'ab') as f:
+            f.write(b'not json\n[1, 2]\n')
+        self.backend.append([make_book(2)])
+        self.backend.compact()
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual([book['title'] for book in self.backend.load()], ['Book 1', 'Book 2'])
+
+    def test_compaction_is_scheduled_after_compact_every_books(self):
+        backend = JsonlFileBackend(self.log_path, self.json_path, compact_every=2)
+        with mock.patch.object(backend, 'schedule_compaction') as schedule:
+            backend.append([make_book(1)])
+            schedule.assert_not_called()
+            backend.append([make_book(2)])
+            schedule.assert_called_once()
+
+    def test_legacy_json_is_migrated_and_can_be_converted_back(self):
+        with open(self.json_path, 'w', encoding='utf-8') as f:
+            json.dump([make_book(1), make_book(2)], f)
+        self.assertEqual(len(self.backend.load()), 2)
+        self.assertTrue(os.path.exists(self.json_path + '.bak'))
+        self.backend.append([make_book(3)])
+
+        count = convert_jsonl_to_json(
+            self.log_path, self.json_path, os.path.join(self.directory, 'all_books.snap'),
+        )
+        self.assertEqual(count, 3)
+        self.assertFalse(os.path.exists(self.log_path))
+        self.assertEqual(len(JsonFileBackend(self.json_path).load()), 3)
+
+
+class DuplicateIndexTests(TestCase):
+    """Индекс ключей файла: догоняет журнал, ключ из BOOKS_DUPLICATE_KEY"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.backend = JsonlFileBackend(
+            os.path.join(directory, 'all_books.jsonl'), os.path.join(directory, 'all_books.json'),
+            compact_every=10 ** 9,
+        )
+        self.index = DuplicateIndex(self.backend, ['title', 'author'])
+
+    def test_key_ignores_case_and_spaces(self):
+        self.backend.append([make_book(1, title='War  and Peace', author='Leo Tolstoy')])
+        new_books, duplicates = self.index.split([
+            make_book(2, title=' war and peace ', author='LEO TOLSTOY'),
+            make_book(3, title='War and Peace', author='Someone'),
+        ])
+        self.assertEqual([book['author'] for book in new_books], ['Someone'])
+        self.assertEqual(len(duplicates), 1)
+
+    def test_refresh_reads_only_appended_books(self):
+        self.backend.append([make_book(1), make_book(2)])
+        self.index.refresh()
+        self.assertEqual(self.index.size, 2)
+        results = []
+        read_since = self.backend.read_since
+        with mock.patch.object(self.backend, 'read_since',
+                               side_effect=lambda cursor: results.append(read_since(cursor)) or results[-1]):
+            self.backend.append([make_book(3)])
+            self.index.refresh()
+        books, _, full = results[0]
+        self.assertFalse(full)
+        self.assertEqual([book['title'] for book in books], ['Book 3'])
+        self.assertEqual(self.index.size, 3)
+        self.assertIn(make_book(3), self.index)
+
+    def test_rewrite_rebuilds_index(self):
+        self.backend.append([make_book(1), make_book(2)])
+        self.index.refresh()
+        self.backend.save([make_book(2)])
+        self.index.refresh()
+        self.assertEqual(self.index.size, 1)
+        self.assertNotIn(make_book(1), self.index)
+
+    def test_file_duplicate_message_uses_key_fields(self):
+        repository = FileBookRepository(self.backend)
+        repository.add({'title': 'Dune', 'year': 1965, 'author': 'Frank Herbert'})
+        with mock.patch('books.views.get_repository', return_value=repository):
+            response = self.client.post('/add/', {
+                'title': 'Dune', 'year': 1970, 'author': 'Frank Herbert', 'save_to': 'file',
+            }, follow=True)
+        self.assertContains(response, "(Frank Herbert) уже существует в файлах")
+
+
+class CatalogueCacheTests(TestCase):
+    """Кэш каталога в памяти: действителен, пока не изменился stat() файла"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.backend = JsonlFileBackend(
+            os.path.join(directory, 'all_books.jsonl'), os.path.join(directory, 'all_books.json'),
+            compact_every=10 ** 9,
+        )
+        self.backend.append([make_book(1), make_book(2)])
+        self.cache = CatalogueCache(self.backend, max_age=0)
+
+    def test_unchanged_file_is_not_read_again(self):
+        rows = self.cache.get()
+        with mock.patch.object(self.backend, 'load_rows') as load_rows:
+            self.assertIs(self.cache.get(), rows)
+            load_rows.assert_not_called()
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_changed_file_is_reloaded(self):
+        self.assertEqual(len(self.cache.get()), 2)
+        self.backend.append([make_book(3)])
+        self.assertEqual([row[0] for row in self.cache.get()], ['Book 1', 'Book 2', 'Book 3'])
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_max_age_forces_reload(self):
+        cache = CatalogueCache(self.backend, max_age=60)
+        cache.get()
+        with mock.patch('books.utils.time.monotonic', return_value=time.monotonic() + 61):
+            cache.get()
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    @override_settings(BOOKS_METRICS=True, BOOKS_METRICS_DIR='')
+    def test_cache_counters_are_exported(self):
+        with mock.patch('books.utils.get_catalogue_cache', return_value=self.cache):
+            self.cache.get()
+            self.cache.get()
+            response = self.client.get('/metrics')
+        self.assertContains(response, 'books_cache_requests_total{cache="catalogue",result="hit"} 1')
+        self.assertContains(response, 'books_cache_requests_total{cache="catalogue",result="miss"} 1')
+        self.assertContains(response, 'books_cache_entries{cache="catalogue"} 2')
+
+
+class PaginationTests(TestCase):
+    """Keyset-пагинация базы по (title, id) и пагинация файла по смещению"""
+
+    def setUp(self):
+        # bulk_create не меняет версию каталога — ответы прошлых тестов не нужны
+        cache.clear()
+
+    def test_keyset_pages_follow_title_order_with_equal_titles(self):
+        Book.objects.bulk_create([
+            Book(title=title, year=2000, author=f"Author {number}")
+            for number, title in enumerate(['B', 'A', 'B', 'C', 'B'])
+        ])
+        seen, cursor = [], None
+        while True:
+            rows, page = paginate_queryset(Book.objects.values('id', 'title'), 2, cursor)
+            seen.extend((row['title'], row['id']) for row in rows)
+            if not page['has_more']:
+                break
+            cursor = page['next_cursor']
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_page_after_insert_does_not_repeat_rows(self):
+        Book.objects.bulk_create([Book(title=f"T{number}", year=2000) for number in range(4)])
+        rows, page = paginate_queryset(Book.objects.values('id', 'title'), 2)
+        Book.objects.create(title='A', year=2000)
+        rows2, _ = paginate_queryset(Book.objects.values('id', 'title'), 2, page['next_cursor'])
+        self.assertEqual([row['title'] for row in rows2], ['T2', 'T3'])
+
+    def test_broken_cursor_means_first_page(self):
+        self.assertIsNone(decode_cursor('not base64!'))
+        self.assertEqual(decode_cursor(encode_cursor({'offset': 5})), {'offset': 5})
+        rows, page = paginate_list(list(range(5)), 2, 'garbage')
+        self.assertEqual(rows, [0, 1])
+        rows, page = paginate_list(list(range(5)), 2, encode_cursor({'offset': 4}))
+        self.assertEqual(rows, [4])
+        self.assertFalse(page['has_more'])
+
+    @override_settings(BOOKS_PAGE_SIZE=2, BOOKS_MAX_PAGE_SIZE=3)
+    def test_search_api_pages(self):
+        Book.objects.bulk_create([Book(title=f"T{number}", year=2000) for number in range(5)])
+        data = self.client.get('/search/?limit=100').json()
+        self.assertEqual(len(data['results']), 3)
+        data = self.client.get('/search/', {'cursor': data['next_cursor']}).json()
+        self.assertEqual([book['title'] for book in data['results']], ['T3', 'T4'])
+        self.assertFalse(data['has_more'])
+
+
+class DatabaseSearchTests(TestCase):
+    """Поиск по базе: полнотекстовый индекс, триггеры и подстрока, как у файла"""
+
+    def titles(self, query, limit=10):
+        rows, _ = search_books_page(query, limit)
+        return [row['title'] for row in rows]
+
+    def test_index_follows_insert_update_delete(self):
+        book = Book.objects.create(title='Остров сокровищ', year=1883, author='Стивенсон')
+        self.assertEqual(self.titles('сокров'), ['Остров сокровищ'])
+        Book.objects.filter(pk=book.pk).update(title='Чёрная стрела')
+        self.assertEqual(self.titles('сокров'), [])
+        self.assertEqual(self.titles('стрела'), ['Чёрная стрела'])
+        Book.objects.filter(pk=book.pk).delete()
+        self.assertEqual(self.titles('стрела'), [])
+
+    def test_substring_inside_word_is_found(self):
+        Book.objects.create(title='Остров сокровищ', year=1883, author='Стивенсон')
+        Book.objects.create(title='Таинственный остров', year=1875, author='Жюль Верн')
+        self.assertEqual(len(self.titles('стров')), 2)
+        self.assertEqual(self.titles('ВЕНСОН'), ['Остров сокровищ'])
+
+    def test_word_prefix_matches_rank_before_substrings(self):
+        Book.objects.create(title='Кассета', year=2000)
+        Book.objects.create(title='Сеть', year=2000)
+        self.assertEqual(self.titles('сет'), ['Сеть', 'Кассета'])
+
+    def test_short_query_matches_word_prefixes(self):
+        Book.objects.create(title='Остров', year=1900)
+        Book.objects.create(title='Сад', year=1900)
+        self.assertEqual(self.titles('ос'), ['Остров'])
+
+    def test_quotes_in_query_are_literal(self):
+        Book.objects.create(title='Книга "Ответов"', year=1900)
+        self.assertEqual(self.titles('га "Отв'), ['Книга "Ответов"'])
+
+    def test_substring_search_uses_trigram_index(self):
+        Book.objects.create(title='Остров сокровищ', year=1883, author='Стивенсон')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.titles('ровищ'), ['Остров сокровищ'])
+        sql = queries.captured_queries[0]['sql']
+        self.assertIn('books_book_trgm MATCH', sql)
+        self.assertNotIn('instr(', sql)
+
+    def test_search_matches_file_catalogue(self):
+        books = [
+            make_book(1, title='Остров сокровищ', author='Стивенсон'),
+            make_book(2, title='Война и мир', author='Лев Толстой'),
+        ]
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        file_repository = FileBookRepository(JsonlFileBackend(
+            os.path.join(directory, 'all_books.jsonl'), os.path.join(directory, 'all_books.json'),
+        ))
+        file_repository.bulk_insert(books)
+        OrmBookRepository().bulk_insert(books)
+        for query in ('стров', 'ТОЛСТ', 'и мир', 'ров сок'):
+            file_rows, _ = file_repository.search(query, 10)
+            db_rows, _ = OrmBookRepository().search(query, 10)
+            self.assertEqual(sorted(row['title'] for row in db_rows),
+                             sorted(row['title'] for row in file_rows), query)
+
+
+class JsonStreamParserTests(TestCase):
+    """Потоковый разбор JSON: элементы по мере прихода кусков и ошибки синтаксиса"""
+
+    def parse(self, data, chunk_size=3):
+        parser = JsonStreamParser()
+        items = []
+        for start in range(0, len(data), chunk_size):
+            items.extend(parser.feed(data[start:start + chunk_size]))
+        items.extend(parser.close())
+        return items
+
+    def test_items_split_across_chunks(self):
+        data = json.dumps([{'title': 'Война и мир', 'year': 1869}, {'pages': 12345}]).encode()
+        for chunk_size in (1, 2, 7, len(data)):
+            self.assertEqual(self.parse(data, chunk_size),
+                             [{'title': 'Война и мир', 'year': 1869}, {'pages': 12345}])
+
+    def test_single_object_and_empty_array(self):
+        self.assertEqual(self.parse(b'{"title": "A"}'), [{'title': 'A'}])
+        self.assertEqual(self.parse(b'\xef\xbb\xbf [ ] '), [])
+
+    def test_items_are_returned_before_the_end(self):
+        parser = JsonStreamParser()
+        self.assertEqual(parser.feed(b'[{"a": 1}, {"b"'), [{'a': 1}])
+
+    def test_syntax_errors(self):
+        cases = {
+            b'[{"a": 1}': 'неожиданный конец файла',
+            b'[{"a": 1} {"b": 2}]': "ожидалась ','",
+            b'"text"': 'объект или массив',
+            b'[{"a": 1}] x': 'лишние данные',
+            b'[{"a": 1,}]': 'символ',
+            b'[{"a": "\xff"}]': 'UTF-8',
+        }
+        for data, message in cases.items():
+            with self.assertRaises(JsonStreamError) as raised:
+                self.parse(data)
+            self.assertIn(message, str(raised.exception), data)
+
+    def test_oversized_record_is_rejected_without_waiting_for_the_end(self):
+        parser = JsonStreamParser(max_record_chars=100)
+        with self.assertRaises(JsonStreamError):
+            parser.feed(b'[{"title": "' + b'x' * 200)
+
+    def test_report_collects_invalid_books(self):
+        report = UploadReport()
+        data = json.dumps([make_book(1), {'title': ''}, 5, make_book(2, year='abc')]).encode()
+        books = list(validate_books_stream(iter_json_records([data], report), report))
+        self.assertEqual([book['title'] for book in books], ['Book 1'])
+        self.assertEqual((report.total, report.valid, report.invalid), (4, 1, 3))
+        self.assertIn('#3', report.errors[1])
+
+
+class BulkImportTests(TestCase):
+    """Пакетная запись в базу: счётчики и обработка дубликатов"""
+
+    def import_books(self, books, on_conflict='skip', **kwargs):
+        return import_books_to_db(books, UploadReport(), on_conflict, **kwargs)
+
+    def test_counts_only_matching_keys_of_the_batch(self):
+        Book.objects.create(title='Dune', year=1965, author='Someone')
+        Book.objects.create(title='Dune', year=1965, author='Other')
+        new_book = [{'title': 'Dune', 'year': 1965, 'author': 'Herbert'}]
+        self.assertEqual(self.import_books(new_book), {'inserted': 1, 'updated': 0, 'skipped': 0, 'failed': 0})
+        Book.objects.filter(author='Herbert').delete()
+        self.assertEqual(self.import_books(new_book, 'update'),
+                         {'inserted': 1, 'updated': 0, 'skipped': 0, 'failed': 0})
+
+    def test_skip_and_update_existing(self):
+        Book.objects.create(title='Dune', year=1965, author='Herbert')
+        Book.objects.create(title='Dune', year=1965, author='Other')
+        books = [{'title': 'Dune', 'year': 1970, 'author': 'Herbert'}, make_book(1)]
+        self.assertEqual(self.import_books(books), {'inserted': 1, 'updated': 0, 'skipped': 1, 'failed': 0})
+        counts = self.import_books(books, 'update')
+        self.assertEqual(counts, {'inserted': 0, 'updated': 2, 'skipped': 0, 'failed': 0})
+        self.assertEqual(Book.objects.get(title='Dune', author='Herbert').year, 1970)
+        self.assertEqual(Book.objects.get(title='Dune', author='Other').year, 1965)
+
+    def test_duplicates_inside_batch_and_books_without_author(self):
+        Book.objects.create(title='Anonymous', year=1900)
+        books = [
+            make_book(1), make_book(1, year=1990),
+            {'title': 'Anonymous', 'year': 1950}, {'title': 'Anonymous', 'year': 1960},
+        ]
+        counts = self.import_books(books, 'update', batch_size=2)
+        self.assertEqual(counts, {'inserted': 1, 'updated': 1, 'skipped': 2, 'failed': 0})
+        self.assertEqual(Book.objects.get(title='Anonymous').year, 1960)
+        self.assertEqual(Book.objects.get(title='Book 1').year, 1990)
+
+    def test_values_too_long_are_reported(self):
+        report = UploadReport()
+        counts = import_books_to_db([make_book(1, title='x' * 300), make_book(2)], report)
+        self.assertEqual(counts['inserted'], 1)
+        self.assertEqual(report.invalid, 1)
+
+
+class SqliteMigrationTests(TestCase):
+    """Перенос из старой SQLite: пачки, контрольная точка и продолжение после сбоя"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.sqlite_path = os.path.join(directory, 'old.sqlite3')
+        self.checkpoint = self.sqlite_path + '.checkpoint.json'
+        with sqlite3.connect(self.sqlite_path) as conn:
+            conn.execute("CREATE TABLE books_book (title TEXT, year INTEGER, author TEXT, "
+                         "genre TEXT, pages TEXT)")
+            conn.executemany("INSERT INTO books_book VALUES (?, ?, ?, NULL, NULL)",
+                             [(f"Book {number}", 2000, f"Author {number}") for number in range(1, 8)])
+        with open(self.checkpoint, 'w', encoding='utf-8') as f:
+            json.dump({'workers': 1, 'shards': {}}, f)
+        self.options = {
+            'sqlite_path': self.sqlite_path, 'batch_size': 3,
+            'checkpoint': self.checkpoint, 'on_conflict': 'update',
+        }
+
+    def migrate(self, start=0):
+        return migrate_range(0, start, 7, self.options, queue.Queue(), threading.Lock())
+
+    def test_rows_are_copied_and_checkpoint_saved(self):
+        counts = self.migrate()
+        self.assertEqual(counts['inserted'], 7)
+        self.assertEqual(Book.objects.count(), 7)
+        self.assertEqual(load_checkpoint(self.checkpoint)['shards'], {'0': 7})
+
+    def test_resume_after_failure_continues_from_checkpoint(self):
+        calls = []
+
+        def fail_second_batch(books, on_conflict, counts):
+            calls.append(len(books))
+            if len(calls) == 2:
+                raise DatabaseError("connection lost")
+            return write_batch(books, on_conflict, counts)
+
+        with mock.patch('books.management.commands.migrate_sqlite_to_postgres.write_batch',
+                        side_effect=fail_second_batch):
+            with self.assertRaises(DatabaseError):
+                self.migrate()
+        last_rowid = load_checkpoint(self.checkpoint)['shards']['0']
+        self.assertEqual(last_rowid, 3)
+        self.assertEqual(Book.objects.count(), 3)
+
+        counts = self.migrate(last_rowid)
+        self.assertEqual(counts, {'inserted': 4, 'updated': 0, 'skipped': 0, 'failed': 0})
+        self.assertEqual(Book.objects.count(), 7)
+
+    def test_checkpoint_for_other_worker_count_is_refused(self):
+        with self.assertRaises(CommandError):
+            call_command('migrate_sqlite_to_postgres', sqlite_path=self.sqlite_path, workers=2,
+                         stdout=io.StringIO())
+
+
+class ImportJobQueueTests(TestCase):
+    """Очередь фоновых загрузок: захват задания, возврат зависших, итог"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(BOOKS_IMPORT_JOBS_DIR=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def enqueue(self, books, **options):
+        upload = SimpleUploadedFile('books.json', json.dumps(books).encode(), 'application/json')
+        return enqueue_upload(upload, save_to='db', **options)
+
+    def test_job_is_claimed_once(self):
+        job = self.enqueue([make_book(1)])
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, ImportJob.STATUS_RUNNING)
+        self.assertIsNotNone(claimed.heartbeat_at)
+        self.assertIsNone(claim_next_job())
+
+    def test_oldest_job_is_claimed_first(self):
+        self.enqueue([make_book(2)])
+        first = self.enqueue([make_book(1)])
+        ImportJob.objects.filter(pk=first.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(claim_next_job().pk, first.pk)
+
+    def test_stale_job_is_requeued(self):
+        job = self.enqueue([make_book(1)])
+        claim_next_job()
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 0)
+        ImportJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(minutes=5), bytes_read=10,
+        )
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_QUEUED)
+        self.assertEqual(job.bytes_read, 0)
+        self.assertEqual(claim_next_job().pk, job.pk)
+
+    def test_process_job_records_counts_and_removes_payload(self):
+        Book.objects.create(**make_book(1))
+        job = self.enqueue([make_book(1), make_book(2), make_book(3)])
+        job = process_job(claim_next_job())
+        self.assertEqual(job.status, ImportJob.STATUS_DONE)
+        self.assertEqual((job.inserted, job.skipped, job.failed), (2, 1, 0))
+        self.assertEqual(job.processed, 3)
+        self.assertEqual(job.progress, 100)
+        self.assertFalse(os.path.exists(job.payload_path))
+
+    def test_invalid_file_fails_job_without_saving(self):
+        job = self.enqueue([make_book(1), {'title': ''}])
+        job = process_job(claim_next_job())
+        self.assertEqual(job.status, ImportJob.STATUS_FAILED)
+        self.assertTrue(job.error.startswith("Загрузка отменена."))
+        self.assertFalse(Book.objects.exists())
+
+    def test_partial_job_saves_valid_books(self):
+        job = self.enqueue([make_book(1), {'title': ''}], partial=True)
+        job = process_job(claim_next_job())
+        self.assertEqual(job.status, ImportJob.STATUS_DONE)
+        self.assertEqual((job.inserted, job.failed), (1, 1))
+        self.assertEqual(len(job.errors), 1)
+
+
+class FileLockingTests(TestCase):
+    """Блокировка файла, атомарная замена и оптимистичная перезапись каталога"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.log_path = os.path.join(self.directory, 'all_books.jsonl')
+        self.json_path = os.path.join(self.directory, 'all_books.json')
+        self.backend = JsonlFileBackend(self.log_path, self.json_path, compact_every=10 ** 9)
+
+    def test_nested_lock_in_same_thread(self):
+        lock = FileLock(self.log_path)
+        with lock.exclusive():
+            with lock.shared():
+                pass
+            with lock.exclusive():
+                pass
+        with lock.shared():
+            with self.assertRaises(RuntimeError):
+                with lock.exclusive():
+                    pass
+        # После выхода блокировку снова можно взять исключительно
+        with lock.exclusive():
+            pass
+
+    def test_atomic_write_replaces_file_without_temp_files(self):
+        atomic_write(self.json_path, [b'[', b']'])
+        with open(self.json_path, 'rb') as f:
+            self.assertEqual(f.read(), b'[]')
+        self.assertEqual(os.listdir(self.directory), ['all_books.json'])
+
+    def test_failed_atomic_write_keeps_old_file(self):
+        atomic_write(self.json_path, [b'[]'])
+
+        def chunks():
+            yield b'[{"title": '
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            atomic_write(self.json_path, chunks())
+        with open(self.json_path, 'rb') as f:
+            self.assertEqual(f.read(), b'[]')
+        self.assertEqual(os.listdir(self.directory), ['all_books.json'])
+
+    def test_save_with_stale_version_conflicts(self):
+        self.backend.append([make_book(1)])
+        _, version = self.backend.load_with_version()
+        self.backend.append([make_book(2)])
+        with self.assertRaises(CatalogueConflict):
+            self.backend.save([make_book(3)], expected_version=version)
+
+    def test_update_retries_after_concurrent_append(self):
+        self.backend.append([make_book(1)])
+        other = JsonlFileBackend(self.log_path, self.json_path, compact_every=10 ** 9)
+        attempts = []
+
+        def modify(books):
+            attempts.append(len(books))
+            if len(attempts) == 1:
+                # Другой процесс дописывает книгу между чтением и записью
+                other.append([make_book(2)])
+            return [dict(book, genre='Роман') for book in books]
+
+        update_all_books_in_file(modify, backend=self.backend)
+        self.assertEqual(attempts, [1, 2])
+        books = self.backend.load()
+        self.assertEqual([book['title'] for book in books], ['Book 1', 'Book 2'])
+        self.assertEqual({book['genre'] for book in books}, {'Роман'})
+
+    def test_update_gives_up_after_retries(self):
+        self.backend.append([make_book(1)])
+
+        def modify(books):
+            self.backend.append([make_book(len(books) + 1)])
+            return books
+
+        with self.assertRaises(CatalogueConflict):
+            update_all_books_in_file(modify, retries=2, backend=self.backend)
+
+    def test_upsert_keeps_books_appended_during_rewrite(self):
+        repository = FileBookRepository(self.backend)
+        repository.bulk_insert([make_book(1), make_book(2)])
+        save = self.backend.save
+        appended = []
+
+        def save_after_concurrent_append(books, expected_version):
+            if not appended:
+                # Другой процесс дописывает книгу перед первой записью
+                appended.append(make_book(3))
+                self.backend.append(appended)
+            return save(books, expected_version)
+
+        with mock.patch.object(self.backend, 'save', side_effect=save_after_concurrent_append):
+            counts = repository.upsert([make_book(1, genre='Роман')])
+        self.assertEqual(counts['updated'], 1)
+        books = {book['title']: book for book in self.backend.load()}
+        self.assertEqual(sorted(books), ['Book 1', 'Book 2', 'Book 3'])
+        self.assertEqual(books['Book 1']['genre'], 'Роман')
+
+
+class SnapshotTests(TestCase):
+    """Колоночный снимок каталога: кодирование, чтение через mmap и уплотнение журнала"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.snapshot_path = os.path.join(self.directory, 'all_books.snap')
+        self.log_path = os.path.join(self.directory, 'all_books.jsonl')
+        self.backend = SnapshotFileBackend(
+            self.log_path, self.snapshot_path, os.path.join(self.directory, 'all_books.json'),
+            compact_every=10 ** 9,
+        )
+
+    def write_snapshot(self, books, log_inode=0, log_offset=0):
+        with open(self.snapshot_path, 'wb') as f:
+            for chunk in encode_snapshot(books, log_inode, log_offset):
+                f.write(chunk)
+
+    def open_snapshot(self, books, log_inode=0, log_offset=0):
+        self.write_snapshot(books, log_inode, log_offset)
+        snapshot = SnapshotCatalogue(self.snapshot_path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_round_trip_keeps_values_and_types(self):
+        books = [
+            {'title': 'Война и мир', 'year': 1869, 'author': 'Лев Толстой', 'pages': 1225},
+            {'title': 'Book', 'year': 2001, 'genre': 'Роман', 'pages': 12.5},
+            {'title': 'Flag', 'year': True, 'extra': 'не сохраняется'},
+        ]
+        snapshot = self.open_snapshot(books, log_inode=7, log_offset=42)
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(list(snapshot), [
+            books[0], books[1], {'title': 'Flag', 'year': True},
+        ])
+        self.assertEqual(snapshot[-1], {'title': 'Flag', 'year': True})
+        self.assertEqual(snapshot.rows[0], ('Война и мир', 1869, 'Лев Толстой', None, 1225))
+        self.assertEqual(list(snapshot.column('genre')), [None, 'Роман', None])
+        self.assertEqual((snapshot.log_inode, snapshot.log_offset), (7, 42))
+        with self.assertRaises(IndexError):
+            snapshot[3]
+
+    def test_repeated_values_are_stored_once(self):
+        books = [make_book(number, author='Один автор', genre='Роман') for number in range(100)]
+        size = sum(len(chunk) for chunk in encode_snapshot(books))
+        unique = [make_book(number, author=f"Автор {number}", genre=f"Жанр {number}")
+                  for number in range(100)]
+        self.assertLess(size, sum(len(chunk) for chunk in encode_snapshot(unique)))
+
+    def test_broken_files_are_rejected(self):
+        for content in (b'', b'BKSNAP01', b'NOTSNAP!' + bytes(HEADER.size)):
+            with open(self.snapshot_path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(SnapshotError):
+                SnapshotCatalogue(self.snapshot_path)
+        chunks = encode_snapshot([make_book(1)])
+        with open(self.snapshot_path, 'wb') as f:
+            f.write(b''.join(chunks)[:-3])
+        with self.assertRaises(SnapshotError):
+            SnapshotCatalogue(self.snapshot_path)
+
+    def test_compaction_moves_log_into_snapshot(self):
+        self.backend.append([make_book(1), make_book(2)])
+        self.backend.compact()
+        self.assertEqual(os.path.getsize(self.log_path), 0)
+        self.backend.append([make_book(3)])
+        books = self.backend.load()
+        self.assertEqual(len(books.snapshot), 2)
+        self.assertEqual([book['title'] for book in books], ['Book 1', 'Book 2', 'Book 3'])
+        self.assertEqual([row[0] for row in self.backend.load_rows()], ['Book 1', 'Book 2', 'Book 3'])
+        self.assertEqual([book['title'] for book in self.backend.iter_books()],
+                         ['Book 1', 'Book 2', 'Book 3'])
+
+    def test_log_already_in_snapshot_is_skipped(self):
+        # Снимок записан, а журнал ещё не заменён (процесс упал между шагами)
+        self.backend.append([make_book(1), make_book(2)])
+        st = os.stat(self.log_path)
+        self.write_snapshot([make_book(1), make_book(2)], st.st_ino, st.st_size)
+        self.backend.append([make_book(3)])
+        self.assertEqual([book['title'] for book in self.backend.load()],
+                         ['Book 1', 'Book 2', 'Book 3'])
+
+    def test_save_replaces_catalogue(self):
+        self.backend.append([make_book(1)])
+        self.backend.save([make_book(5), make_book(6)])
+        self.assertEqual([book['title'] for book in self.backend.load()], ['Book 5', 'Book 6'])
+        self.assertEqual(os.path.getsize(self.log_path), 0)
+
+
+class CatalogueRowsTests(TestCase):
+    """Нормализация книг при записи и отображение строк каталога"""
+
+    def test_clean_book_strips_strings_and_drops_empty_fields(self):
+        book = {'title': '  Идиот ', 'year': 1869, 'author': '', 'genre': '   ', 'pages': None,
+                'extra': 0}
+        self.assertEqual(clean_book(book), {'title': 'Идиот', 'year': 1869, 'extra': 0})
+
+    def test_book_row_follows_book_fields(self):
+        row = book_row({'pages': 100, 'title': 'Book', 'genre': 'Роман'})
+        self.assertEqual(row, ('Book', None, None, 'Роман', 100))
+        self.assertEqual(len(row), len(BOOK_FIELDS))
+
+    def test_display_books_fills_placeholders_lazily(self):
+        rows = [('Book 1', 2001, None, '', 100), ('  Book 2 ', None, ' Автор ', None, None)]
+        books = DisplayBooks(rows)
+        self.assertEqual(len(books), 2)
+        self.assertEqual(books[0], {'title': 'Book 1', 'year': '2001', 'author': '—',
+                                    'genre': '—', 'pages': '100'})
+        self.assertEqual(books[1:], [{'title': 'Book 2', 'year': '—', 'author': 'Автор',
+                                      'genre': '—', 'pages': '—'}])
+        self.assertEqual([book['title'] for book in books], ['Book 1', 'Book 2'])
+
+    def test_display_books_builds_only_requested_rows(self):
+        rows = mock.MagicMock()
+        rows.__getitem__.return_value = ('Book', None, None, None, None)
+        DisplayBooks(rows)[5]
+        rows.__getitem__.assert_called_once_with(5)
+
+
+class ConditionalCatalogueTests(TestCase):
+    """ETag/Last-Modified по версии каталога, ответы 304 и ключи кэша ответов"""
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(**make_book(1))
+        bump_catalogue_version()
+
+    def test_matching_etag_gets_304(self):
+        response = self.client.get('/search/?q=book')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+        self.assertIn('Last-Modified', response)
+        response = self.client.get('/search/?q=book', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_write_changes_etag_and_cached_response(self):
+        first = self.client.get('/search/?q=book')
+        self.assertEqual(len(first.json()['results']), 1)
+        self.client.post(f'/delete/{self.book.pk}/')
+        second = self.client.get('/search/?q=book', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.json()['results'], [])
+
+    def test_repeated_request_is_served_from_cache(self):
+        self.client.get('/search/?q=book')
+        # Остаётся только запрос версии каталога
+        with self.assertNumQueries(1):
+            response = self.client.get('/search/?q=book')
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_cache_key_depends_on_version_and_full_path(self):
+        request = RequestFactory().get('/search/', {'q': 'book', 'limit': 10})
+        other = RequestFactory().get('/search/', {'q': 'book', 'limit': 20})
+        key = view_cache_key(search_books, ('db-1', None), request)
+        self.assertNotEqual(key, view_cache_key(search_books, ('db-2', None), request))
+        self.assertNotEqual(key, view_cache_key(search_books, ('db-1', None), other))
+        self.assertEqual(key, view_cache_key(search_books, ('db-1', None), request))
+
+    def test_file_version_follows_file_signature(self):
+        backend = mock.Mock()
+        backend.signature.return_value = (1, 10, 2_000_000_000_000_000_000)
+        with mock.patch('books.caching.get_file_backend', return_value=backend):
+            version = catalogue_version('file')
+            backend.signature.return_value = (1, 20, 2_000_000_000_000_000_000)
+            self.assertNotEqual(catalogue_version('file')[0], version[0])
+        self.assertEqual(version[1].year, 2033)
+
+
+class SearchFieldsTests(TestCase):
+    """Выбор полей ответа поиска (?fields=) и кэш результатов поиска по файлу"""
+
+    def setUp(self):
+        cache.clear()
+        Book.objects.create(**make_book(1, genre='Роман'))
+
+    def test_parse_fields_keeps_only_allowed(self):
+        request = RequestFactory().get('/search/', {'fields': ' year, secret,title'})
+        self.assertEqual(parse_fields(request, BOOK_FIELDS), ['year', 'title'])
+        for value in ('', 'secret'):
+            request = RequestFactory().get('/search/', {'fields': value})
+            self.assertEqual(parse_fields(request, BOOK_FIELDS), list(BOOK_FIELDS))
+
+    def test_search_returns_requested_fields(self):
+        data = self.client.get('/search/', {'q': 'book', 'fields': 'id,title'}).json()
+        self.assertEqual(list(data['results'][0]), ['id', 'title'])
+        data = self.client.get('/search/', {'q': 'book'}).json()
+        self.assertEqual(set(data['results'][0]), set(SEARCH_FIELDS_DB))
+
+    def test_search_cache_refines_longest_cached_prefix(self):
+        rows = [book_row(make_book(1, title='Война и мир')), book_row(make_book(2, title='Воин')),
+                book_row(make_book(3, title='Остров'))]
+        search_cache = SearchCache()
+        self.assertEqual(len(search_cache.search(rows, 'Вои')), 1)
+        self.assertEqual(len(search_cache.search(rows, 'во')), 2)
+        with mock.patch('books.utils.row_matches', wraps=row_matches) as matches:
+            found = search_cache.search(rows, 'ВОЙН')
+        self.assertEqual([row[0] for row in found], ['Война и мир'])
+        # Фильтруется только результат «во», а не весь каталог
+        self.assertEqual(matches.call_count, 2)
+        self.assertEqual(search_cache.search(rows, 'войн'), found)
+        self.assertEqual(search_cache.stats(), {'hits': 1, 'refined': 1, 'misses': 2, 'size': 3})
+
+    def test_search_cache_resets_for_new_rows(self):
+        search_cache = SearchCache()
+        rows = [book_row(make_book(1))]
+        search_cache.search(rows, 'book')
+        new_rows = rows + [book_row(make_book(2))]
+        self.assertEqual(len(search_cache.search(new_rows, 'book')), 2)
+        self.assertEqual(search_cache.stats()['misses'], 2)
+
+    def test_search_cache_skips_too_broad_results(self):
+        search_cache = SearchCache(max_rows=1)
+        rows = [book_row(make_book(1)), book_row(make_book(2))]
+        search_cache.search(rows, 'book')
+        self.assertEqual(search_cache.stats()['size'], 0)
+
+
+class AsyncViewsTests(TestCase):
+    """Асинхронные представления: страница, поиск, правка и удаление через AsyncClient"""
+
+    def setUp(self):
+        cache.clear()
+        self.books = [Book.objects.create(**make_book(number)) for number in range(1, 4)]
+
+    async def test_index_lists_database_books(self):
+        response = await self.async_client.get('/', {'source': 'db', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book['title'] for book in response.context['books']], ['Book 1', 'Book 2'])
+        self.assertTrue(response.context['page']['has_more'])
+        self.assertTrue(response.context['db_active'])
+
+    async def test_index_reads_file_catalogue_in_thread_pool(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        backend = JsonlFileBackend(os.path.join(directory, 'all_books.jsonl'),
+                                   os.path.join(directory, 'all_books.json'))
+        backend.append([make_book(7, genre='Роман')])
+        with mock.patch('books.views.get_repository', return_value=FileBookRepository(backend)):
+            response = await self.async_client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['books']), [{
+            'title': 'Book 7', 'year': '2007', 'author': 'Author 0', 'genre': 'Роман', 'pages': '—',
+        }])
+
+    async def test_search_pages_through_results(self):
+        data = (await self.async_client.get('/search/', {'q': 'book', 'limit': 2})).json()
+        self.assertEqual(len(data['results']), 2)
+        data = (await self.async_client.get(
+            '/search/', {'q': 'book', 'limit': 2, 'cursor': data['next_cursor']}
+        )).json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertFalse(data['has_more'])
+
+    async def test_edit_updates_book(self):
+        book = self.books[0]
+        response = await self.async_client.post(f'/edit/{book.pk}/', {
+            'title': ' Новое название ', 'year': 1999, 'author': '', 'genre': 'Роман', 'pages': '',
+            'save_to': 'db',
+        })
+        self.assertEqual(response.json(), {'success': True})
+        book = await Book.objects.aget(pk=book.pk)
+        self.assertEqual((book.title, book.year, book.author, book.genre),
+                         ('Новое название', 1999, None, 'Роман'))
+
+    async def test_delete_removes_book(self):
+        book = self.books[0]
+        response = await self.async_client.post(f'/delete/{book.pk}/')
+        self.assertEqual(response.json(), {'success': True})
+        self.assertFalse(await Book.objects.filter(pk=book.pk).aexists())
+        response = await self.async_client.post(f'/delete/{book.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    """Выгрузка: под WSGI — синхронный поток, под ASGI — асинхронный, без сборки в список"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.backend = JsonlFileBackend(os.path.join(directory, 'all_books.jsonl'),
+                                        os.path.join(directory, 'all_books.json'))
+        self.backend.append([make_book(number) for number in range(1, 11)])
+        self.read = []
+        iter_books = self.backend.iter_books
+
+        def counted():
+            for book in iter_books():
+                self.read.append(book['title'])
+                yield book
+
+        patcher = mock.patch.object(self.backend, 'iter_books', counted)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('books.export.get_repository', return_value=FileBookRepository(self.backend))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_wsgi_export_is_sync_stream(self):
+        response = self.client.get('/export/', {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], ','.join(BOOK_FIELDS))
+        self.assertEqual(len(lines), 11)
+
+    @override_settings(BOOKS_EXPORT_CHUNK_SIZE=2)
+    async def test_asgi_export_reads_file_incrementally(self):
+        response = await self.async_client.get('/export/', {'format': 'jsonl'})
+        self.assertTrue(response.is_async)
+        chunks = aiter(response.streaming_content)
+        first = await anext(chunks)
+        self.assertEqual(json.loads(first)['title'], 'Book 1')
+        # К первому куску прочитан только первый кусок файла, а не весь каталог
+        self.assertEqual(len(self.read), 2)
+        rest = b''.join([chunk async for chunk in chunks])
+        titles = [json.loads(line)['title'] for line in (first + rest).decode('utf-8').splitlines()]
+        self.assertEqual(titles, [f"Book {number}" for number in range(1, 11)])
+
+    @override_settings(BOOKS_EXPORT_CHUNK_SIZE=2)
+    async def test_asgi_export_streams_database_with_aiterator(self):
+        for number in range(1, 6):
+            await Book.objects.acreate(**make_book(number))
+        with mock.patch('books.export.get_repository', return_value=OrmBookRepository()):
+            response = await self.async_client.get('/export/', {'source': 'db', 'format': 'jsonl', 'gzip': '1'})
+            self.assertTrue(response.is_async)
+            data = b''.join([chunk async for chunk in response.streaming_content])
+        lines = gzip.decompress(data).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines],
+                         [f"Book {number}" for number in range(1, 6)])
+
+
+class EditBookTests(TransactionTestCase):
+    """
+    Правка книги одним условным UPDATE: дубликаты отклоняются, книга не меняется.
+    Без общей транзакции теста, как в работающем приложении: ошибка
+    уникального ограничения в ней сделала бы транзакцию непригодной.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='Идиот', year=1869, author='Достоевский')
+        self.other = Book.objects.create(title='Бесы', year=1872, author='Достоевский')
+
+    def edit(self, pk, **fields):
+        data = {'title': 'Бесы', 'year': 1872, 'author': '', 'genre': '', 'pages': '',
+                'save_to': 'db', **fields}
+        return self.client.post(f'/edit/{pk}/', data)
+
+    def test_same_title_and_year_is_rejected(self):
+        response = self.edit(self.book.pk, author='Другой автор')
+        self.assertEqual(response.json(), {'success': False,
+                                           'error': 'Книга "Бесы" (1872) уже существует.'})
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.title, self.book.author), ('Идиот', 'Достоевский'))
+
+    def test_same_title_and_author_is_rejected(self):
+        response = self.edit(self.book.pk, year=1900, author='Достоевский')
+        self.assertEqual(response.json()['error'], 'Книга "Бесы" (Достоевский) уже существует.')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.year, 1869)
+
+    def test_book_may_keep_its_own_title_and_year(self):
+        response = self.edit(self.other.pk, genre='Роман')
+        self.assertEqual(response.json(), {'success': True})
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.genre, 'Роман')
+
+    def test_missing_book_is_404(self):
+        self.assertEqual(self.edit(10 ** 6, title='Новая').status_code, 404)
+
+    def test_edit_changes_catalogue_version(self):
+        version = catalogue_version('db')
+        self.edit(self.book.pk, title='Игрок', year=1866)
+        self.assertNotEqual(catalogue_version('db')[0], version[0])
+
+
+class UniqueTitleWithoutAuthorMigrationTests(TransactionTestCase):
+    """Миграция 0008 не удаляет книги без автора, а перечисляет мешающие дубликаты"""
+
+    before = [('books', '0007_importjob_near_duplicates')]
+    after = [('books', '0008_book_unique_title_no_author')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.addCleanup(self.migrate_to_latest)
+        self.Book = self.executor.loader.project_state(self.before).apps.get_model('books', 'Book')
+
+    def migrate_to_latest(self):
+        self.Book.objects.all().delete()
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+
+    def test_duplicates_stop_migration_and_are_kept(self):
+        ids = [self.Book.objects.create(title=title, year=2000).pk
+               for title in ('Сказки', 'Сказки', 'Стихи', 'Сказки')]
+        with self.assertRaises(CommandError) as raised:
+            self.migrate()
+        self.assertIn(f'"Сказки": id {ids[0]}, {ids[1]}, {ids[3]}', str(raised.exception))
+        self.assertNotIn('Стихи', str(raised.exception))
+        self.assertEqual(self.Book.objects.count(), 4)
+
+    def test_constraint_is_added_without_duplicates(self):
+        self.Book.objects.create(title='Сказки', year=2000)
+        self.Book.objects.create(title='Сказки', year=2001, author='Андерсен')
+        self.migrate()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.Book.objects.create(title='Сказки', year=2002)
+
+
+class ServerSettingsTests(TestCase):
+    """Постоянные соединения с базой, пул psycopg и настройки gunicorn из окружения"""
+
+    def database_settings(self, **env):
+        # Настройки читаются при импорте модуля — поэтому отдельный процесс
+        code = ("import json; from book_project import settings; "
+                "print(json.dumps(settings.DATABASES['default'], default=str))")
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, check=True,
+            capture_output=True, text=True, env={**os.environ, 'SECRET_KEY': 'x', **env},
+        )
+        return json.loads(result.stdout)
+
+    def test_persistent_connections_by_default(self):
+        database = self.database_settings(BOOKS_DB_CONN_MAX_AGE='30', BOOKS_DB_POOL='0')
+        self.assertEqual(database['CONN_MAX_AGE'], 30)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('pool', database.get('OPTIONS', {}))
+
+    def test_pool_replaces_persistent_connections_on_postgres(self):
+        database = self.database_settings(
+            DATABASE_URL='postgres://user:secret@db:5432/books', BOOKS_DB_POOL='1',
+            BOOKS_DB_POOL_MAX_SIZE='4',
+        )
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 2, 'max_size': 4, 'timeout': 10})
+
+    def test_pool_is_ignored_for_sqlite(self):
+        database = self.database_settings(DATABASE_URL='sqlite:///books.sqlite3', BOOKS_DB_POOL='1')
+        self.assertNotIn('pool', database.get('OPTIONS', {}))
+
+    def test_gunicorn_config_reads_environment(self):
+        path = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+        with mock.patch.dict(os.environ, {'GUNICORN_WORKERS': '3', 'GUNICORN_THREADS': '8',
+                                          'GUNICORN_PRELOAD': 'false'}):
+            config = runpy.run_path(path)
+        self.assertEqual((config['workers'], config['threads']), (3, 8))
+        self.assertFalse(config['preload_app'])
+        self.assertEqual(config['worker_class'], 'gthread')
+        # keep-alive к nginx дольше, чем nginx держит соединение с gunicorn (4 с)
+        self.assertGreater(config['keepalive'], 4)
+
+
+class RequestMetricsTests(TestCase):
+    """Замеры запроса: чтение файлов считается один раз, Server-Timing и /metrics"""
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.log_path = os.path.join(self.directory, 'all_books.jsonl')
+        self.json_path = os.path.join(self.directory, 'all_books.json')
+
+    def measured(self, read):
+        metrics = RequestMetrics()
+        token = metrics_context.set(metrics)
+        try:
+            read()
+        finally:
+            metrics_context.reset(token)
+        return metrics
+
+    def test_catalogue_reload_counts_file_bytes_once(self):
+        backends = [
+            JsonFileBackend(self.json_path),
+            JsonlFileBackend(self.log_path, self.json_path, compact_every=10 ** 9),
+        ]
+        for backend in backends:
+            backend.save([make_book(1), make_book(2)])
+            size = os.path.getsize(backend.path)
+            metrics = self.measured(CatalogueCache(backend).get)
+            self.assertEqual(metrics.file_bytes, size)
+            self.assertGreater(metrics.seconds['file'], 0)
+
+    def test_snapshot_counts_only_log_tail(self):
+        backend = SnapshotFileBackend(
+            self.log_path, os.path.join(self.directory, 'all_books.snap'), self.json_path,
+            compact_every=10 ** 9,
+        )
+        backend.append([make_book(1), make_book(2)])
+        backend.compact()
+        backend.append([make_book(3)])
+        metrics = self.measured(CatalogueCache(backend).get)
+        # Снимок читается из mmap при обращении; прочитан только журнал
+        self.assertEqual(metrics.file_bytes, os.path.getsize(self.log_path))
+
+    @override_settings(BOOKS_METRICS=True, BOOKS_METRICS_SERVER_TIMING=True, BOOKS_METRICS_DIR='')
+    def test_server_timing_header(self):
+        Book.objects.create(**make_book(1))
+        response = self.client.get('/search/?q=book')
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="[1-9]\d* queries", file;dur=[\d.]+, tpl;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+
+    @override_settings(BOOKS_METRICS=True, BOOKS_METRICS_SERVER_TIMING=False, BOOKS_METRICS_DIR='')
+    def test_metrics_export_request_histograms(self):
+        response = self.client.get('/search/?q=book')
+        self.assertNotIn('Server-Timing', response)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '# TYPE books_request_duration_seconds histogram')
+        self.assertContains(response, 'books_request_duration_seconds_bucket{view="books:search_books",le="+Inf"}')
+        self.assertContains(response, 'books_db_queries_total{view="books:search_books"}')
+
+    def test_metrics_disabled_by_default(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+class SyntheticCatalogueTests(TestCase):
+    """Синтетический каталог для бенчмарков: воспроизводимость и заполнение хранилищ"""
+
+    def test_books_are_deterministic_by_seed(self):
+        books = list(generate_books(50, seed=3))
+        self.assertEqual(len(books), 50)
+        self.assertEqual(books, list(generate_books(50, seed=3)))
+        self.assertNotEqual(books, list(generate_books(50, seed=4)))
+        self.assertEqual(len({(book['title'], book['author']) for book in books}), 50)
+        for book in books:
+            self.assertEqual(clean_book(book), book)
+
+    def test_start_continues_numbering(self):
+        book = next(generate_books(1, start=10))
+        self.assertTrue(book['title'].endswith(' 10'))
+        self.assertEqual(sample_queries(5, seed=1), sample_queries(5, seed=1))
+
+    def test_command_fills_database(self):
+        call_command('generate_books', rows=30, target='db', batch_size=7, stdout=io.StringIO())
+        call_command('generate_books', rows=5, target='db', stdout=io.StringIO())
+        self.assertEqual(Book.objects.count(), 35)
+        call_command('generate_books', rows=5, target='db', replace=True, stdout=io.StringIO())
+        self.assertEqual(Book.objects.count(), 5)
+        with self.assertRaises(CommandError):
+            call_command('generate_books', rows=0, target='db')
+
+    def test_command_does_not_overwrite_file_without_replace(self):
+        directory = tempfile.mkdtemp(prefix='books-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        backend = JsonlFileBackend(os.path.join(directory, 'all_books.jsonl'),
+                                   os.path.join(directory, 'all_books.json'))
+        with mock.patch('books.management.commands.generate_books.get_file_backend',
+                        return_value=backend):
+            call_command('generate_books', rows=20, target='file', stdout=io.StringIO())
+            with self.assertRaises(CommandError):
+                call_command('generate_books', rows=20, target='file', stdout=io.StringIO())
+            call_command('generate_books', rows=10, target='file', replace=True, stdout=io.StringIO())
+        self.assertEqual(len(backend.load()), 10)
@@ -0,0 +1,112 @@
+"""
+Приём загружаемого JSON с проверкой по мере получения.
+
+BooksUploadHandler заменяет стандартные обработчики Django для страницы
+загрузки: куски тела запроса сразу идут в JsonStreamParser, книги
+проверяются по мере разбора. Байты, как и у стандартных обработчиков,
+копятся в памяти до FILE_UPLOAD_MAX_MEMORY_SIZE, а больший файл
+переносится во временный файл (SpooledTemporaryFile) — запрос не держит
+в памяти до BOOKS_UPLOAD_MAX_BYTES. Синтаксическая ошибка, превышение
+BOOKS_UPLOAD_MAX_BYTES или BOOKS_UPLOAD_MAX_RECORDS останавливают приём
+(StopUpload) — остаток тела уже не разбирается, временный файл удаляется.
+"""
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+
+from .utils import JsonStreamError, JsonStreamParser, UploadReport, validate_books_stream
+
+
+class CheckedUploadedFile(UploadedFile):
+    """Загруженный JSON (в памяти или во временном файле) вместе с отчётом его проверки"""
+
+    def __init__(self, file, name, content_type, size, charset, report):
+        super().__init__(file, name, content_type, size, charset)
+        self.report = report
+
+
+class BooksUploadHandler(FileUploadHandler):
+    """
+    Разбирает и проверяет файл из поля field_name, пока он приходит.
+    Причина отказа — в self.error; сам файл тогда в request.FILES не попадает.
+    """
+
+    field_name = 'file'
+
+    def __init__(self, request=None, max_bytes=None, max_records=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes or settings.BOOKS_UPLOAD_MAX_BYTES
+        self.max_records = max_records or settings.BOOKS_UPLOAD_MAX_RECORDS
+        self.error = None
+        self.report = None
+        self.request_length = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request_length = content_length
+
+    def reject(self, message):
+        self.error = message
+        # Со сбросом Django не дочитывает тело: иначе при потоковом проксировании
+        # (proxy_request_buffering off) воркер принимал бы до BOOKS_UPLOAD_MAX_BYTES
+        # уже отвергнутого файла. Ценой этого браузер может показать обрыв
+        # соединения вместо страницы ошибки — см. BOOKS_UPLOAD_RESET_ON_REJECT
+        raise StopUpload(connection_reset=settings.BOOKS_UPLOAD_RESET_ON_REJECT)
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset,
+                         content_type_extra)
+        if field_name != self.field_name:
+            raise SkipFile()
+        if not file_name.lower().endswith('.json'):
+            self.reject("Поддерживаются только файлы .json")
+        # Размер всего запроса известен до чтения файла: заведомо большой
+        # отклоняется сразу (запас — на остальные поля формы)
+        if self.request_length and self.request_length > self.max_bytes + 64 * 1024:
+            self.reject(self.too_large())
+        self.report = UploadReport()
+        self.parser = JsonStreamParser()
+        # Имя file нужно Django: при StopUpload он сам закрывает handler.file
+        self.file = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE, dir=settings.FILE_UPLOAD_TEMP_DIR,
+        )
+
+    def too_large(self):
+        return f"Файл больше {self.max_bytes // (1024 * 1024)} МБ"
+
+    def check(self, records):
+        for _ in validate_books_stream(records, self.report):
+            pass
+        if self.report.total > self.max_records:
+            self.reject(f"В файле больше {self.max_records} книг")
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_bytes:
+            self.reject(self.too_large())
+        try:
+            self.check(self.parser.feed(raw_data))
+        except JsonStreamError as e:
+            self.reject(f"Ошибка чтения JSON: {e}")
+        self.file.write(raw_data)
+        # Кусок принят — дальше по цепочке обработчиков он не идёт
+
+    def file_complete(self, file_size):
+        try:
+            self.check(self.parser.close())
+        except JsonStreamError as e:
+            self.error = f"Ошибка чтения JSON: {e}"
+        except StopUpload:
+            pass
+        if self.error:
+            self.file.close()
+            return None
+        self.file.seek(0)
+        return CheckedUploadedFile(
+            self.file, self.file_name, self.content_type, file_size, self.charset, self.report,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
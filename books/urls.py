@@ -1,6 +1,6 @@
 # books/urls.py
 from django.urls import path
-from . import views
+from . import metrics, views
 
 app_name = 'books'
 
@@ -10,5 +10,9 @@ urlpatterns = [
     path('upload/', views.upload_file, name='upload_file'),
     path('edit/<int:pk>/', views.edit_book, name='edit_book'),
     path('delete/<int:pk>/', views.delete_book, name='delete_book'),
+    path('batch/', views.batch_books, name='batch_books'),
     path('search/', views.search_books, name='search_books'),
+    path('export/', views.export_books, name='export_books'),
+    path('jobs/<uuid:job_id>/', views.import_job_status, name='import_job_status'),
+    path('metrics', metrics.metrics_view, name='metrics'),
 ]
\ No newline at end of file
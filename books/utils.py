@@ -1,11 +1,31 @@
+import codecs
 import json
+import logging
 import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from collections.abc import Sequence
+from contextlib import contextmanager
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.storage import default_storage
 from django.conf import settings
 from datetime import datetime
 
+from .metrics import measure
+from .snapshot import CatalogueView, SnapshotCatalogue, SnapshotError, encode_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
 ALL_BOOKS_FILE = os.path.join(settings.BOOKS_JSON_DIR, 'all_books.json')
+ALL_BOOKS_LOG_FILE = os.path.join(settings.BOOKS_JSON_DIR, 'all_books.jsonl')
+ALL_BOOKS_SNAPSHOT_FILE = os.path.join(settings.BOOKS_JSON_DIR, 'all_books.snap')
 
 def sanitize_filename(filename):
     """Безопасное имя файла"""
@@ -38,57 +58,426 @@ def validate_book_data(book, file_source, index=None):
 
     return True, ""
 
+class JsonStreamError(ValueError):
+    """Синтаксическая ошибка во входном JSON"""
+
+
+class JsonStreamParser:
+    """
+    Потоковый разбор JSON вида [{...}, {...}] или {...}.
+    Байты подаются кусками через feed(), готовые элементы верхнего уровня
+    возвращаются сразу, поэтому в памяти держится только текущий элемент.
+    """
+
+    def __init__(self, max_record_chars=1_000_000):
+        self.max_record_chars = max_record_chars
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._consumed = 0
+        self._state = 'start'
+
+    def feed(self, data):
+        """Принимает очередной кусок байтов, возвращает список готовых элементов"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        try:
+            self._buffer += self._decoder.decode(data)
+        except UnicodeDecodeError as e:
+            raise JsonStreamError(f"файл не в кодировке UTF-8 ({e})")
+        return self._drain(final=False)
+
+    def close(self):
+        """Завершает разбор; ошибка, если документ оборван"""
+        try:
+            self._buffer += self._decoder.decode(b'', final=True)
+        except UnicodeDecodeError as e:
+            raise JsonStreamError(f"файл не в кодировке UTF-8 ({e})")
+        items = self._drain(final=True)
+        if self._state != 'done':
+            raise JsonStreamError("неожиданный конец файла")
+        return items
+
+    def _drain(self, final):
+        items = []
+        buf = self._buffer
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos == len(buf):
+                break
+            char = buf[pos]
+
+            if self._state == 'start':
+                if char == '[':
+                    pos += 1
+                    self._state = 'first'
+                elif char == '{':
+                    self._state = 'single'
+                else:
+                    raise JsonStreamError("JSON должен содержать объект или массив объектов")
+            elif self._state == 'first' and char == ']':
+                pos += 1
+                self._state = 'done'
+            elif self._state in ('first', 'item', 'single'):
+                try:
+                    item, end = self._json.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    if final:
+                        raise JsonStreamError(f"{e.msg} (символ {self._consumed + e.pos + 1})")
+                    if len(buf) - pos > self.max_record_chars:
+                        raise JsonStreamError(
+                            f"элемент длиннее {self.max_record_chars} символов или повреждён"
+                        )
+                    break
+                if not final and (
+                    end == len(buf) or
+                    isinstance(item, (int, float)) and buf[end] not in ' \t\r\n,]'
+                ):
+                    # Число на границе куска может продолжиться в следующем
+                    break
+                items.append(item)
+                pos = end
+                self._state = 'done' if self._state == 'single' else 'separator'
+            elif self._state == 'separator':
+                if char == ',':
+                    self._state = 'item'
+                elif char == ']':
+                    self._state = 'done'
+                else:
+                    raise JsonStreamError(f"ожидалась ',' или ']', получено {char!r}")
+                pos += 1
+            else:
+                raise JsonStreamError("лишние данные после конца JSON")
+        self._buffer = buf[pos:]
+        self._consumed += pos
+        return items
+
+
+class UploadReport:
+    """Итог потоковой проверки файла: счётчики и первые max_errors ошибок"""
+
+    def __init__(self, max_errors=None):
+        if max_errors is None:
+            max_errors = settings.BOOKS_UPLOAD_MAX_ERRORS
+        self.max_errors = max_errors
+        self.total = 0
+        self.valid = 0
+        self.invalid = 0
+        self.errors = []
+        self.fatal = None
+        # NearDuplicateReport, если загрузка проверялась на почти-дубликаты
+        self.near_duplicates = None
+
+    @property
+    def ok(self):
+        return self.fatal is None and self.invalid == 0
+
+    @property
+    def errors_truncated(self):
+        return len(self.errors) >= self.max_errors
+
+    def add_error(self, message):
+        """Запись невалидна: учитывается в invalid"""
+        self.invalid += 1
+        self.note(message)
+
+    def note(self, message):
+        """Сообщение без учёта в счётчиках (например, ошибка записи в БД)"""
+        if len(self.errors) < self.max_errors:
+            self.errors.append(message)
+
+    def first_error(self):
+        return self.fatal or (self.errors[0] if self.errors else "")
+
+
+def iter_json_records(chunks, report):
+    """
+    Отдаёт элементы JSON по мере разбора кусков байтов.
+    Синтаксическая ошибка прерывает разбор и записывается в report.fatal.
+    """
+    parser = JsonStreamParser()
+    try:
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+        yield from parser.close()
+    except JsonStreamError as e:
+        report.fatal = f"Ошибка чтения JSON: {e}"
+
+
+def validate_books_stream(records, report):
+    """
+    Проверяет книги по одной и отдаёт только валидные. Номер книги в
+    сообщениях — report.total, поэтому файл можно проверять по кускам.
+    """
+    for book in records:
+        report.total += 1
+        i = report.total
+        if not isinstance(book, dict):
+            report.add_error(f"Книга #{i} не является объектом (словарём)")
+            continue
+        valid, msg = validate_book_data(book, "JSON", i)
+        if not valid:
+            report.add_error(msg)
+            continue
+        report.valid += 1
+        yield book
+
+
+def read_file_chunks(file_path, chunk_size=64 * 1024):
+    with open(file_path, 'rb') as f:
+        yield from iter(lambda: f.read(chunk_size), b'')
+
+
 def validate_json_file(file_path):
     """Проверяет JSON-файл: структура + валидация каждой книги"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    report = UploadReport(max_errors=1)
+    data = []
+    for book in validate_books_stream(iter_json_records(read_file_chunks(file_path), report), report):
+        data.append(book)
+        if report.invalid:
+            break
+    if not report.ok:
+        return False, report.first_error()
+    return True, data
+
+
+BOOK_FIELDS = ('title', 'year', 'author', 'genre', 'pages')
 
-        if isinstance(data, dict):
-            data = [data]
-        elif not isinstance(data, list):
-            return False, "JSON должен содержать объект или массив объектов"
 
-        # Проверяем каждую книгу
-        for i, book in enumerate(data):
-            if not isinstance(book, dict):
-                return False, f"Книга #{i+1} не является объектом (словарём)"
+def clean_book(book):
+    """
+    Нормализует книгу один раз — перед записью в файл: у строк убираются
+    пробелы по краям, пустые поля не записываются. Прочие ключи не меняются.
+    """
+    clean = {}
+    for key, value in book.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            continue
+        clean[key] = value
+    return clean
+
+
+# Строка каталога в кэше — кортеж значений в порядке BOOK_FIELDS:
+# он в несколько раз компактнее словаря и быстрее создаётся, чем объект
+# со __slots__. Отсутствующее поле — None.
+TITLE, YEAR, AUTHOR, GENRE, PAGES = range(len(BOOK_FIELDS))
+
+
+def book_row(book):
+    """Строка каталога из словаря книги, уже нормализованного clean_book"""
+    get = book.get
+    return get('title'), get('year'), get('author'), get('genre'), get('pages')
+
 
-            valid, msg = validate_book_data(book, "JSON", i+1)
-            if not valid:
-                return False, msg
+def display_value(value):
+    """Значение поля для отображения: строкой, вместо пустого — «—»"""
+    if value is None:
+        return "—"
+    if isinstance(value, str):
+        # Файлы, записанные до clean_book, могут содержать пробелы и пустые строки
+        return value.strip() or "—"
+    # Для чисел, булевых и др. — просто в строку
+    return str(value)
+
+
+def display_row(row):
+    """Словарь для шаблона или JSON из строки каталога"""
+    return {field: display_value(value) for field, value in zip(BOOK_FIELDS, row)}
+
+
+class DisplayBooks(Sequence):
+    """
+    Ленивое представление строк каталога для шаблонов и JSON: словари
+    с «—» собираются только для книг, к которым обратились (обычно одна страница).
+    """
 
-        return True, data
+    def __init__(self, rows):
+        self.rows = rows
 
-    except Exception as e:
-        return False, f"Ошибка чтения JSON: {str(e)}"
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [display_row(row) for row in self.rows[index]]
+        return display_row(self.rows[index])
+
+    def __iter__(self):
+        return map(display_row, self.rows)
+
+
+class CatalogueCache:
+    """
+    Кэш каталога в памяти процесса: строки-кортежи из backend.load_rows()
+    (у снимка — ленивое представление поверх mmap).
+    Запись действительна, пока не изменился stat() файла (inode, размер,
+    mtime) и не истёк max_age секунд. Параллельные запросы одного воркера
+    ждут одну общую перестройку.
+    """
+
+    def __init__(self, backend, max_age=None):
+        self.backend = backend
+        if max_age is None:
+            max_age = getattr(settings, 'BOOKS_FILE_CACHE_MAX_AGE', 300)
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.rebuild_seconds = 0.0
+        self._lock = threading.Lock()
+        self._books = None
+        self._signature = None
+        self._built_at = 0.0
+
+    def _is_fresh(self, signature):
+        if self._books is None or signature != self._signature:
+            return False
+        return not self.max_age or time.monotonic() - self._built_at < self.max_age
+
+    def get(self):
+        signature = self.backend.signature()
+        if self._is_fresh(signature):
+            self.hits += 1
+            return self._books
+        with self._lock:
+            # Пока ждали блокировку, другой поток мог уже всё перестроить
+            signature = self.backend.signature()
+            if self._is_fresh(signature):
+                self.hits += 1
+                return self._books
+            self.misses += 1
+            started = time.perf_counter()
+            # Время и байты чтения считают сами хранилища
+            books = self.backend.load_rows()
+            self.rebuild_seconds += time.perf_counter() - started
+            self._books, self._signature = books, signature
+            self._built_at = time.monotonic()
+            return books
+
+    def clear(self):
+        with self._lock:
+            self._books = None
+            self._signature = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'rebuild_seconds': round(self.rebuild_seconds, 6),
+            'size': len(self._books) if self._books is not None else 0,
+        }
+
+
+_catalogue_cache = None
+
+
+def get_catalogue_cache():
+    global _catalogue_cache
+    if _catalogue_cache is None:
+        _catalogue_cache = CatalogueCache(get_file_backend())
+    return _catalogue_cache
 
 
 def load_all_books():
-    """Загружает все книги из общего файла и нормализует поля"""
-    books = load_all_books_from_file()
-    expected_fields = ['title', 'year', 'author', 'genre', 'pages']
-
-    normalized = []
-    for book in books:
-        norm = {}
-        for field in expected_fields:
-            value = book.get(field, None)
-
-            # Если значение отсутствует или None
-            if value is None or value == "":
-                norm[field] = "—"
+    """
+    Загружает все книги из общего файла строками-кортежами (см. book_row).
+    Результат кэшируется на процесс; список общий — не изменяйте его.
+    Для вывода оберните его в DisplayBooks.
+    """
+    return get_catalogue_cache().get()
+
+
+def file_cache_stats():
+    """Счётчики кэша каталога: попадания, промахи, время перестроек"""
+    return get_catalogue_cache().stats()
+
+
+def row_matches(row, needle):
+    """Есть ли needle (уже в casefold) в названии или авторе строки каталога"""
+    return (needle in str(row[TITLE] or '').casefold()
+            or needle in str(row[AUTHOR] or '').casefold())
+
+
+class SearchCache:
+    """
+    LRU недавних результатов поиска по файловому каталогу.
+    Ключ — нормализованный запрос. Для более длинного запроса берётся
+    результат самого длинного закэшированного начала и фильтруется он,
+    а не весь каталог: всё, что содержит «войн», содержит и «вой».
+    Кэш сбрасывается, когда CatalogueCache отдаёт новый список строк.
+    """
+
+    def __init__(self, max_entries=None, max_rows=100_000):
+        if max_entries is None:
+            max_entries = getattr(settings, 'BOOKS_SEARCH_CACHE_SIZE', 64)
+        self.max_entries = max_entries
+        # Слишком общие запросы («а») не храним — они заняли бы много памяти
+        self.max_rows = max_rows
+        self.hits = 0
+        self.refined = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._rows = None
+
+    def search(self, rows, query):
+        needle = query.strip().casefold()
+        if not needle:
+            return rows
+        base = rows
+        with self._lock:
+            if rows is not self._rows:
+                self._entries.clear()
+                self._rows = rows
+            for end in range(len(needle), 0, -1):
+                found = self._entries.get(needle[:end])
+                if found is None:
+                    continue
+                self._entries.move_to_end(needle[:end])
+                if end == len(needle):
+                    self.hits += 1
+                    return found
+                self.refined += 1
+                base = found
+                break
             else:
-                # Преобразуем в строку и обрезаем пробелы только если это строка
-                if isinstance(value, str):
-                    cleaned = value.strip()
-                    norm[field] = cleaned if cleaned else "—"
-                else:
-                    # Для чисел, булевых и др. — просто в строку
-                    norm[field] = str(value)
-        normalized.append(norm)
+                self.misses += 1
+
+        found = [row for row in base if row_matches(row, needle)]
+        if self.max_entries and len(found) <= self.max_rows:
+            with self._lock:
+                if rows is self._rows:
+                    self._entries[needle] = found
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        return found
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'refined': self.refined,
+            'misses': self.misses,
+            'size': len(self._entries),
+        }
+
+
+_search_cache = None
+
+
+def get_search_cache():
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = SearchCache()
+    return _search_cache
+
+
+def search_cache_stats():
+    """Счётчики кэша поиска: попадания, уточнения по началу запроса, промахи"""
+    return get_search_cache().stats()
 
-    return normalized
 
 def save_book_as_json(book_data):
     """Сохраняет одну книгу в отдельный JSON-файл"""
@@ -105,23 +494,727 @@ def save_book_as_json(book_data):
 
     return filepath
 
-def load_all_books_from_file():
-    """Читает все книги из общего файла all_books.json"""
-    if not os.path.exists(ALL_BOOKS_FILE):
-        return []
-    try:
-        with open(ALL_BOOKS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                return data
+class CatalogueError(Exception):
+    """Общий файл каталога существует, но его не удалось прочитать"""
+
+
+class CatalogueConflict(Exception):
+    """Файл каталога изменился между чтением и записью"""
+
+
+# Ожидаемая версия при сохранении без проверки
+ANY_VERSION = object()
+
+if fcntl is not None:
+    LOCK_SH, LOCK_EX = fcntl.LOCK_SH, fcntl.LOCK_EX
+else:
+    LOCK_SH, LOCK_EX = 1, 2
+
+
+class FileLock:
+    """
+    Блокировка читатель/писатель через fcntl.flock на файле path + '.lock'.
+    Отдельный файл нужен потому, что сам каталог заменяется через os.replace.
+    Вложенный захват в том же потоке проходит без ожидания.
+    Без fcntl (Windows) блокировка действует только внутри процесса.
+    """
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._local = threading.local()
+        self._process_lock = threading.RLock()
+
+    def shared(self):
+        return self._acquire(LOCK_SH)
+
+    def exclusive(self):
+        return self._acquire(LOCK_EX)
+
+    @contextmanager
+    def _acquire(self, mode):
+        if getattr(self._local, 'depth', 0):
+            if mode == LOCK_EX and self._local.mode != LOCK_EX:
+                raise RuntimeError("Нельзя повысить разделяемую блокировку до исключительной")
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), mode)
             else:
-                return []
-    except Exception:
-        return []
+                self._process_lock.acquire()
+            self._local.depth, self._local.mode = 1, mode
+            try:
+                yield
+            finally:
+                self._local.depth = 0
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    self._process_lock.release()
+
+
+def atomic_write(path, chunks):
+    """
+    Записывает куски байтов во временный файл рядом с path и атомарно
+    подменяет им path: читатели видят либо старый, либо новый файл целиком.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with measure('file') as timer, open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                timer.add_bytes(len(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class JsonFileBackend:
+    """Старый формат: весь каталог — один JSON-массив в all_books.json.
+    Любое добавление перечитывает и перезаписывает файл целиком."""
+
+    def __init__(self, path=ALL_BOOKS_FILE):
+        self.path = path
+        self.lock = FileLock(path)
+
+    def load(self):
+        return self.load_with_version()[0]
+
+    def load_rows(self):
+        """Книги строками-кортежами для кэша каталога"""
+        return [book_row(book) for book in self.load()]
+
+    def load_with_version(self):
+        """(книги, версия файла); версия нужна для save(expected_version=...)"""
+        with self.lock.shared():
+            version = file_signature(self.path)
+            if version is None:
+                return [], None
+            try:
+                with measure('file') as timer, open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    timer.add_bytes(version[1])
+            except (OSError, ValueError) as e:
+                logger.exception("Не удалось прочитать %s", self.path)
+                raise CatalogueError(f"Не удалось прочитать {self.path}: {e}") from e
+            if not isinstance(data, list):
+                raise CatalogueError(f"{self.path} должен содержать массив книг")
+            return data, version
+
+    def iter_books(self):
+        """
+        Книги потоковым разбором файла, без списка в памяти. Файл заменяется
+        только атомарно, поэтому открытый дескриптор видит целую версию
+        и блокировка нужна лишь на время открытия.
+        """
+        with self.lock.shared():
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return
+        with f:
+            report = UploadReport(max_errors=1)
+            for book in iter_json_records(iter(lambda: f.read(64 * 1024), b''), report):
+                if isinstance(book, dict):
+                    yield book
+            if report.fatal:
+                raise CatalogueError(f"{self.path}: {report.fatal}")
+
+    def save(self, books, expected_version=ANY_VERSION):
+        books = [clean_book(book) for book in books]
+        with self.lock.exclusive():
+            check_version(self.path, expected_version)
+            atomic_write(self.path, [json.dumps(books, ensure_ascii=False, indent=4).encode('utf-8')])
+
+    def append(self, books):
+        with self.lock.exclusive():
+            all_books, _ = self.load_with_version()
+            all_books.extend(clean_book(book) for book in books)
+            self.save(all_books)
+
+    def signature(self):
+        return file_signature(self.path)
+
+    def read_since(self, cursor):
+        """
+        Книги, появившиеся после курсора: (книги, новый курсор, full).
+        full=True — каталог прочитан заново и прежние книги надо забыть.
+        Файл не дописывается, поэтому любое изменение — полное перечитывание.
+        """
+        if cursor is not None and self.signature() == cursor:
+            return [], cursor, False
+        books, version = self.load_with_version()
+        return books, version, True
+
+
+class JsonlFileBackend:
+    """
+    Журнал JSON Lines: одна книга — одна строка в all_books.jsonl.
+    Добавление дописывает строки в конец файла (O(1) от размера каталога),
+    а периодическое уплотнение в фоне переписывает журнал без битых строк.
+    Читатели берут разделяемую блокировку, запись и уплотнение — исключительную.
+    """
+
+    def __init__(self, path=ALL_BOOKS_LOG_FILE, legacy_path=ALL_BOOKS_FILE,
+                 compact_every=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.lock = FileLock(path)
+        if compact_every is None:
+            compact_every = getattr(settings, 'BOOKS_JSONL_COMPACT_EVERY', 1000)
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._appended_since_compact = 0
+        self._bad_lines = 0
+        self._compacting = False
+
+    def _ensure_migrated(self):
+        """Однократно переносит старый all_books.json в журнал"""
+        if not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+            with self.lock.exclusive():
+                if not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+                    convert_json_to_jsonl(self.legacy_path, self.path)
+
+    def load(self):
+        return self.load_with_version()[0]
+
+    def load_rows(self):
+        """Книги строками-кортежами для кэша каталога"""
+        return [book_row(book) for book in self.load()]
+
+    def load_with_version(self):
+        """(книги, версия файла); версия нужна для save(expected_version=...)"""
+        self._ensure_migrated()
+        books = []
+        bad = 0
+        with self.lock.shared():
+            version = file_signature(self.path)
+            if version is None:
+                return books, None
+            with measure('file') as timer, open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        # Незавершённая строка — запись ещё идёт или оборвалась.
+                        # Уплотнение её сохранит, так что это не повод его запускать
+                        break
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        book = json.loads(line)
+                    except ValueError:
+                        bad += 1
+                        continue
+                    if isinstance(book, dict):
+                        books.append(book)
+                    else:
+                        bad += 1
+                timer.add_bytes(version[1])
+        self._bad_lines = bad
+        if bad:
+            self.schedule_compaction()
+        return books, version
+
+    def signature(self):
+        self._ensure_migrated()
+        return file_signature(self.path)
+
+    def iter_books(self):
+        """
+        Книги журнала построчно, без списка в памяти. Читается то, что было
+        в файле на момент открытия: дописанное позже и замена файла
+        уплотнением открытый дескриптор не затрагивают.
+        """
+        self._ensure_migrated()
+        with self.lock.shared():
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return
+        with f:
+            yield from iter_log_books(f, 0, os.fstat(f.fileno()).st_size)
+
+    def read_from(self, offset):
+        """
+        Читает завершённые строки журнала начиная с байта offset.
+        Возвращает (книги, смещение конца прочитанного).
+        """
+        self._ensure_migrated()
+        with self.lock.shared():
+            if not os.path.exists(self.path):
+                return [], 0
+            with open(self.path, 'rb') as f:
+                return read_log_lines(f, offset)
+
+    def read_since(self, cursor):
+        """
+        Книги после курсора (inode, смещение): (книги, новый курсор, full).
+        Пока журнал тот же, дочитывается только его конец; после уплотнения
+        или перезаписи (другой inode) журнал читается с начала и full=True.
+        """
+        self._ensure_migrated()
+        with self.lock.shared():
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return [], None, True
+            with f:
+                st = os.fstat(f.fileno())
+                full = cursor is None or cursor[0] != st.st_ino or st.st_size < cursor[1]
+                books, offset = read_log_lines(f, 0 if full else cursor[1])
+        return books, (st.st_ino, offset), full
+
+    def save(self, books, expected_version=ANY_VERSION):
+        """Полная перезапись журнала (атомарно, через временный файл)"""
+        with self.lock.exclusive():
+            check_version(self.path, expected_version)
+            self._write_snapshot(books)
+            self._appended_since_compact = 0
+
+    def append(self, books):
+        """Дописывает книги в конец журнала одной операцией записи"""
+        if not books:
+            return
+        self._ensure_migrated()
+        payload = ''.join(
+            json.dumps(clean_book(book), ensure_ascii=False) + '\n' for book in books
+        )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock.exclusive(), measure('file') as timer:
+            with open(self.path, 'a+b') as f:
+                # Если предыдущая запись оборвалась без перевода строки,
+                # не склеиваем новую книгу с «хвостом»
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        payload = '\n' + payload
+                data = payload.encode('utf-8')
+                f.write(data)
+                timer.add_bytes(len(data))
+        with self._lock:
+            self._appended_since_compact += len(books)
+            need_compact = self._appended_since_compact >= self.compact_every
+        if need_compact:
+            self.schedule_compaction()
+
+    def schedule_compaction(self):
+        """Запускает уплотнение в фоновом потоке (не более одного за раз)"""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """
+        Переписывает журнал, отбрасывая битые строки.
+        Чтение идёт без блокировки; строки, дописанные за это время,
+        переносятся под исключительной блокировкой перед заменой файла.
+        """
+        try:
+            if not os.path.exists(self.path):
+                return
+            books = []
+            offset = 0
+            with open(self.path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Незавершённая строка: её допишут, заберём с «хвостом»
+                        break
+                    offset += len(line)
+                    try:
+                        book = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(book, dict):
+                        books.append(book)
+            with self.lock.exclusive():
+                with open(self.path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_ino != inode:
+                        # Файл успели переписать целиком — уплотнять нечего
+                        return
+                    f.seek(offset)
+                    tail = f.read()
+                self._write_snapshot(books, tail)
+            with self._lock:
+                self._appended_since_compact = 0
+                self._bad_lines = 0
+        finally:
+            self._compacting = False
+
+    def _write_snapshot(self, books, tail=b''):
+        def chunks():
+            for book in books:
+                yield json.dumps(clean_book(book), ensure_ascii=False).encode('utf-8') + b'\n'
+            if tail:
+                yield tail
+        atomic_write(self.path, chunks())
+
+
+class SnapshotFileBackend(JsonlFileBackend):
+    """
+    Колоночный снимок all_books.snap (см. books/snapshot.py) плюс журнал
+    all_books.jsonl с книгами, добавленными после него.
+
+    Снимок открывается через mmap, поэтому воркеры делят страницы кэша ОС,
+    а книги разбираются при обращении. В заголовке снимка записано, до какого
+    места (inode и смещение) он включает журнал. Уплотнение сначала атомарно
+    пишет новый снимок и только потом заменяет журнал его «хвостом»: если
+    процесс упадёт между шагами, уже вошедшая в снимок часть журнала
+    просто пропускается при чтении.
+    Снимок хранит только поля title, year, author, genre и pages.
+    """
+
+    def __init__(self, path=ALL_BOOKS_LOG_FILE, snapshot_path=ALL_BOOKS_SNAPSHOT_FILE,
+                 legacy_path=ALL_BOOKS_FILE, compact_every=None):
+        super().__init__(path, legacy_path, compact_every)
+        self.snapshot_path = snapshot_path
+        self._snapshot = None
+        self._snapshot_signature = None
+
+    def _ensure_migrated(self):
+        if not os.path.exists(self.snapshot_path):
+            super()._ensure_migrated()
+
+    def open_snapshot(self):
+        """(снимок или None, подпись файла); снимок переоткрывается после замены файла"""
+        with self._lock:
+            signature = file_signature(self.snapshot_path)
+            if signature != self._snapshot_signature:
+                try:
+                    self._snapshot = SnapshotCatalogue(self.snapshot_path) if signature else None
+                except (OSError, SnapshotError) as e:
+                    logger.exception("Не удалось открыть %s", self.snapshot_path)
+                    raise CatalogueError(f"Не удалось прочитать {self.snapshot_path}: {e}") from e
+                self._snapshot_signature = signature
+            return self._snapshot, self._snapshot_signature
+
+    def _log_start(self, snapshot, log_signature):
+        """Смещение в журнале, с которого начинаются книги не из снимка"""
+        if snapshot is None or log_signature is None or log_signature[0] != snapshot.log_inode:
+            return 0
+        return snapshot.log_offset
+
+    def load_with_version(self):
+        self._ensure_migrated()
+        with self.lock.shared():
+            version = self.signature()
+            snapshot, _ = self.open_snapshot()
+            tail, _ = self.read_from(self._log_start(snapshot, file_signature(self.path)))
+        return CatalogueView(snapshot, tail), version
+
+    def load_rows(self):
+        """Строки снимка читаются из mmap при обращении; копируется только журнал"""
+        self._ensure_migrated()
+        with self.lock.shared():
+            snapshot, _ = self.open_snapshot()
+            tail, _ = self.read_from(self._log_start(snapshot, file_signature(self.path)))
+        return CatalogueView(snapshot.rows if snapshot else None, [book_row(book) for book in tail])
+
+    def signature(self):
+        return file_signature(self.snapshot_path), super().signature()
+
+    def iter_books(self):
+        """Книги снимка (из mmap по одной), затем книги журнала после него"""
+        self._ensure_migrated()
+        with self.lock.shared():
+            snapshot, _ = self.open_snapshot()
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                f = None
+        if snapshot is not None:
+            yield from snapshot
+        if f is None:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            start = self._log_start(snapshot, (st.st_ino, st.st_size, st.st_mtime_ns))
+            yield from iter_log_books(f, start, st.st_size)
+
+    def read_since(self, cursor):
+        """Курсор — (подпись снимка, курсор журнала); новый снимок читается целиком"""
+        with self.lock.shared():
+            snapshot, snapshot_signature = self.open_snapshot()
+            if cursor is not None and cursor[0] == snapshot_signature:
+                books, log_cursor, full = super().read_since(cursor[1])
+                if not full:
+                    return books, (snapshot_signature, log_cursor), False
+            log = file_signature(self.path)
+            tail, offset = self.read_from(self._log_start(snapshot, log))
+            log_cursor = (log[0], offset) if log else None
+        return CatalogueView(snapshot, tail), (snapshot_signature, log_cursor), True
+
+    def save(self, books, expected_version=ANY_VERSION):
+        """Записывает книги новым снимком и очищает журнал"""
+        with self.lock.exclusive():
+            if expected_version is not ANY_VERSION and self.signature() != expected_version:
+                raise CatalogueConflict(f"{self.snapshot_path} изменён другим процессом")
+            log = file_signature(self.path)
+            atomic_write(self.snapshot_path, encode_snapshot(
+                map(clean_book, books), *((log[0], log[1]) if log else (0, 0))
+            ))
+            if log:
+                self._truncate_log(log[1])
+            self._appended_since_compact = 0
+
+    def compact(self):
+        """
+        Переносит журнал в новый снимок. Снимок кодируется без блокировки;
+        под исключительной блокировкой только проверяется, что снимок и
+        журнал никто не заменил, и записываются файлы.
+        """
+        try:
+            log = file_signature(self.path)
+            if log is None:
+                return
+            snapshot, snapshot_signature = self.open_snapshot()
+            books, offset = self.read_from(self._log_start(snapshot, log))
+            books = [clean_book(book) for book in books]
+            chunks = encode_snapshot(CatalogueView(snapshot, books), log[0], offset)
+            with self.lock.exclusive():
+                current = file_signature(self.path)
+                if (current is None or current[0] != log[0]
+                        or file_signature(self.snapshot_path) != snapshot_signature):
+                    # Каталог успели переписать — уплотним в следующий раз
+                    return
+                atomic_write(self.snapshot_path, chunks)
+                self._truncate_log(offset)
+            with self._lock:
+                self._appended_since_compact = 0
+                self._bad_lines = 0
+        finally:
+            self._compacting = False
+
+    def _truncate_log(self, offset):
+        """Заменяет журнал его частью после offset (вызывать под исключительной блокировкой)"""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        atomic_write(self.path, [tail])
+
+
+def read_log_lines(f, offset):
+    """
+    Читает завершённые строки журнала из открытого файла начиная с offset.
+    Возвращает (книги, смещение конца прочитанного); битые строки пропускаются.
+    """
+    books = []
+    start = offset
+    with measure('file') as timer:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            try:
+                book = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(book, dict):
+                books.append(book)
+        timer.add_bytes(offset - start)
+    return books, offset
+
+
+def iter_log_books(f, offset, end):
+    """Книги из строк журнала между offset и end; битые строки пропускаются"""
+    f.seek(offset)
+    for line in f:
+        offset += len(line)
+        if offset > end or not line.endswith(b'\n'):
+            break
+        try:
+            book = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(book, dict):
+            yield book
+
+
+def check_version(path, expected_version):
+    """CatalogueConflict, если файл изменился после чтения версии expected_version"""
+    if expected_version is not ANY_VERSION and file_signature(path) != expected_version:
+        raise CatalogueConflict(f"{path} изменён другим процессом")
+
+
+def file_signature(path):
+    """(inode, размер, mtime) файла или None, если файла нет"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+FILE_BACKENDS = {
+    'json': JsonFileBackend,
+    'jsonl': JsonlFileBackend,
+    'snapshot': SnapshotFileBackend,
+}
+
+_file_backend = None
+
+
+def get_file_backend():
+    """Возвращает файловое хранилище, выбранное в settings.BOOKS_FILE_BACKEND"""
+    global _file_backend
+    if _file_backend is None:
+        name = getattr(settings, 'BOOKS_FILE_BACKEND', 'jsonl')
+        try:
+            backend_class = FILE_BACKENDS[name]
+        except KeyError:
+            raise ImproperlyConfigured(
+                f"Неизвестное файловое хранилище BOOKS_FILE_BACKEND={name!r}"
+            )
+        _file_backend = backend_class()
+    return _file_backend
+
+
+def convert_json_to_jsonl(src=ALL_BOOKS_FILE, dst=ALL_BOOKS_LOG_FILE):
+    """
+    Переносит каталог из all_books.json в журнал JSON Lines.
+    Исходный файл сохраняется рядом с суффиксом .bak.
+    Возвращает количество перенесённых книг.
+    """
+    books = JsonFileBackend(src).load()
+    atomic_write(dst, (
+        json.dumps(clean_book(book), ensure_ascii=False).encode('utf-8') + b'\n'
+        for book in books if isinstance(book, dict)
+    ))
+    os.replace(src, src + '.bak')
+    return len(books)
+
+
+def convert_jsonl_to_json(src=ALL_BOOKS_LOG_FILE, dst=ALL_BOOKS_FILE,
+                          snapshot_path=ALL_BOOKS_SNAPSHOT_FILE):
+    """
+    Обратный перенос: каталог из журнала (и снимка, если он есть) — в all_books.json.
+    Журнал и снимок сохраняются рядом с суффиксом .bak: иначе при возврате
+    к хранилищу jsonl оно взяло бы их вместо нового all_books.json.
+    Возвращает количество перенесённых книг.
+    """
+    backend = SnapshotFileBackend(src, snapshot_path, legacy_path=dst)
+    with backend.lock.exclusive():
+        books = list(backend.iter_books())
+        JsonFileBackend(dst).save(books)
+        for path in (src, snapshot_path):
+            if os.path.exists(path):
+                os.replace(path, path + '.bak')
+    return len(books)
+
+
+def save_all_books_to_file(books, expected_version=ANY_VERSION):
+    """
+    Сохраняет список книг в общий файл (полная атомарная перезапись).
+    С expected_version бросает CatalogueConflict, если файл успели изменить.
+    """
+    get_file_backend().save(books, expected_version)
+
+
+def update_all_books_in_file(modify, retries=3, backend=None):
+    """
+    Цикл «прочитать — изменить — сохранить» с оптимистичной проверкой версии:
+    modify(books) возвращает новый список; при конфликте цикл повторяется.
+    Файл читается и изменяется без исключительной блокировки — она берётся
+    только на время записи, поэтому читатели и дописывание не ждут.
+    backend — хранилище (по умолчанию из настроек).
+    """
+    backend = backend or get_file_backend()
+    for attempt in range(retries):
+        books, version = backend.load_with_version()
+        try:
+            backend.save(modify(books), expected_version=version)
+            return
+        except CatalogueConflict:
+            if attempt == retries - 1:
+                raise
+
+
+def normalize_key_part(value):
+    """Приводит значение поля к виду для сравнения: без регистра и лишних пробелов"""
+    if value is None:
+        return ''
+    return ' '.join(str(value).split()).casefold()
+
+
+def book_key(book, fields=None):
+    """Ключ книги для проверки дубликатов по полям settings.BOOKS_DUPLICATE_KEY"""
+    if fields is None:
+        fields = settings.BOOKS_DUPLICATE_KEY
+    return tuple(normalize_key_part(book.get(field)) for field in fields)
+
+
+class DuplicateIndex:
+    """
+    Множество ключей всех книг в общем файле.
+    Строится один раз на процесс и догоняет файл через backend.read_since():
+    журнал дочитывается с последнего смещения, а после перезаписи или
+    уплотнения каталога индекс перестраивается целиком.
+    """
+
+    def __init__(self, backend, fields=None):
+        self.backend = backend
+        self.fields = tuple(fields or settings.BOOKS_DUPLICATE_KEY)
+        self.lock = threading.RLock()
+        self.size = 0
+        self._keys = set()
+        self._cursor = None
+
+    def key(self, book):
+        return book_key(book, self.fields)
+
+    def __contains__(self, book):
+        return self.key(book) in self._keys
+
+    def refresh(self):
+        with self.lock:
+            books, self._cursor, full = self.backend.read_since(self._cursor)
+            if full:
+                self._keys = set()
+                self.size = 0
+            for book in books:
+                self._keys.add(self.key(book))
+            self.size += len(books)
+
+    def split(self, books):
+        """Делит книги на новые и дубликаты (в том числе внутри самой пачки)"""
+        with self.lock:
+            self.refresh()
+            new_books, duplicates = [], []
+            seen = set()
+            for book in books:
+                key = self.key(book)
+                if key in self._keys or key in seen:
+                    duplicates.append(book)
+                else:
+                    seen.add(key)
+                    new_books.append(book)
+            return new_books, duplicates
+
+
+_duplicate_index = None
+
+
+def get_duplicate_index():
+    global _duplicate_index
+    if _duplicate_index is None:
+        _duplicate_index = DuplicateIndex(get_file_backend())
+    return _duplicate_index
 
 
-def save_all_books_to_file(books):
-    """Сохраняет список книг в общий файл"""
-    os.makedirs(os.path.dirname(ALL_BOOKS_FILE), exist_ok=True)
-    with open(ALL_BOOKS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(books, f, ensure_ascii=False, indent=4)
\ No newline at end of file
+def count_books_in_file():
+    index = get_duplicate_index()
+    index.refresh()
+    return index.size
@@ -1,36 +1,80 @@
-import os
+import json
 from .utils import *
 from django.core.files.uploadedfile import UploadedFile
-from .utils import (
-    sanitize_filename, validate_json_file,
-    load_all_books_from_file, save_all_books_to_file
-)
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, HttpResponseRedirect
-from django.http import JsonResponse
+from django.db import IntegrityError
+from django.db.models import Exists, OuterRef
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.contrib import messages
-from django.db.models import Q
-from .models import Book
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from .batch import apply_batch
+from .bulk import ON_CONFLICT_CHOICES
+from .caching import abump_catalogue_version, cached_catalogue_view, ensure_csrf_cookie_once
+from .export import FORMATS as EXPORT_FORMATS, aexport_stream, export_stream
+from .jobs import enqueue_upload, job_status, run_import
+from .metrics import measure
+from .models import BOOK_LIST_FIELDS, Book, ImportJob
 from .forms import BookForm
-from .utils import load_all_books
+from .pagination import parse_fields, parse_limit
+from .repository import get_repository
+from .uploads import BooksUploadHandler
 
+# Поля, которые поиск может вернуть для книги из базы
+SEARCH_FIELDS_DB = BOOK_LIST_FIELDS
 
-def index(request):
-    source = request.GET.get('source', 'file')  # 'file' или 'db'
 
-    if source == 'db':
-        books = list(Book.objects.all().values())
-        db_active = True
-    else:
-        books = load_all_books()
-        db_active = False
+async def get_books_page(source, query, limit, cursor):
+    """
+    Одна страница книг из выбранного источника с учётом поиска.
+    База читается асинхронным ORM, файл — в пуле потоков, чтобы чтение
+    и разбор каталога не блокировали цикл событий.
+    """
+    return await get_repository(source).asearch(query, limit, cursor)
+
+
+def render_page(request, template_name, context=None):
+    """render() с замером времени шаблона для метрик запроса"""
+    with measure('template'):
+        return render(request, template_name, context)
 
-    return render(request, 'books/index.html', {
+
+# Токен CSRF берётся скриптами из cookie, поэтому страница одинакова
+# для всех пользователей и её можно кэшировать
+@ensure_csrf_cookie_once
+@cached_catalogue_view(default_source='file')
+async def index(request):
+    source = request.GET.get('source', 'file')  # 'file' или 'db'
+    db_active = source == 'db'
+
+    try:
+        books, page = await get_books_page(
+            source, '', parse_limit(request), request.GET.get('cursor')
+        )
+    except CatalogueError as e:
+        messages.error(request, f"Каталог недоступен: {e}")
+        books, page = [], None
+
+    # Шаблон читает сообщения из сессии — это синхронный код
+    return await sync_to_async(render_page)(request, 'books/index.html', {
         'books': books,
+        'page': page,
         'db_active': db_active,
         'source': source
     })
 
+
+def duplicate_label(book, fields=None):
+    """«'Название' (автор)» по полям ключа дубликатов файла (settings.BOOKS_DUPLICATE_KEY)"""
+    fields = fields or settings.BOOKS_DUPLICATE_KEY
+    details = ', '.join(str(book.get(field) or '—') for field in fields if field != 'title')
+    label = f"'{book.get('title')}'"
+    return f"{label} ({details})" if details else label
+
+
 def add_book(request):
     if request.method == 'POST':
         form = BookForm(request.POST)
@@ -45,124 +89,163 @@ def add_book(request):
             # Получаем выбор пользователя: куда сохранять
             save_to = form.cleaned_data['save_to']
 
+            new_book = {
+                'title': title,
+                'year': year,
+                'author': author,
+                'genre': genre,
+                'pages': pages,
+            }
+            # Дубликат определяет хранилище: база — по уникальному ограничению
+            # (title, author), файл — по ключу settings.BOOKS_DUPLICATE_KEY
             if save_to == 'db':
-                # Сохранение в базу данных SQLite
-                if Book.objects.filter(title=title, author=author).exists():
-                    messages.warning(request, f"Книга '{title}' ({author}) уже существует в базе данных.")
-                else:
-                    Book.objects.create(
-                        title=title,
-                        year=year,
-                        author=author,
-                        genre=genre,
-                        pages=pages
-                    )
+                if get_repository('db').add(new_book):
                     messages.success(request, "Книга успешно добавлена в базу данных!")
-            else:
-                # Сохранение в файл JSON (старая логика)
-                all_books = load_all_books_from_file()
-
-                new_book = {
-                    'title': title,
-                    'year': year,
-                }
-                if author:
-                    new_book['author'] = author
-                if genre:
-                    new_book['genre'] = genre
-                if pages:
-                    new_book['pages'] = pages
-
-                # Проверяем дубликат по названию и году
-                is_duplicate = any(
-                    book.get('title') == new_book['title'] and
-                    book.get('year') == new_book['year']
-                    for book in all_books
-                )
-
-                if is_duplicate:
-                    messages.warning(request, f"Книга '{new_book['title']}' ({new_book['year']}) уже существует в файлах.")
                 else:
-                    all_books.append(new_book)
-                    save_all_books_to_file(all_books)
+                    messages.warning(request, f"Книга '{title}' ({author}) уже существует в базе данных.")
+            else:
+                if get_repository('file').add(new_book):
                     messages.success(request, "Книга успешно добавлена в файл!")
+                else:
+                    messages.warning(request, f"Книга {duplicate_label(new_book)} уже существует в файлах.")
 
             return HttpResponseRedirect(reverse('books:index'))
     else:
         form = BookForm()
 
-    return render(request, 'books/add_book.html', {'form': form})
+    return render_page(request, 'books/add_book.html', {'form': form})
 
 
+@csrf_exempt
 def upload_file(request):
-    if request.method == 'POST' and request.FILES.get('file'):
-        uploaded_file = request.FILES['file']
-        filename = uploaded_file.name.lower()
-
-        # Поддерживаем только JSON
-        if not (filename.endswith('.json')):
-            messages.error(request, "Поддерживаются только файлы .json")
-            return render(request, 'books/upload.html')
-
-        # Временное сохранение
-        safe_filename = sanitize_filename(filename)
-        temp_path = os.path.join(settings.BOOKS_JSON_DIR, safe_filename)  # можно в любую папку
-
-        with open(temp_path, 'wb+') as dest:
-            for chunk in uploaded_file.chunks():
-                dest.write(chunk)
-
-        # Валидация файла
-        if filename.endswith('.json'):
-            valid, data_or_error = validate_json_file(temp_path)
-
-        # Удаляем временный файл сразу после проверки
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-
-        if not valid:
-            messages.error(request, f"Загрузка отменена. {data_or_error}")
-            return render(request, 'books/upload.html')
-
-        # Теперь data_or_error — это список книг
-        new_books = data_or_error
-
-        # Загружаем существующие книги
-        all_books = load_all_books_from_file()
-
-        # Добавляем новые (можно проверить на дубликаты по title+year, если нужно)
-        initial_count = len(all_books)
-        for book in new_books:
-            # Простая защита от полных дубликатов (по названию и автору)
-            if not any(b.get('title') == book['title'] and b.get('author') == book['author'] for b in all_books):
-                all_books.append(book)
-
-        added_count = len(all_books) - initial_count
-        if added_count == 0:
+    # Обработчик загрузки ставится до первого чтения request.POST, а его
+    # читает CsrfViewMiddleware — поэтому CSRF проверяется внутри, в receive_upload
+    upload = BooksUploadHandler(request)
+    request.upload_handlers = [upload]
+    return receive_upload(request, upload)
+
+
+@csrf_protect
+def receive_upload(request, upload):
+    """
+    Файл уже разобран и проверен обработчиком по мере приёма (books.uploads):
+    отклонённый не доходит сюда вовсе, принятый лежит в памяти (большой —
+    во временном файле) вместе с отчётом
+    """
+    # Разбор тела запускается первым обращением к request.POST / FILES
+    uploaded_file = request.FILES.get('file') if request.method == 'POST' else None
+    if upload.error:
+        messages.error(request, f"Файл не принят. {upload.error}")
+        response = render_page(request, 'books/upload.html', {'report': upload.report})
+        response.status_code = 400
+        return response
+
+    if uploaded_file:
+        # Куда загружать: в общий файл или пачками в базу данных
+        save_to = request.POST.get('save_to', 'file')
+        on_conflict = request.POST.get('on_conflict', 'skip')
+        if on_conflict not in dict(ON_CONFLICT_CHOICES):
+            on_conflict = 'skip'
+
+        # Режим «загрузить валидные, показать ошибки»: иначе любой
+        # невалидный элемент отменяет загрузку целиком
+        partial = request.POST.get('partial') == '1'
+        # Проверка на почти-дубликаты: флажок формы или settings.BOOKS_DEDUPE_ON_UPLOAD
+        check_near_duplicates = request.POST.get('near_duplicates') == '1' or None
+
+        # Строгий режим: файл с невалидными книгами не загружается вовсе
+        if uploaded_file.report.invalid and not partial:
+            messages.error(request, f"Загрузка отменена. {uploaded_file.report.first_error()}")
+            return render_page(request, 'books/upload.html', {'report': uploaded_file.report})
+
+        # Фоновый режим: файл уходит в очередь, ответ — id задания
+        if settings.BOOKS_UPLOAD_ASYNC:
+            job = enqueue_upload(
+                uploaded_file, save_to, on_conflict, partial,
+                bool(check_near_duplicates or settings.BOOKS_DEDUPE_ON_UPLOAD),
+            )
+            status_url = reverse('books:import_job_status', args=[job.id])
+            if 'application/json' in request.headers.get('Accept', ''):
+                return JsonResponse({'job_id': str(job.id), 'status_url': status_url}, status=202)
+            messages.info(request, f"Файл '{uploaded_file.name}' поставлен в очередь на загрузку.")
+            return render_page(request, 'books/upload.html', {'job': job, 'status_url': status_url})
+
+        # Файл уже проверен при приёме, второй проход проверки не нужен:
+        # книги пишутся за один разбор (partial=True), невалидные пропускаются
+        report, counts = run_import(
+            uploaded_file.chunks, save_to, on_conflict, True, check_near_duplicates,
+        )
+
+        if report.fatal:
+            messages.error(request, f"Разбор файла прерван. {report.fatal}")
+        if report.invalid:
+            messages.warning(request, f"Пропущено невалидных книг: {report.invalid}.")
+        if report.near_duplicates and report.near_duplicates.flagged:
+            messages.warning(request, f"Похожих на уже существующие книг: "
+                                      f"{report.near_duplicates.flagged}. Список — ниже.")
+
+        if counts['inserted'] == 0 and counts['updated'] == 0:
             messages.success(request,
-                         f"Файл '{uploaded_file.name}' не загружен. Книга с таким названием и автором уже существует")
+                         f"Файл '{uploaded_file.name}' не загружен. Все книги из него уже существуют")
         else:
-            # Сохраняем всё в один файл
-            save_all_books_to_file(all_books)
-
+            total = get_repository(save_to).count()
             messages.success(request,
-                             f"Файл '{uploaded_file.name}' успешно загружен. Добавлено книг: {added_count}. Всего в базе: {len(all_books)}.")
-
-    return render(request, 'books/upload.html')
-
-def search_books(request):
-    query = request.GET.get('q', '')
-    if query:
-        books = Book.objects.filter(
-            Q(title__icontains=query) | Q(author__icontains=query)
-        ).values()
-    else:
-        books = Book.objects.all().values()
-    return JsonResponse(list(books), safe=False)
-
-
-def edit_book(request, pk):
-    book = get_object_or_404(Book, pk=pk)
+                             f"Файл '{uploaded_file.name}' успешно загружен. "
+                             f"Добавлено: {counts['inserted']}, обновлено: {counts['updated']}, "
+                             f"пропущено: {counts['skipped']}, с ошибками: {counts['failed']}. "
+                             f"Всего в базе: {total}.")
+
+        return render_page(request, 'books/upload.html', {'report': report, 'counts': counts})
+
+    return render_page(request, 'books/upload.html')
+
+
+def export_books(request):
+    """
+    Выгрузка всего каталога потоком: ?source=file|db, ?format=csv|jsonl,
+    ?gzip=1 — файл .gz. Память и время до первого байта не зависят от размера каталога.
+    """
+    source = 'db' if request.GET.get('source') == 'db' else 'file'
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': f"Неизвестный формат: {export_format}"}, status=400)
+    compress = request.GET.get('gzip') == '1'
+
+    filename = f"books-{source}.{export_format}" + ('.gz' if compress else '')
+    # Синхронный итератор Django под ASGI сначала собирает целиком в список
+    stream = aexport_stream if isinstance(request, ASGIRequest) else export_stream
+    response = StreamingHttpResponse(
+        stream(source, export_format, compress),
+        content_type='application/gzip' if compress else EXPORT_FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # nginx не должен копить поток в буфере — иначе первый байт придёт в конце
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def import_job_status(request, job_id):
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return JsonResponse(job_status(job))
+
+@cached_catalogue_view(default_source='db')
+async def search_books(request):
+    query = request.GET.get('q', '').strip()
+    source = request.GET.get('source', 'db')
+    try:
+        books, page = await get_books_page(
+            source, query, parse_limit(request), request.GET.get('cursor')
+        )
+    except CatalogueError as e:
+        return JsonResponse({'error': f"Каталог недоступен: {e}"}, status=503)
+    # Только поля, которые показывает таблица (?fields=...)
+    allowed = SEARCH_FIELDS_DB if source == 'db' else BOOK_FIELDS
+    fields = parse_fields(request, allowed)
+    results = [{field: book.get(field) for field in fields} for book in books]
+    return JsonResponse({'results': results, **page})
+
+
+async def edit_book(request, pk):
     if request.method == 'POST':
         form = BookForm(request.POST)
         if form.is_valid():
@@ -172,21 +255,28 @@ def edit_book(request, pk):
             genre = form.cleaned_data.get('genre', '').strip() or None
             pages = form.cleaned_data.get('pages', '').strip() or None
 
-            # Проверка дубликата (кроме самой книги)
-            if Book.objects.exclude(pk=pk).filter(title=title, year=year).exists():
+            # Проверка дубликата (кроме самой книги) и сохранение — один UPDATE:
+            # строка меняется, только если другой книги с тем же названием и годом нет,
+            # а совпадение (title, author) отсекает уникальное ограничение
+            duplicate = Book.objects.filter(title=title, year=year).exclude(pk=OuterRef('pk'))
+            try:
+                updated = await Book.objects.filter(pk=pk).filter(~Exists(duplicate)).aupdate(
+                    title=title, year=year, author=author, genre=genre, pages=pages,
+                )
+            except IntegrityError:
+                return JsonResponse({
+                    'success': False,
+                    'error': f'Книга "{title}" ({author or "без автора"}) уже существует.'
+                })
+            if not updated:
+                if not await Book.objects.filter(pk=pk).aexists():
+                    raise Http404("Книга не найдена")
                 return JsonResponse({
                     'success': False,
                     'error': f'Книга "{title}" ({year}) уже существует.'
                 })
 
-            # Сохраняем
-            book.title = title
-            book.year = year
-            book.author = author
-            book.genre = genre
-            book.pages = pages
-            book.save()
-
+            await abump_catalogue_version()
             return JsonResponse({'success': True})
         else:
             # 🔍 Показываем реальные ошибки формы
@@ -205,7 +295,25 @@ def edit_book(request, pk):
     return JsonResponse({'success': False}, status=405)
 
 
-def delete_book(request, pk):
-    book = get_object_or_404(Book, pk=pk)
-    book.delete()
-    return JsonResponse({'success': True})
\ No newline at end of file
+async def delete_book(request, pk):
+    # Один DELETE по первичному ключу, без предварительного SELECT
+    deleted, _ = await Book.objects.filter(pk=pk).adelete()
+    if not deleted:
+        raise Http404("Книга не найдена")
+    await abump_catalogue_version()
+    return JsonResponse({'success': True})
+
+def batch_books(request):
+    """
+    Пакетное изменение и удаление книг из базы одним POST с JSON:
+    {"update": [{"id": ..., "title": ..., ...}], "delete": [id, ...]}.
+    Ответ — результат по каждому элементу (см. books.batch).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False}, status=405)
+    try:
+        payload = json.loads(request.body)
+        return JsonResponse(apply_batch(payload))
+    except ValueError as e:
+        # BatchError и ошибки разбора JSON — подклассы ValueError
+        return JsonResponse({'success': False, 'error': f"Некорректный пакет: {e}"}, status=400)
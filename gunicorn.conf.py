@@ -0,0 +1,39 @@
+# gunicorn.conf.py
+# Настройки gunicorn из переменных окружения (или .env). gunicorn читает этот
+# файл сам, если запущен из каталога проекта; иначе — через -c gunicorn.conf.py.
+# Значения по умолчанию выбраны по scripts/benchmark_gunicorn.py (см. README).
+import multiprocessing
+
+# Не config: gunicorn принимает все имена модуля за свои настройки, а
+# config — это настройка «путь к файлу конфигурации»
+from decouple import config as env
+
+bind = env('GUNICORN_BIND', default='0.0.0.0:8000')
+
+# 'gthread' — процессы с потоками; для ASGI-профиля —
+# 'uvicorn.workers.UvicornWorker' (тогда threads не используется)
+worker_class = env('GUNICORN_WORKER_CLASS', default='gthread')
+# Процессов по умолчанию — по одному на ядро плюс один: представления
+# большую часть времени ждут базу, а ожидание закрывают потоки
+workers = env('GUNICORN_WORKERS', default=multiprocessing.cpu_count() + 1, cast=int)
+threads = env('GUNICORN_THREADS', default=4, cast=int)
+
+# Приложение загружается до fork: код и снимок каталога (mmap) делят
+# страницы памяти, воркеры стартуют быстрее. При импорте приложение
+# к базе не подключается, так что соединения у каждого воркера свои
+preload_app = env('GUNICORN_PRELOAD', default=True, cast=bool)
+
+# Воркер перезапускается после max_requests запросов (± jitter, чтобы не все
+# сразу) — ограничивает рост памяти из-за кэшей каталога в процессе
+max_requests = env('GUNICORN_MAX_REQUESTS', default=1000, cast=int)
+max_requests_jitter = env('GUNICORN_MAX_REQUESTS_JITTER', default=100, cast=int)
+
+timeout = env('GUNICORN_TIMEOUT', default=60, cast=int)
+# Сколько секунд держать keep-alive соединение от nginx между запросами
+keepalive = env('GUNICORN_KEEPALIVE', default=5, cast=int)
+graceful_timeout = env('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+
+accesslog = env('GUNICORN_ACCESSLOG', default=None)
+errorlog = '-'
+loglevel = env('GUNICORN_LOGLEVEL', default='info')
+
@@ -0,0 +1,94 @@
+"""
+Сравнение профилей gunicorn (класс воркера, число процессов и потоков) одним
+и тем же нагрузочным тестом. Каждый профиль запускается с gunicorn.conf.py и
+переменными GUNICORN_*, после теста сервер останавливается.
+
+Запуск из каталога проекта (нужны SECRET_KEY, ALLOWED_HOSTS и база):
+    python scripts/benchmark_gunicorn.py --concurrency 50 --duration 20 \\
+        "/?source=db" "/search/?q=война"
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import run  # noqa: E402
+
+CPUS = multiprocessing.cpu_count()
+
+# Имя профиля: переменные окружения для gunicorn.conf.py
+PROFILES = {
+    # Прежний запуск: gunicorn без настроек — один синхронный воркер
+    'sync-1': {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_WORKERS': '1'},
+    'sync-2n+1': {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_WORKERS': str(2 * CPUS + 1)},
+    'gthread-n+1x4': {
+        'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_WORKERS': str(CPUS + 1), 'GUNICORN_THREADS': '4',
+    },
+    'uvicorn-n+1': {
+        'GUNICORN_WORKER_CLASS': 'uvicorn.workers.UvicornWorker', 'GUNICORN_WORKERS': str(CPUS + 1),
+        'BOOKS_DB_CONN_MAX_AGE': '0',
+        'APP': 'book_project.asgi:application',
+    },
+}
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def run_profile(name, paths, port, concurrency, duration):
+    env = dict(os.environ, **PROFILES[name])
+    app = env.pop('APP', 'book_project.wsgi:application')
+    env['GUNICORN_BIND'] = f"127.0.0.1:{port}"
+    env['GUNICORN_LOGLEVEL'] = 'warning'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', app], env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_ready(base + paths[0]):
+            raise RuntimeError(f"{name}: сервер не ответил")
+        summary = run([base + path for path in paths], concurrency, duration)
+    finally:
+        server.terminate()
+        server.wait()
+    summary['profile'] = name
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение профилей gunicorn")
+    parser.add_argument('paths', nargs='*', default=['/?source=db', '/search/?q=война'],
+                        help="Пути, которые запрашиваются по кругу")
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                        help="Какие профили сравнивать (по умолчанию все)")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--json', action='store_true', help="Итог строками JSON")
+    args = parser.parse_args()
+
+    for name in args.profile or PROFILES:
+        summary = run_profile(name, args.paths, args.port, args.concurrency, args.duration)
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False))
+            continue
+        print(f"{name:<16} {summary['rps']:8.1f} запр/с  p50={summary.get('p50_ms')} мс  "
+              f"p99={summary.get('p99_ms')} мс  ошибок: {summary['errors']}, "
+              f"статусы: {summary['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Выигрыш от nginx: один и тот же нагрузочный тест напрямую в gunicorn и через
+nginx (микрокэш, gzip, keep-alive к gunicorn). Для каждого профиля —
+запросов в секунду, задержки, байт на ответ и доля ответов из микрокэша.
+
+Главную страницу nginx берёт из кэша только у клиентов с cookie csrftoken,
+поэтому она получается заранее одним запросом.
+
+Запуск в docker (сервисы web и nginx из docker-compose.yml):
+    docker compose -f docker-compose.yml -f docker-compose.loadtest.yml run --rm loadgen
+Или против уже запущенных серверов:
+    python scripts/benchmark_nginx.py --direct http://localhost:8000 --proxy http://localhost \\
+        --concurrency 50 --duration 20 "/?source=db" "/search/?q=война"
+"""
+import argparse
+import http.cookies
+import json
+import os
+import sys
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark_gunicorn import wait_ready  # noqa: E402
+from load_test import run  # noqa: E402
+
+# Имя профиля: (какой сервер, заголовки запроса)
+PROFILES = {
+    'direct': ('direct', {}),
+    'nginx': ('proxy', {}),
+    'nginx-gzip': ('proxy', {'Accept-Encoding': 'gzip'}),
+}
+
+# Значения X-Cache-Status, при которых ответ отдан без запроса к приложению
+# (REVALIDATED — приложение ответило 304, страница не строилась)
+CACHE_HITS = ('HIT', 'STALE', 'UPDATING', 'REVALIDATED')
+
+
+def csrf_cookie(base):
+    """Cookie csrftoken, которую ставит главная страница"""
+    response = urllib.request.urlopen(base + '/', timeout=10)
+    cookies = http.cookies.SimpleCookie()
+    for header in response.headers.get_all('Set-Cookie') or []:
+        cookies.load(header)
+    response.read()
+    if 'csrftoken' not in cookies:
+        return None
+    return f"csrftoken={cookies['csrftoken'].value}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение gunicorn напрямую и через nginx")
+    parser.add_argument('paths', nargs='*', default=['/?source=db', '/search/?q=война'],
+                        help="Пути, которые запрашиваются по кругу")
+    parser.add_argument('--direct', default='http://localhost:8000', help="Адрес gunicorn")
+    parser.add_argument('--proxy', default='http://localhost', help="Адрес nginx")
+    parser.add_argument('--profile', action='append', choices=list(PROFILES),
+                        help="Какие профили сравнивать (по умолчанию все)")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--json', action='store_true', help="Итог строками JSON")
+    args = parser.parse_args()
+
+    bases = {'direct': args.direct.rstrip('/'), 'proxy': args.proxy.rstrip('/')}
+    for base in bases.values():
+        if not wait_ready(base + args.paths[0], timeout=120):
+            raise SystemExit(f"{base}: сервер не ответил")
+    cookie = csrf_cookie(bases['direct'])
+
+    for name in args.profile or PROFILES:
+        server, headers = PROFILES[name]
+        headers = dict(headers, Cookie=cookie) if cookie else headers
+        summary = run([bases[server] + path for path in args.paths],
+                      args.concurrency, args.duration, headers)
+        summary['profile'] = name
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False))
+            continue
+        cache = summary.get('cache', {})
+        hits = sum(cache.get(status, 0) for status in CACHE_HITS)
+        hit_rate = f"{hits / summary['requests']:.0%}" if summary['requests'] and cache else '—'
+        print(f"{name:<12} {summary['rps']:8.1f} запр/с  p50={summary.get('p50_ms')} мс  "
+              f"p99={summary.get('p99_ms')} мс  {summary['bytes_per_request']} байт/ответ  "
+              f"из кэша: {hit_rate}  ошибок: {summary['errors']}, статусы: {summary['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Нагрузочный тест: N параллельных клиентов с keep-alive в течение заданного
+времени запрашивают указанные URL по кругу и считают пропускную способность.
+
+Запуск (сравнение WSGI и ASGI — один и тот же тест против двух профилей):
+    python scripts/load_test.py http://localhost:8000/?source=db \\
+        "http://localhost:8000/search/?q=война" --concurrency 50 --duration 30
+
+В итоге — и байты ответов (как пришли, то есть сжатыми, если задан
+Accept-Encoding), и ответы микрокэша nginx по заголовку X-Cache-Status.
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def client(urls, deadline, headers, results, lock):
+    """Один клиент: своё соединение, запросы подряд до deadline"""
+    connections = {}
+    timings, statuses, errors = [], {}, 0
+    cache, received = {}, 0
+    number = 0
+    while time.monotonic() < deadline:
+        url = urls[number % len(urls)]
+        number += 1
+        parts = urlsplit(url)
+        path = quote(parts.path + (f"?{parts.query}" if parts.query else ''), safe="/?=&%:+,;@")
+        conn = connections.get(parts.netloc)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            conn = connections[parts.netloc] = conn_class(parts.netloc, timeout=30)
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            received += len(response.read())
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            connections.pop(parts.netloc, None)
+            continue
+        timings.append(time.perf_counter() - started)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        cache_status = response.getheader('X-Cache-Status')
+        if cache_status:
+            cache[cache_status] = cache.get(cache_status, 0) + 1
+    for conn in connections.values():
+        conn.close()
+    with lock:
+        results['timings'].extend(timings)
+        results['errors'] += errors
+        results['bytes'] += received
+        for status, count in statuses.items():
+            results['statuses'][status] = results['statuses'].get(status, 0) + count
+        for status, count in cache.items():
+            results['cache'][status] = results['cache'].get(status, 0) + count
+
+
+def run(urls, concurrency, duration, headers=None):
+    """Возвращает сводку: запросов в секунду и задержки в мс"""
+    results = {'timings': [], 'errors': 0, 'statuses': {}, 'cache': {}, 'bytes': 0}
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [
+        threading.Thread(target=client, args=(urls, deadline, headers or {}, results, lock))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    timings = [t * 1000 for t in results['timings']]
+    summary = {
+        'concurrency': concurrency,
+        'duration': round(elapsed, 2),
+        'requests': len(timings),
+        'errors': results['errors'],
+        'statuses': results['statuses'],
+        'rps': round(len(timings) / elapsed, 1),
+        'bytes_per_request': round(results['bytes'] / len(timings)) if timings else 0,
+    }
+    if results['cache']:
+        summary['cache'] = results['cache']
+    if timings:
+        summary.update({
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'max_ms': round(max(timings), 2),
+        })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP-эндпоинтов")
+    parser.add_argument('urls', nargs='+', help="URL, которые запрашиваются по кругу")
+    parser.add_argument('--concurrency', type=int, default=20, help="Параллельных клиентов")
+    parser.add_argument('--duration', type=float, default=10, help="Длительность, с")
+    parser.add_argument('--header', action='append', default=[],
+                        help="Заголовок запроса 'Имя: значение' (можно несколько)")
+    parser.add_argument('--json', action='store_true', help="Вывести итог одной строкой JSON")
+    args = parser.parse_args()
+
+    headers = dict(header.split(':', 1) for header in args.header)
+    headers = {name.strip(): value.strip() for name, value in headers.items()}
+    summary = run(args.urls, args.concurrency, args.duration, headers)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False))
+        return
+    print(f"Клиентов: {summary['concurrency']}, время: {summary['duration']} с")
+    print(f"Запросов: {summary['requests']} ({summary['rps']} в секунду), "
+          f"ошибок соединения: {summary['errors']}, статусы: {summary['statuses']}")
+    if summary['requests']:
+        print(f"Задержка: p50={summary['p50_ms']} мс p95={summary['p95_ms']} мс "
+              f"p99={summary['p99_ms']} мс max={summary['max_ms']} мс")
+        print(f"Байт на ответ: {summary['bytes_per_request']}")
+    if 'cache' in summary:
+        print(f"Микрокэш nginx (X-Cache-Status): {summary['cache']}")
+
+
+if __name__ == '__main__':
+    main()